@@ -0,0 +1,240 @@
+"""
+Content-addressed store for savegame backups.
+
+Every version of a savegame is stored once, under the SHA-256 of its bytes and compressed with zlib, in a folder
+outside of the game's save directory. Backing up bytes that are identical to the latest backup doesn't write anything.
+Optionally a version is stored as a binary delta against the previous one, with a full copy every `keyframe_interval`
+versions so that restoring never has to replay a long chain of deltas.
+
+Layout of the store, per campaign:
+
+    <root>/<campaign>/index.json        history of backups and the storage info of every object
+    <root>/<campaign>/objects/<hash>    the compressed full copy or delta of one version
+"""
+import hashlib
+import json
+import os
+import struct
+import zlib
+from datetime import datetime, timedelta
+
+from patch_buffer import changed_region
+
+DEFAULT_BACKUP_DIR = os.path.join(os.path.expanduser("~"), ".gloomhaven-savegame-editor", "backups")
+
+_BLOCK_SIZE = 1024
+
+
+def make_delta(base, target):
+    """
+    Encode `target` as copies from `base` and literal bytes: the common prefix and suffix are copied, and when the
+    parts in between have the same length (e.g. after fixed-width edits) they are compared block by block.
+    :return: list of ("copy", offset, length) and ("insert", bytes) operations
+    """
+    region = changed_region(base, target)
+    if region is None:
+        return [("copy", 0, len(base))] if base else []
+    prefix, base_end, _ = region
+    suffix = len(base) - base_end
+
+    ops = [("copy", 0, prefix)] if prefix else []
+    base_middle = (prefix, len(base) - suffix)
+    target_middle = (prefix, len(target) - suffix)
+    if base_middle[1] - base_middle[0] == target_middle[1] - target_middle[0]:
+        for offset in range(target_middle[0], target_middle[1], _BLOCK_SIZE):
+            end = min(offset + _BLOCK_SIZE, target_middle[1])
+            if base[offset:end] == target[offset:end]:
+                if ops and ops[-1][0] == "copy" and ops[-1][1] + ops[-1][2] == offset:
+                    ops[-1] = ("copy", ops[-1][1], ops[-1][2] + end - offset)
+                else:
+                    ops.append(("copy", offset, end - offset))
+            else:
+                ops.append(("insert", bytes(target[offset:end])))
+    elif target_middle[1] > target_middle[0]:
+        ops.append(("insert", bytes(target[target_middle[0] : target_middle[1]])))
+    if suffix:
+        ops.append(("copy", len(base) - suffix, suffix))
+    return ops
+
+
+def apply_delta(base, ops):
+    out = bytearray()
+    for op in ops:
+        if op[0] == "copy":
+            out += base[op[1] : op[1] + op[2]]
+        else:
+            out += op[1]
+    return bytes(out)
+
+
+def _encode_delta(ops):
+    out = bytearray()
+    for op in ops:
+        if op[0] == "copy":
+            out += b"c" + struct.pack("<II", op[1], op[2])
+        else:
+            out += b"i" + struct.pack("<I", len(op[1])) + op[1]
+    return bytes(out)
+
+
+def _decode_delta(data):
+    ops, pos = [], 0
+    while pos < len(data):
+        if data[pos : pos + 1] == b"c":
+            ops.append(("copy",) + struct.unpack_from("<II", data, pos + 1))
+            pos += 9
+        else:
+            (length,) = struct.unpack_from("<I", data, pos + 1)
+            ops.append(("insert", data[pos + 5 : pos + 5 + length]))
+            pos += 5 + length
+    return ops
+
+
+class BackupStore:
+    def __init__(self, root=None, deltas=False, keyframe_interval=10, keep_last=None, max_age_days=None):
+        """
+        :param root: folder of the store, by default ~/.gloomhaven-savegame-editor/backups
+        :param deltas: store new versions as a delta against the latest backup where that is smaller
+        :param keyframe_interval: maximum number of deltas in a row before a full copy is stored again
+        :param keep_last: retention policy; keep at most this many backups per campaign
+        :param max_age_days: retention policy; drop backups older than this, but always keep the latest one
+        """
+        self.root = root or DEFAULT_BACKUP_DIR
+        self.deltas = deltas
+        self.keyframe_interval = keyframe_interval
+        self.keep_last = keep_last
+        self.max_age_days = max_age_days
+
+    def _campaign_dir(self, campaign):
+        return os.path.join(self.root, campaign)
+
+    def _object_path(self, campaign, object_hash):
+        return os.path.join(self._campaign_dir(campaign), "objects", object_hash)
+
+    def _load_index(self, campaign):
+        path = os.path.join(self._campaign_dir(campaign), "index.json")
+        if not os.path.exists(path):
+            return {"history": [], "objects": {}}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_index(self, campaign, index):
+        path = os.path.join(self._campaign_dir(campaign), "index.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(f"{path}.tmp", path)
+
+    def _write_object(self, campaign, object_hash, payload):
+        path = self._object_path(campaign, object_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(zlib.compress(payload))
+        os.replace(f"{path}.tmp", path)
+
+    def _chain_length(self, index, object_hash):
+        length = 0
+        while index["objects"][object_hash]["base"] is not None:
+            object_hash = index["objects"][object_hash]["base"]
+            length += 1
+        return length
+
+    def backup(self, campaign, data, note=None):
+        """
+        Back up a version of a savegame, unless it's identical to the latest backup of the campaign.
+        :return: the backup id (SHA-256 of the savegame)
+        """
+        index = self._load_index(campaign)
+        object_hash = hashlib.sha256(data).hexdigest()
+        history = index["history"]
+        if history and history[-1]["id"] == object_hash:
+            return object_hash
+
+        if object_hash not in index["objects"]:
+            payload, base = bytes(data), None
+            if self.deltas and history:
+                latest = history[-1]["id"]
+                if self._chain_length(index, latest) + 1 < self.keyframe_interval:
+                    delta = _encode_delta(make_delta(self.restore(campaign, latest, index=index), data))
+                    if len(delta) < len(payload):
+                        payload, base = delta, latest
+            self._write_object(campaign, object_hash, payload)
+            index["objects"][object_hash] = {"base": base, "size": len(data)}
+        history.append({"id": object_hash, "time": datetime.now().isoformat(timespec="seconds"), "note": note})
+        self._apply_retention(campaign, index)
+        self._save_index(campaign, index)
+        return object_hash
+
+    def list_campaigns(self):
+        """
+        :return: sorted names of the campaigns that have backups in the store
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self._campaign_dir(name), "index.json"))
+        )
+
+    def list_backups(self, campaign):
+        """
+        :return: list of dicts with the "id", "time" and "note" of every backup, oldest first
+        """
+        return list(self._load_index(campaign)["history"])
+
+    def _resolve(self, index, backup_id):
+        if backup_id in index["objects"]:
+            return backup_id
+        matches = [h for h in index["objects"] if h.startswith(backup_id)]
+        if len(matches) != 1:
+            raise Exception(f"Backup '{backup_id}' {'is ambiguous' if matches else 'was not found'}!")
+        return matches[0]
+
+    def restore(self, campaign, backup_id, index=None):
+        """
+        Get the bytes of a backup.
+        :param backup_id: the backup id, or an unambiguous prefix of it
+        """
+        index = index or self._load_index(campaign)
+        object_hash = self._resolve(index, backup_id)
+        chain = []
+        while object_hash is not None:
+            chain.append(object_hash)
+            object_hash = index["objects"][object_hash]["base"]
+        with open(self._object_path(campaign, chain[-1]), "rb") as f:
+            data = zlib.decompress(f.read())
+        for object_hash in reversed(chain[:-1]):
+            with open(self._object_path(campaign, object_hash), "rb") as f:
+                data = apply_delta(data, _decode_delta(zlib.decompress(f.read())))
+        return data
+
+    def _apply_retention(self, campaign, index):
+        history = index["history"]
+        keep = history
+        if self.max_age_days is not None:
+            cutoff = (datetime.now() - timedelta(days=self.max_age_days)).isoformat(timespec="seconds")
+            keep = [entry for entry in keep[:-1] if entry["time"] >= cutoff] + keep[-1:]
+        if self.keep_last is not None:
+            keep = keep[-self.keep_last :]
+        if len(keep) == len(history):
+            return
+        index["history"] = keep
+
+        kept_hashes = {entry["id"] for entry in keep}
+        # Turn kept deltas whose base isn't kept into full copies, so that the base can be dropped
+        for object_hash in sorted(kept_hashes, key=lambda h: self._chain_length(index, h)):
+            base = index["objects"][object_hash]["base"]
+            if base is not None and base not in kept_hashes:
+                data = self.restore(campaign, object_hash, index=index)
+                self._write_object(campaign, object_hash, data)
+                index["objects"][object_hash]["base"] = None
+        # Objects that kept backups still need, either directly or as the base of a delta
+        needed = set()
+        for object_hash in kept_hashes:
+            while object_hash is not None and object_hash not in needed:
+                needed.add(object_hash)
+                object_hash = index["objects"][object_hash]["base"]
+        for object_hash in list(index["objects"]):
+            if object_hash not in needed:
+                del index["objects"][object_hash]
+                os.remove(self._object_path(campaign, object_hash))
@@ -0,0 +1,147 @@
+"""
+Run the same task over every campaign in a GloomSaves/Campaign folder, using a pool of processes.
+
+    python batch.py "<...>/GloomSaves/Campaign" report
+    python batch.py "<...>/GloomSaves/Campaign" apply unlock_scenario_90.json --dry-run
+
+From Python, `run_batch` takes any picklable function that receives a SaveGameEditor, e.g.
+
+    def fix_pq_deck(editor):
+        editor.remove_personal_quests(["Greed_is_Good"])
+        editor.save_savegame()
+
+    run_batch(root_dir, fix_pq_deck)
+
+Tasks that only read, like `campaign_report`, should pass `read_only=True`, so that no backup is made.
+"""
+import argparse
+import contextlib
+import dataclasses
+import glob
+import io
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from backup_store import BackupStore
+from savegame_editor import SaveGameEditor
+
+
+def find_campaigns(root_dir, ext=".dat"):
+    """
+    Find every campaign in `root_dir`, i.e. every Campaign_*/Campaign_*.dat savegame whose name matches its folder
+    :return: sorted list of campaign names
+    """
+    campaigns = []
+    for path in glob.glob(os.path.join(glob.escape(root_dir), "Campaign_*", f"Campaign_*{ext}")):
+        folder = os.path.basename(os.path.dirname(path))
+        if os.path.basename(path) == f"{folder}{ext}":
+            campaigns.append(folder)
+    return sorted(campaigns)
+
+
+def campaign_report(editor):
+    """Collect the campaign values, characters, scenario states and looted chests of a campaign."""
+    report = dataclasses.asdict(editor.get_campaign_values())
+    report["characters"] = editor.get_characters()
+    report["scenarios"] = editor.get_scenario_states()
+    report["looted_chests"] = sorted(editor.get_looted_chests())
+    return report
+
+
+def apply_manifest(editor, manifest, dry_run=False):
+    """Apply a sync manifest to a campaign, see `SaveGameEditor.apply_manifest`."""
+    plan = editor.apply_manifest(manifest, dry_run=dry_run, verbose=False)
+    return [patch["description"] for patch in plan]
+
+
+def _run_task(root_dir, campaign, task, task_kwargs, ext, read_only, backup_store):
+    start = time.perf_counter()
+    output = io.StringIO()
+    result, error = None, None
+    try:
+        with contextlib.redirect_stdout(output):
+            editor = SaveGameEditor(
+                ext=ext, root_dir=root_dir, campaign=campaign, read_only=read_only, backup_store=backup_store
+            )
+            result = task(editor, **task_kwargs)
+    except Exception:
+        error = traceback.format_exc()
+    return {
+        "campaign": campaign,
+        "result": result,
+        "error": error,
+        "output": output.getvalue(),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def run_batch(
+    root_dir, task, campaigns=None, processes=None, ext=".dat", read_only=False, backup_store=None, **task_kwargs
+):
+    """
+    Run `task(editor, **task_kwargs)` for every campaign in `root_dir`, in parallel.
+    A failing campaign doesn't stop the others; its traceback ends up in its result instead.
+    :param root_dir: folder that contains the campaign folders
+    :param task: picklable (module-level) function that receives a SaveGameEditor for the campaign
+    :param campaigns: names of the campaigns to process, or None for all campaigns found by `find_campaigns`
+    :param processes: number of worker processes, or None for one per CPU
+    :param read_only: open the campaigns read-only, for tasks that don't edit them; no backups are made
+    :param backup_store: BackupStore that the campaigns are backed up to when they are opened, or None for the default
+    :return: dict mapping every campaign name to a dict with its "result", "error" (None or the traceback),
+        everything it printed ("output") and the wall time it took ("seconds")
+    """
+    if campaigns is None:
+        campaigns = find_campaigns(root_dir, ext=ext)
+    if not campaigns:
+        return {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(_run_task, root_dir, campaign, task, task_kwargs, ext, read_only, backup_store)
+            for campaign in campaigns
+        ]
+        results = [future.result() for future in futures]
+    return {result["campaign"]: result for result in results}
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--campaigns", nargs="*", help="only process these campaigns")
+    common.add_argument("--processes", type=int, help="number of worker processes (default: one per CPU)")
+    parser = argparse.ArgumentParser(description="Process every campaign in a GloomSaves/Campaign folder in parallel.")
+    parser.add_argument("root_dir", help="folder that contains the campaign folders")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("report", parents=[common], help="report the state of every campaign")
+    apply_parser = subparsers.add_parser("apply", parents=[common], help="apply a sync manifest to every campaign")
+    apply_parser.add_argument("manifest", help="path to the manifest, see SaveGameEditor.plan_manifest")
+    apply_parser.add_argument("--dry-run", action="store_true", help="only list the changes, don't save anything")
+    apply_parser.add_argument(
+        "--backup-dir", help="folder to back up the savegames to (default: ~/.gloomhaven-savegame-editor/backups)"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "report":
+        results = run_batch(
+            args.root_dir, campaign_report, campaigns=args.campaigns, processes=args.processes, read_only=True
+        )
+    else:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+        results = run_batch(
+            args.root_dir,
+            apply_manifest,
+            campaigns=args.campaigns,
+            processes=args.processes,
+            read_only=args.dry_run,
+            backup_store=BackupStore(args.backup_dir),
+            manifest=manifest,
+            dry_run=args.dry_run,
+        )
+    print(json.dumps(results, indent=2))
+    return 1 if any(result["error"] for result in results.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
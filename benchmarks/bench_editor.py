@@ -0,0 +1,96 @@
+"""
+Benchmarks of the main SaveGameEditor operations on synthetic campaigns, see conftest.py for the regression gates.
+
+    python -m pytest benchmarks
+"""
+import contextlib
+import io
+
+from backup_store import BackupStore
+from conftest import CAMPAIGN
+from savegame_editor import SaveGameEditor
+
+ROUNDS = 5
+
+
+def _quiet(operation, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return operation(*args)
+
+
+def _benchmark_edit(benchmark, open_editor, check_peak_memory, name, operation):
+    """Time `operation(editor)` on a freshly opened and indexed campaign in every round, then gate its peak memory."""
+    benchmark.pedantic(
+        lambda editor: _quiet(operation, editor), setup=lambda: ((open_editor(),), {}), rounds=ROUNDS, iterations=1
+    )
+    editor = open_editor()
+    check_peak_memory(name, lambda: operation(editor))
+
+
+def test_construct(benchmark, open_editor, check_peak_memory):
+    def construct(editor):
+        return SaveGameEditor(root_dir=editor.root_dir, campaign=CAMPAIGN, backup_store=editor.backup_store)
+
+    _benchmark_edit(benchmark, lambda: open_editor(index=False), check_peak_memory, "construct", construct)
+
+
+def test_construct_and_index(benchmark, open_editor, check_peak_memory, tmp_path):
+    def construct_and_index(editor):
+        # A new backup store every time, so that the backup isn't skipped as a duplicate
+        new_editor = SaveGameEditor(
+            root_dir=editor.root_dir, campaign=CAMPAIGN, backup_store=BackupStore(str(tmp_path / str(id(editor))))
+        )
+        return new_editor.index
+
+    benchmark.pedantic(
+        lambda editor: _quiet(construct_and_index, editor),
+        setup=lambda: ((open_editor(index=False),), {}),
+        rounds=ROUNDS,
+        iterations=1,
+    )
+    editor = open_editor(index=False)
+    check_peak_memory("construct_and_index", lambda: construct_and_index(editor))
+
+
+def test_update_char_values(benchmark, open_editor, check_peak_memory):
+    def update_char_values(editor):
+        editor.update_char_values(char_name="Character 001", gold=120, exp=250, perk_points=1, perk_checks=2)
+
+    _benchmark_edit(benchmark, open_editor, check_peak_memory, "update_char_values", update_char_values)
+
+
+def test_toggle_scenario_status(benchmark, open_editor, check_peak_memory):
+    def toggle_scenario_status(editor):
+        editor.toggle_scenario_status(scenario=90, status="Unlocked")
+
+    _benchmark_edit(benchmark, open_editor, check_peak_memory, "toggle_scenario_status", toggle_scenario_status)
+
+
+def test_replace_events(benchmark, open_editor, check_peak_memory):
+    def replace_events(editor):
+        editor.replace_events(event="city", new_events=[18, 3, 57, 41, 26, 71, 37, 27, 29, 21, 10, 31, 25, 2, 13, 1])
+
+    _benchmark_edit(benchmark, open_editor, check_peak_memory, "replace_events", replace_events)
+
+
+def test_prioritise_personal_quests(benchmark, open_editor, check_peak_memory):
+    def prioritise_personal_quests(editor):
+        editor.prioritise_personal_quests(["Goliath_Toppler", "Implement_of_Light"])
+
+    _benchmark_edit(
+        benchmark, open_editor, check_peak_memory, "prioritise_personal_quests", prioritise_personal_quests
+    )
+
+
+def test_toggle_chests(benchmark, open_editor, check_peak_memory):
+    def toggle_chests(editor):
+        editor.toggle_chests(looted=[1, 7, 9, 10, 17, 21, 32, 38, 39, 41, 46, 50, 51, 63, 67, 69, 70, 5, 8, 20, 24])
+
+    _benchmark_edit(benchmark, open_editor, check_peak_memory, "toggle_chests", toggle_chests)
+
+
+def test_save_savegame(benchmark, open_editor, check_peak_memory):
+    def save_savegame(editor):
+        editor.save_savegame(force=True)
+
+    _benchmark_edit(benchmark, open_editor, check_peak_memory, "save_savegame", save_savegame)
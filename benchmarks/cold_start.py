@@ -0,0 +1,79 @@
+"""
+Measure the cold start of a headless script, i.e. the wall time of a fresh Python process that imports the editor and,
+given a campaign, opens it and bumps the prosperity by one.
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --root-dir "<...>/GloomSaves/Campaign" --campaign <campaign folder> --max-ms 300
+
+The campaign is copied to a temporary folder first, so the real savegame and its backups are left alone. Prints the
+median and best times in milliseconds as JSON; with --max-ms it exits with 1 when the median is slower than that.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = "import savegame_editor"
+
+EDIT_SCRIPT = """
+import struct, sys
+from backup_store import BackupStore
+from savegame_editor import SaveGameEditor
+
+editor = SaveGameEditor(root_dir=sys.argv[1], campaign=sys.argv[2], backup_store=BackupStore(sys.argv[3]))
+span = editor._get_campaign_value_spans()["prosperity"]
+prosperity = struct.unpack("<I", editor.buffer.read(*span))[0]
+editor.update_campaign_values(prosperity=prosperity + 1)
+editor.save_savegame()
+"""
+
+
+def time_process(args, repeat):
+    """:return: wall time in milliseconds of every run of `python <args>`"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=REPO_DIR, check=True, stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold start of the savegame editor.")
+    parser.add_argument("--root-dir", help="folder that contains the campaign folder")
+    parser.add_argument("--campaign", help="campaign to open and edit; without it only the import is measured")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, help="fail when the median cold start is slower than this")
+    args = parser.parse_args(argv)
+
+    results = {"interpreter": time_process(["-c", "pass"], args.repeat)}
+    results["import"] = time_process(["-c", IMPORT_SCRIPT], args.repeat)
+    if args.campaign:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shutil.copytree(os.path.join(args.root_dir, args.campaign), os.path.join(tmp_dir, args.campaign))
+            backup_dir = os.path.join(tmp_dir, "backups")
+            results["open_and_edit"] = time_process(
+                ["-c", EDIT_SCRIPT, tmp_dir, args.campaign, backup_dir], args.repeat
+            )
+
+    report = {
+        name: {"median_ms": round(statistics.median(times), 1), "best_ms": round(min(times), 1)}
+        for name, times in results.items()
+    }
+    print(json.dumps(report, indent=2))
+    slowest = list(report.values())[-1]["median_ms"]
+    if args.max_ms is not None and slowest > args.max_ms:
+        print(f"Cold start of {slowest} ms is slower than {args.max_ms} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
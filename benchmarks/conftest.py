@@ -0,0 +1,101 @@
+"""
+Fixtures for the benchmark suite: synthetic campaigns of a few sizes, and a peak memory gate.
+
+Time regressions are caught by pytest-benchmark: save a baseline once and compare every later run against it, e.g.
+
+    python -m pytest benchmarks --benchmark-save=baseline
+    python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=median:25%
+
+Peak memory is measured with tracemalloc for one run of every operation and has to stay below `MEMORY_BUDGETS`, a
+multiple of the size of the savegame, so it is checked on every run without a baseline.
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tracemalloc
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backup_store import BackupStore  # noqa: E402
+from savegame_editor import SaveGameEditor  # noqa: E402
+from synthetic_savegame import write_campaign  # noqa: E402
+
+CAMPAIGN = "Campaign_Synthetic"
+
+SAVEGAME_SIZES = {
+    "campaign": {},
+    "stress": {"party_size": 4, "n_scenarios": 95, "filler_objects": 20000},
+}
+
+# Peak memory allowed per operation, as a multiple of the size of the savegame
+MEMORY_BUDGETS = {
+    "construct": 4,
+    "construct_and_index": 40,
+    "update_char_values": 1,
+    "toggle_scenario_status": 1,
+    "replace_events": 4,
+    "prioritise_personal_quests": 1,
+    "toggle_chests": 10,
+    "save_savegame": 1,
+}
+
+
+@pytest.fixture(scope="session", params=list(SAVEGAME_SIZES))
+def template_dir(request, tmp_path_factory):
+    """A folder with one synthetic campaign, generated once per size."""
+    root_dir = tmp_path_factory.mktemp(request.param)
+    write_campaign(str(root_dir), CAMPAIGN, **SAVEGAME_SIZES[request.param])
+    return root_dir
+
+
+@pytest.fixture
+def open_editor(template_dir, tmp_path):
+    """
+    :return: function that copies the template campaign to a fresh folder and opens it, so that every benchmark
+        round edits an untouched savegame
+    """
+    rounds = []
+
+    def _open_editor(index=True):
+        root_dir = tmp_path / f"round{len(rounds)}"
+        rounds.append(root_dir)
+        shutil.copytree(template_dir / CAMPAIGN, root_dir / CAMPAIGN)
+        with contextlib.redirect_stdout(io.StringIO()):
+            editor = SaveGameEditor(root_dir=str(root_dir), campaign=CAMPAIGN, backup_store=BackupStore(str(tmp_path)))
+        if index:
+            editor.index
+        return editor
+
+    return _open_editor
+
+
+@pytest.fixture
+def savegame_size(template_dir):
+    return os.path.getsize(template_dir / CAMPAIGN / f"{CAMPAIGN}.dat")
+
+
+@pytest.fixture
+def check_peak_memory(savegame_size):
+    """
+    :return: function that runs `operation()` once under tracemalloc and fails the test when its peak memory exceeds
+        the budget of `name`
+    """
+
+    def _check_peak_memory(name, operation):
+        with contextlib.redirect_stdout(io.StringIO()):
+            tracemalloc.start()
+            try:
+                operation()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        budget = MEMORY_BUDGETS[name] * savegame_size
+        assert peak <= budget, f"{name} peaked at {peak:,} bytes, over its budget of {budget:,} bytes"
+        return peak
+
+    return _check_peak_memory
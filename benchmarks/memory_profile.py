@@ -0,0 +1,85 @@
+"""
+Measure the peak RSS of holding one campaign in memory: a fresh Python process per model, so the numbers don't mix.
+
+    python benchmarks/memory_profile.py
+    python benchmarks/memory_profile.py --savegame "<...>/GloomSaves/Campaign/<campaign>/<campaign>.dat"
+
+Without --savegame, synthetic campaigns of a few sizes are generated first. The models are
+* "bytes": only the savegame bytes, the baseline every model pays
+* "records": the savegame plus its RecordIndex (what the editor holds once a feature needed the index)
+* "dict": the nested dicts and lists of netfleece that the editor used to keep, if netfleece is installed
+Prints the peak RSS in MB per model and savegame as JSON, as well as the RSS on top of the baseline as a multiple of
+the savegame size.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_savegame import write_campaign  # noqa: E402
+
+SIZES = {"campaign": {}, "stress": {"filler_objects": 20000}, "huge": {"filler_objects": 200000}}
+
+MODEL_SCRIPTS = {
+    "bytes": "data = open(sys.argv[1], 'rb').read()",
+    "records": "from nrbf import RecordIndex\ndata = open(sys.argv[1], 'rb').read()\nindex = RecordIndex(data)",
+    "dict": "import netfleece\ndata = open(sys.argv[1], 'rb').read()\nparsed = netfleece.parseloop(__import__('io')"
+    ".BytesIO(data), decode=True, expand=True, backfill=True, crunch=True, root=True)",
+}
+
+REPORT = """
+import resource
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(peak * (1 if sys.platform == "darwin" else 1024))
+"""
+
+
+def peak_rss(model, savegame):
+    """:return: peak RSS in bytes of a process that loads `savegame` into `model`, or None if that failed"""
+    script = f"import sys\n{MODEL_SCRIPTS[model]}\n{REPORT}"
+    result = subprocess.run(
+        [sys.executable, "-c", script, savegame], cwd=REPO_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    return int(result.stdout.strip().splitlines()[-1])
+
+
+def profile(savegame):
+    size = os.path.getsize(savegame)
+    baseline = peak_rss("bytes", savegame)
+    report = {"savegame_mb": round(size / 2**20, 2), "bytes_mb": round(baseline / 2**20, 1)}
+    for model in ("records", "dict"):
+        peak = peak_rss(model, savegame)
+        if peak is None:
+            report[f"{model}_mb"] = None
+            continue
+        report[f"{model}_mb"] = round(peak / 2**20, 1)
+        report[f"{model}_x_savegame"] = round((peak - baseline) / size, 1)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the peak RSS of a campaign per in-memory model.")
+    parser.add_argument("--savegame", help="savegame to measure instead of synthetic ones")
+    args = parser.parse_args(argv)
+
+    if args.savegame:
+        results = {os.path.basename(args.savegame): profile(args.savegame)}
+    else:
+        results = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name, options in SIZES.items():
+                root_dir = os.path.join(tmp_dir, name)
+                write_campaign(root_dir, "Campaign_Synthetic", **options)
+                results[name] = profile(os.path.join(root_dir, "Campaign_Synthetic", "Campaign_Synthetic.dat"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
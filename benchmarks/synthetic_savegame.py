@@ -0,0 +1,386 @@
+"""
+Generate synthetic Gloomhaven Digital campaign savegames.
+
+The generated files are valid MS-NRBF (BinaryFormatter) streams laid out the way the editor expects a real campaign
+save to be laid out: a party with characters, quest states, city/road event decks with their discard piles, a personal
+quest deck and a list of already looted chests. Use `filler_objects` to blow the file up to stress-test sizes.
+
+    python benchmarks/synthetic_savegame.py <root_dir> --party-size 4 --scenarios 95 --filler-objects 100000
+"""
+import argparse
+import os
+import random
+import struct
+
+LIBRARY = "Assembly-CSharp, Version=0.0.0.0, Culture=neutral, PublicKeyToken=null"
+MSCORLIB = "mscorlib, Version=4.0.0.0, Culture=neutral, PublicKeyToken=b77a5c561934e089"
+STRING_LIST = f"System.Collections.Generic.List`1[[System.String, {MSCORLIB}]]"
+CHARACTER_CLASS = "MapRuleLibrary.Party.CMapCharacter"
+QUEST_CLASS = "MapRuleLibrary.State.CQuestState"
+LOG_CLASS = "MapRuleLibrary.State.CMapLogEntry"
+
+CHARACTER_CLASSES = ["Brute", "Tinkerer", "Spellweaver", "Scoundrel", "Cragheart", "Mindthief", "Sunkeeper", "Berserker"]
+PERSONAL_QUESTS = [
+    "Seeker_of_Xorn", "Merchant_Class", "Greed_is_Good", "Trophy_Hunt", "Fall_of_Man", "Augmented_Abilities",
+    "The_Thin_Places", "Vengeance", "Goliath_Toppler", "Finding_the_Cure", "Take_Back_the_Trees",
+    "The_Fall_of_Man", "Law_Bringer", "Pounds_of_Flesh", "Aberrant_Slayer", "Fear_of_the_Night",
+    "Zealot_of_the_Blood_God", "Implement_of_Light", "Elemental_Samples", "A_Study_of_Anatomy", "Wonder_of_Nature",
+    "Battle_Legacy", "Sinister_Sire", "Vengeance_Seeker",
+]
+SCENARIO_STATES = [1, 2, 4]
+
+# Bytes that the editor's byte-pattern locators treat as record separators (MemberReference, ObjectNull and
+# ObjectNullMultiple256). Object ids and values that are matched across by those patterns avoid them.
+_SEPARATORS = (9, 10, 13)
+
+
+def lps(s):
+    """Length-prefixed UTF-8 string as used throughout MS-NRBF."""
+    data = s.encode("utf-8")
+    n = len(data)
+    prefix = b""
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            prefix += bytes([byte | 0x80])
+        else:
+            prefix += bytes([byte])
+            return prefix + data
+
+
+def i32(v):
+    return struct.pack("<i", v)
+
+
+def _clean_int(v):
+    return not any(b in _SEPARATORS for b in struct.pack("<i", v))
+
+
+def _clean_randrange(rng, start, stop):
+    value = rng.randrange(start, stop)
+    while not _clean_int(value):
+        value = rng.randrange(start, stop)
+    return value
+
+
+class _Writer:
+    def __init__(self):
+        self.out = bytearray()
+        self.next_id = 1
+        self.metadata = {}
+
+    def new_id(self):
+        while not _clean_int(self.next_id):
+            self.next_id += 1
+        object_id = self.next_id
+        self.next_id += 1
+        return object_id
+
+    def string(self, value, object_id=None):
+        object_id = object_id or self.new_id()
+        self.out += b"\x06" + i32(object_id) + lps(value)
+        return object_id
+
+    def reference(self, object_id):
+        self.out += b"\x09" + i32(object_id)
+
+    def nulls(self, n):
+        if n == 1:
+            self.out += b"\x0a"
+        elif 1 < n < 256:
+            self.out += b"\x0d" + bytes([n])
+        elif n >= 256:
+            self.out += b"\x0e" + i32(n)
+
+    def class_header(self, object_id, name, members, library=2):
+        """
+        Write a ClassWithMembersAndTypes the first time a class is seen and a ClassWithId afterwards.
+        :param members: list of (member name, binary type, additional info) tuples
+        """
+        if name in self.metadata:
+            self.out += b"\x01" + i32(object_id) + i32(self.metadata[name])
+            return
+        self.metadata[name] = object_id
+        system = library is None
+        self.out += (b"\x04" if system else b"\x05") + i32(object_id) + lps(name) + i32(len(members))
+        for member, _, _ in members:
+            self.out += lps(member)
+        self.out += bytes(binary_type for _, binary_type, _ in members)
+        for _, binary_type, info in members:
+            if binary_type in (0, 7):
+                self.out += bytes([info])
+            elif binary_type == 3:
+                self.out += lps(info)
+            elif binary_type == 4:
+                self.out += lps(info[0]) + i32(info[1])
+        if not system:
+            self.out += i32(library)
+
+    def string_list(self, list_id, items_id, size):
+        members = [("_items", 6, None), ("_size", 0, 8), ("_version", 0, 8)]
+        self.class_header(list_id, STRING_LIST, members, library=None)
+        self.reference(items_id)
+        self.out += i32(size) + i32(size)
+
+    def string_array(self, object_id, values, capacity=None):
+        capacity = max(len(values), capacity or 0)
+        self.out += b"\x11" + i32(object_id) + i32(capacity)
+        for value in values:
+            self.string(value)
+        self.nulls(capacity - len(values))
+
+
+def _next_power_of_2(x, min_power=2):
+    return max(2**min_power, 1 if x == 0 else 2 ** (x - 1).bit_length())
+
+
+def generate_savegame(
+    party_size=4,
+    n_scenarios=95,
+    n_city_events=30,
+    n_road_events=30,
+    n_city_discards=5,
+    n_road_discards=5,
+    n_personal_quests=24,
+    looted_chests=(1, 7, 9),
+    filler_objects=0,
+    seed=0,
+):
+    """
+    Build a synthetic campaign savegame.
+    :param party_size: number of characters in the party
+    :param n_scenarios: number of `Quest_Campaign_NNN` quest states
+    :param n_city_events: number of cards in the city event deck
+    :param n_road_events: number of cards in the road event deck
+    :param n_city_discards: number of cards in the city event discard pile
+    :param n_road_discards: number of cards in the road event discard pile
+    :param n_personal_quests: number of personal quests in the deck (at most 25)
+    :param looted_chests: chest numbers that have already been looted
+    :param filler_objects: number of extra log entry objects to pad the save with, for stress testing
+    :param seed: seed for the random values
+    :return: the savegame as bytes
+    """
+    rng = random.Random(seed)
+    w = _Writer()
+    ids = {
+        name: w.new_id()
+        for name in [
+            "state", "library", "party", "temple", "characters", "character_items", "quests", "quest_items", "rewards",
+            "city", "city_items", "city_discard", "city_discard_items", "road", "road_items", "road_discard",
+            "road_discard_items", "pq_wrapper", "pq", "pq_items", "chests", "chests_items", "log", "log_items",
+        ]
+    }
+    char_ids = [w.new_id() for _ in range(party_size)]
+    quest_ids = [w.new_id() for _ in range(n_scenarios)]
+    log_ids = [w.new_id() for _ in range(filler_objects)]
+
+    w.out += b"\x00" + i32(ids["state"]) + i32(-1) + i32(1) + i32(0)
+    w.out += b"\x0c" + i32(ids["library"]) + lps(LIBRARY)
+
+    w.class_header(
+        ids["state"],
+        "MapRuleLibrary.State.CMapState",
+        [
+            ("MapParty", 4, ("MapRuleLibrary.Party.CMapParty", 2)),
+            ("QuestStates", 3, f"System.Collections.Generic.List`1[[{QUEST_CLASS}, {LIBRARY}]]"),
+            ("CityEventDeck", 3, STRING_LIST),
+            ("CityEventDiscard", 3, STRING_LIST),
+            ("RoadEventDeck", 3, STRING_LIST),
+            ("RoadEventDiscard", 3, STRING_LIST),
+            ("TempleOfTheGreatOak", 4, ("MapRuleLibrary.Party.CTempleOfTheGreatOak", 2)),
+            ("MapLog", 3, f"System.Collections.Generic.List`1[[{LOG_CLASS}, {LIBRARY}]]"),
+            ("Seed", 0, 8),
+            ("SaveVersion", 1, None),
+        ],
+    )
+    for name in ["party", "quests", "city", "city_discard", "road", "road_discard", "temple", "log"]:
+        w.reference(ids[name])
+    w.out += i32(seed)
+    w.string("1.0.0")
+
+    w.class_header(
+        ids["party"],
+        "MapRuleLibrary.Party.CMapParty",
+        [
+            ("SelectedCharacters", 3, f"System.Collections.Generic.List`1[[{CHARACTER_CLASS}, {LIBRARY}]]"),
+            ("Prosperity", 0, 8),
+            ("Reputation", 0, 8),
+            ("PersonalQuestDeck", 4, ("MapRuleLibrary.Party.CPersonalQuestDeck", 2)),
+            ("AlreadyRewardedChestTreasureTableIDs", 3, STRING_LIST),
+            ("PartyName", 1, None),
+        ],
+    )
+    w.reference(ids["characters"])
+    w.out += i32(rng.choice([3, 5, 12, 18, 20])) + i32(rng.choice([-5, 0, 4, 7, 11]))
+    w.reference(ids["pq_wrapper"])
+    w.reference(ids["chests"])
+    w.string("The Synthetic Party")
+
+    w.class_header(ids["temple"], "MapRuleLibrary.Party.CTempleOfTheGreatOak", [("GoldDonated", 0, 8)])
+    w.out += i32(rng.choice([0, 50, 100, 230]))
+
+    # Characters
+    characters_class = f"System.Collections.Generic.List`1[[{CHARACTER_CLASS}, {LIBRARY}]]"
+    w.class_header(
+        ids["characters"],
+        characters_class,
+        [("_items", 4, (f"{CHARACTER_CLASS}[]", 2)), ("_size", 0, 8), ("_version", 0, 8)],
+        library=None,
+    )
+    w.reference(ids["character_items"])
+    w.out += i32(party_size) + i32(party_size)
+    capacity = _next_power_of_2(party_size)
+    w.out += b"\x07" + i32(ids["character_items"]) + b"\x00" + i32(1) + i32(capacity) + b"\x04"
+    w.out += lps(CHARACTER_CLASS) + i32(2)
+    for char_id in char_ids:
+        w.reference(char_id)
+    w.nulls(capacity - party_size)
+    for i, char_id in enumerate(char_ids):
+        w.class_header(
+            char_id,
+            CHARACTER_CLASS,
+            [
+                ("CharacterName", 1, None),
+                ("CharacterID", 1, None),
+                ("Gold", 0, 8),
+                ("EXP", 0, 8),
+                ("Level", 0, 8),
+                ("PerkPoints", 0, 8),
+                ("PerkChecks", 0, 8),
+                ("Donations", 0, 8),
+                ("PersonalQuest", 2, None),
+                ("RetirementQuest", 2, None),
+                ("OwnedItems", 7, 8),
+            ],
+        )
+        w.string(f"Character {i + 1:03d}")
+        w.string(f"{CHARACTER_CLASSES[i % len(CHARACTER_CLASSES)]}ID")
+        values = [_clean_randrange(rng, 11, 200), _clean_randrange(rng, 11, 500), rng.randrange(1, 9)]
+        values += [rng.randrange(0, 3), rng.randrange(0, 3), rng.randrange(0, 5) * 11]
+        w.out += b"".join(i32(v) for v in values)
+        w.nulls(1)
+        w.nulls(1)
+        items_id = w.new_id()
+        w.reference(items_id)
+        n_items = rng.randrange(1, 8)
+        w.out += b"\x0f" + i32(items_id) + i32(n_items) + b"\x08"
+        w.out += b"".join(i32(rng.randrange(1, 150)) for _ in range(n_items))
+
+    # Quest states
+    quests_class = f"System.Collections.Generic.List`1[[{QUEST_CLASS}, {LIBRARY}]]"
+    w.class_header(
+        ids["quests"],
+        quests_class,
+        [("_items", 4, (f"{QUEST_CLASS}[]", 2)), ("_size", 0, 8), ("_version", 0, 8)],
+        library=None,
+    )
+    w.reference(ids["quest_items"])
+    w.out += i32(n_scenarios) + i32(n_scenarios)
+    capacity = _next_power_of_2(n_scenarios)
+    w.out += b"\x07" + i32(ids["quest_items"]) + b"\x00" + i32(1) + i32(capacity) + b"\x04"
+    w.out += lps(QUEST_CLASS) + i32(2)
+    for quest_id in quest_ids:
+        w.reference(quest_id)
+    w.nulls(capacity - n_scenarios)
+    w.out += b"\x0f" + i32(ids["rewards"]) + i32(0) + b"\x08"
+    for i, quest_id in enumerate(quest_ids):
+        scenario = i + 1
+        w.class_header(
+            quest_id,
+            QUEST_CLASS,
+            [("ID", 1, None), ("QuestSequence", 0, 8), ("QuestState", 0, 8), ("RewardsTaken", 7, 8)],
+        )
+        w.string(f"Quest_Campaign_{scenario:03d}")
+        # Scenario 19 is the one quest whose sequence number collides with the MemberReference byte in real saves
+        w.out += i32(9 if scenario == 19 else 100 + scenario)
+        w.out += i32(1 if scenario > 60 else rng.choice(SCENARIO_STATES))
+        w.reference(ids["rewards"])
+
+    # Event decks, discard piles, personal quest deck and chests; their arrays are written back to back below
+    city_events = rng.sample(range(1, 82), n_city_events + n_city_discards)
+    road_events = rng.sample(range(1, 70), n_road_events + n_road_discards)
+    decks = [
+        ("city", [f"Event_City_Campaign_{n}ID" for n in city_events[:n_city_events]]),
+        ("city_discard", [f"Event_City_Campaign_{n}ID" for n in city_events[n_city_events:]]),
+        ("road", [f"Event_Road_Campaign_{n}ID" for n in road_events[:n_road_events]]),
+        ("road_discard", [f"Event_Road_Campaign_{n}ID" for n in road_events[n_road_events:]]),
+        ("pq", [f"PERSONALQUEST_{q}" for q in rng.sample(PERSONAL_QUESTS, min(n_personal_quests, 24))]),
+        ("chests", [f"TT_Campaign_Chest_{c:02d}" for c in sorted(looted_chests)]),
+    ]
+    w.class_header(ids["pq_wrapper"], "MapRuleLibrary.Party.CPersonalQuestDeck", [("m_Deck", 3, STRING_LIST)])
+    w.reference(ids["pq"])
+    for name, values in decks:
+        w.string_list(ids[name], ids[f"{name}_items"], len(values))
+    for name, values in decks:
+        capacity = 25 if name == "pq" else _next_power_of_2(len(values))
+        w.string_array(ids[f"{name}_items"], values, capacity)
+
+    # Filler log entries
+    log_class = f"System.Collections.Generic.List`1[[{LOG_CLASS}, {LIBRARY}]]"
+    w.class_header(
+        ids["log"], log_class, [("_items", 4, (f"{LOG_CLASS}[]", 2)), ("_size", 0, 8), ("_version", 0, 8)], library=None
+    )
+    w.reference(ids["log_items"])
+    w.out += i32(filler_objects) + i32(filler_objects)
+    capacity = _next_power_of_2(filler_objects)
+    w.out += b"\x07" + i32(ids["log_items"]) + b"\x00" + i32(1) + i32(capacity) + b"\x04"
+    w.out += lps(LOG_CLASS) + i32(2)
+    for log_id in log_ids:
+        w.reference(log_id)
+    w.nulls(capacity - filler_objects)
+    for i, log_id in enumerate(log_ids):
+        w.class_header(log_id, LOG_CLASS, [("Message", 1, None), ("Round", 0, 8), ("Value", 0, 6)])
+        w.string(f"Log entry {i}: {rng.choice(PERSONAL_QUESTS)}")
+        w.out += i32(rng.randrange(1, 1000)) + struct.pack("<d", rng.random())
+
+    w.out += b"\x0b"
+    return bytes(w.out)
+
+
+def write_campaign(root_dir, campaign="Campaign_Synthetic", ext=".dat", **kwargs):
+    """
+    Write a synthetic savegame into `root_dir` using the same folder layout as GloomSaves/Campaign.
+    :return: the path of the written savegame
+    """
+    os.makedirs(f"{root_dir}/{campaign}", exist_ok=True)
+    path = f"{root_dir}/{campaign}/{campaign}{ext}"
+    with open(path, "wb") as f:
+        f.write(generate_savegame(**kwargs))
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Gloomhaven Digital campaign savegame.")
+    parser.add_argument("root_dir")
+    parser.add_argument("--campaign", default="Campaign_Synthetic")
+    parser.add_argument("--party-size", type=int, default=4)
+    parser.add_argument("--scenarios", type=int, default=95)
+    parser.add_argument("--city-events", type=int, default=30)
+    parser.add_argument("--road-events", type=int, default=30)
+    parser.add_argument("--city-discards", type=int, default=5)
+    parser.add_argument("--road-discards", type=int, default=5)
+    parser.add_argument("--personal-quests", type=int, default=24)
+    parser.add_argument("--looted-chests", type=int, nargs="*", default=[1, 7, 9])
+    parser.add_argument("--filler-objects", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    path = write_campaign(
+        args.root_dir,
+        campaign=args.campaign,
+        party_size=args.party_size,
+        n_scenarios=args.scenarios,
+        n_city_events=args.city_events,
+        n_road_events=args.road_events,
+        n_city_discards=args.city_discards,
+        n_road_discards=args.road_discards,
+        n_personal_quests=args.personal_quests,
+        looted_chests=args.looted_chests,
+        filler_objects=args.filler_objects,
+        seed=args.seed,
+    )
+    print(f"Wrote {os.path.getsize(path):,} bytes to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Correctness checks of the editor and the backup store on synthetic savegames, run together with the benchmarks:
+
+    python -m pytest benchmarks
+"""
+import contextlib
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from backup_store import BackupStore, apply_delta, make_delta
+from conftest import CAMPAIGN, SAVEGAME_SIZES
+from nrbf import Record, RecordIndex, iter_records, read_records, write_records
+from savegame_editor import SaveGameEditor
+from synthetic_savegame import generate_savegame, write_campaign
+from watch import ManifestWatcher
+
+
+@pytest.fixture
+def editor(tmp_path):
+    write_campaign(str(tmp_path), CAMPAIGN)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return SaveGameEditor(root_dir=str(tmp_path), campaign=CAMPAIGN, backup_store=BackupStore(str(tmp_path / "b")))
+
+
+def _index_state(index):
+    """:return: the layout of every record in the index and the contents of its hash indexes, to compare two indexes"""
+
+    def value(v):
+        return ("record", v.start) if isinstance(v, Record) else v
+
+    records = [
+        (record.record_type, record.object_id, record.start, record.end, list(record.offsets or []))
+        + tuple(value(v) for v in record.values or [])
+        for record in iter_records(index.records)
+    ]
+    return (
+        records,
+        {object_id: record.start for object_id, record in index.objects.items()},
+        {name: [record.start for record in records] for name, records in index.members.items() if records},
+    )
+
+
+@pytest.mark.parametrize("size", list(SAVEGAME_SIZES))
+def test_write_records_round_trip(size):
+    data = generate_savegame(**SAVEGAME_SIZES[size])
+    assert bytes(write_records(read_records(data))) == data
+
+
+def test_index_is_updated_like_a_fresh_index(editor):
+    editor.index
+    edits = [
+        lambda: editor.replace_events("city", ["05", "11", "02"]),
+        lambda: editor.replace_events("road", ["03", "33", "40", "05", "31", "17", "28", "44", "12"]),
+        lambda: editor.toggle_chests(looted=[11, 12]),
+        lambda: editor.toggle_chests(looted=[3]),
+        lambda: editor.prioritise_personal_quests(["Law_Bringer", "Goliath_Toppler"]),
+    ]
+    for edit in edits:
+        with contextlib.redirect_stdout(io.StringIO()):
+            edit()
+        assert _index_state(editor.index) == _index_state(RecordIndex(bytes(editor.txt)))
+        assert editor.index.verify(editor.txt) == []
+
+
+def test_restore_backup_after_edit(editor):
+    original, backup_id = bytes(editor.txt), editor.backup_id
+    with contextlib.redirect_stdout(io.StringIO()):
+        editor.replace_events("city", ["05", "11", "02"])
+        editor.save_savegame()
+        editor.restore_backup(backup_id)
+    with open(editor.file, "rb") as f:
+        assert f.read() == original
+    assert editor.verify_savegame() == []
+    assert editor.get_event_deck("city").cards != ["05", "11", "02"]
+
+
+def test_fixed_width_edit_is_saved_without_indexing(editor):
+    with contextlib.redirect_stdout(io.StringIO()):
+        editor.update_campaign_values(prosperity=25)
+    assert editor.save_savegame()
+    assert editor._index is None
+    assert editor.get_campaign_values().prosperity == 25
+
+
+@pytest.mark.parametrize(
+    "edit",
+    [
+        lambda data: data[:100] + b"inserted" + data[100:],
+        lambda data: data[:5000] + b"Q" + data[5001:],
+        lambda data: data[:-7],
+        lambda data: b"ab" + data,
+        lambda data: data,
+        lambda data: b"",
+    ],
+)
+def test_make_delta_round_trip(edit):
+    base = generate_savegame(**SAVEGAME_SIZES["stress"])
+    target = edit(base)
+    assert apply_delta(base, make_delta(base, target)) == target
+    assert apply_delta(b"", make_delta(b"", target)) == target
+
+
+def _versions(n):
+    data = generate_savegame()
+    return [data[:1000] + bytes([i]) * (i + 1) + data[1000:] for i in range(n)]
+
+
+def test_backup_store_stores_deltas_with_full_copies_in_between(tmp_path):
+    store = BackupStore(str(tmp_path), deltas=True, keyframe_interval=3)
+    versions = _versions(7)
+    ids = [store.backup(CAMPAIGN, version) for version in versions]
+    objects = store._load_index(CAMPAIGN)["objects"]
+    assert [objects[backup_id]["base"] is None for backup_id in ids] == [True, False, False, True, False, False, True]
+    assert [store.restore(CAMPAIGN, backup_id) for backup_id in ids] == versions
+
+
+def test_backup_store_keep_last(tmp_path):
+    store = BackupStore(str(tmp_path), deltas=True, keyframe_interval=3, keep_last=3)
+    versions = _versions(6)
+    ids = [store.backup(CAMPAIGN, version) for version in versions]
+    assert [backup["id"] for backup in store.list_backups(CAMPAIGN)] == ids[-3:]
+    assert [store.restore(CAMPAIGN, backup_id) for backup_id in ids[-3:]] == versions[-3:]
+    assert sorted(os.listdir(tmp_path / CAMPAIGN / "objects")) == sorted(ids[-3:])
+
+
+def test_backup_store_max_age_days(tmp_path):
+    store = BackupStore(str(tmp_path), deltas=True, max_age_days=5)
+    versions = _versions(3)
+    ids = [store.backup(CAMPAIGN, version) for version in versions[:2]]
+    index = store._load_index(CAMPAIGN)
+    index["history"][0]["time"] = (datetime.now() - timedelta(days=10)).isoformat(timespec="seconds")
+    store._save_index(CAMPAIGN, index)
+    ids.append(store.backup(CAMPAIGN, versions[2]))
+    assert [backup["id"] for backup in store.list_backups(CAMPAIGN)] == ids[1:]
+    assert [store.restore(CAMPAIGN, backup_id) for backup_id in ids[1:]] == versions[1:]
+    with pytest.raises(Exception):
+        store.restore(CAMPAIGN, ids[0])
+
+
+def test_undo_and_redo_a_length_changing_edit(editor):
+    original = bytes(editor.txt)
+    with contextlib.redirect_stdout(io.StringIO()):
+        editor.replace_events("city", ["05", "11", "02"])
+    edited = bytes(editor.txt)
+    assert len(edited) != len(original)
+    assert editor.undo() == ["replace_events('city', ['05', '11', '02'])"]
+    assert bytes(editor.txt) == original
+    assert editor.index.verify(editor.txt) == []
+    assert _index_state(editor.index) == _index_state(RecordIndex(original))
+    editor.redo()
+    assert bytes(editor.txt) == edited
+    assert editor.index.verify(editor.txt) == []
+    assert editor.get_event_deck("city").cards == ["05", "11", "02"]
+
+
+def test_checkpoint(editor):
+    original = bytes(editor.txt)
+    editor.checkpoint("start")
+    with contextlib.redirect_stdout(io.StringIO()):
+        editor.update_campaign_values(prosperity=25)
+        editor.prioritise_personal_quests(["Law_Bringer"])
+    edited = bytes(editor.txt)
+    editor.checkpoint("edited")
+    assert len(editor.restore_checkpoint("start")) == 2
+    assert bytes(editor.txt) == original
+    editor.restore_checkpoint("edited")
+    assert bytes(editor.txt) == edited
+
+
+def test_new_edit_after_undo_drops_the_redo_steps(editor):
+    with contextlib.redirect_stdout(io.StringIO()):
+        editor.update_campaign_values(prosperity=25)
+        editor.update_campaign_values(prosperity=30)
+        editor.undo()
+        editor.update_campaign_values(reputation=3)
+    assert [step["applied"] for step in editor.history.steps()] == [True, True]
+    with pytest.raises(Exception):
+        editor.redo()
+    values = editor.get_campaign_values()
+    assert (values.prosperity, values.reputation) == (25, 3)
+
+
+def test_history_drops_the_oldest_steps(editor):
+    editor.history.max_steps = 3
+    with contextlib.redirect_stdout(io.StringIO()):
+        for prosperity in range(20, 25):
+            editor.update_campaign_values(prosperity=prosperity)
+    assert len(editor.history.steps()) == 3
+    editor.undo(3)
+    assert editor.get_campaign_values().prosperity == 21
+    with pytest.raises(Exception):
+        editor.undo()
+
+    editor.history.max_bytes = 1
+    with contextlib.redirect_stdout(io.StringIO()):
+        editor.replace_events("city", ["05", "11", "02"])
+        editor.replace_events("city", ["03", "04"])
+    # The latest step is always kept, even when it's over the limit on its own
+    assert len(editor.history.steps()) == 1
+    editor.undo()
+    assert editor.get_event_deck("city").cards == ["05", "11", "02"]
+
+
+def _reopen(editor):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return SaveGameEditor(root_dir=editor.root_dir, campaign=editor.campaign, backup_store=editor.backup_store)
+
+
+def test_update_characters(editor):
+    before = editor.get_characters()
+    assert len(before) == 4
+    results = editor.update_characters(
+        {"Character 001": {"gold": 91, "exp": 374}, "Character 003": {"perk_checks": 2}}, verbose=False
+    )
+    assert results["Character 001"]["gold"] == {"old": before["Character 001"]["gold"], "new": 91}
+    assert results["Character 001"]["exp"] == {"old": before["Character 001"]["exp"], "new": 374}
+    assert results["Character 003"]["perk_checks"] == {"old": before["Character 003"]["perk_checks"], "new": 2}
+    gold = before["Character 003"]["gold"]
+    assert results["Character 003"]["gold"] == {"old": gold, "new": gold}
+    editor.save_savegame()
+    after = _reopen(editor).get_characters(["Character 001", "Character 003", "Character 002"])
+    assert (after["Character 001"]["gold"], after["Character 001"]["exp"]) == (91, 374)
+    assert after["Character 003"]["perk_checks"] == 2
+    assert after["Character 002"] == before["Character 002"]
+
+
+def test_update_characters_rejects_unknown_names_before_writing(editor):
+    original = bytes(editor.txt)
+    with pytest.raises(Exception, match="Nobody"):
+        editor.update_characters({"Character 001": {"gold": 91}, "Nobody": {"gold": 1}}, verbose=False)
+    with pytest.raises(Exception, match="level"):
+        editor.update_characters({"Character 001": {"gold": 91, "level": 3}}, verbose=False)
+    assert bytes(editor.txt) == original
+    assert not editor.buffer.dirty
+
+
+
+def test_set_scenario_states(editor):
+    before = editor.get_scenario_states()
+    assert (before[1], before[2], before[7]) == ("Locked", "Completed", "Unlocked")
+    results = editor.set_scenario_states({1: "Unlocked", 7: "Blocked", 2: "Locked"}, verbose=False)
+    assert results == {
+        1: {"old": "Locked", "new": "Unlocked"},
+        7: {"old": "Unlocked", "new": "Blocked"},
+        # A completed scenario can't be changed
+        2: {"old": "Completed", "new": "Completed"},
+    }
+    with pytest.raises(Exception, match="Unknown scenario state"):
+        editor.set_scenario_states({3: "Done"}, verbose=False)
+    editor.save_savegame()
+    after = _reopen(editor).get_scenario_states()
+    assert (after[1], after[2], after[7]) == ("Unlocked", "Completed", "Blocked")
+    assert {number: state for number, state in after.items() if number not in (1, 7)} == {
+        number: state for number, state in before.items() if number not in (1, 7)
+    }
+
+
+MANIFEST = {
+    "GoldDonations": 230,
+    "Prosperity": 20,
+    "Reputation": 5,
+    "CityEvents": [18, 3, 57, 41],
+    "RoadEvents": [3, 33, 40, 5, 31],
+    "LootedChests": [1, 7, 9, 17],
+    "Characters": [{"Name": "Character 001", "Gold": 91, "Experience": 374, "PerkPoints": 0, "PerkChecks": 1}],
+    "Scenarios": [{"Id": 3, "Status": "Unlocked"}, {"Id": 7, "Status": "Locked"}],
+}
+
+
+def test_apply_manifest_dry_run_changes_nothing(editor):
+    original = bytes(editor.txt)
+    plan = editor.apply_manifest(MANIFEST, dry_run=True, verbose=False)
+    assert len(plan) > 0
+    assert bytes(editor.txt) == original
+    assert not editor.buffer.dirty
+    with open(editor.file, "rb") as f:
+        assert f.read() == original
+
+
+def test_apply_manifest_leaves_nothing_to_plan(editor):
+    editor.apply_manifest(MANIFEST, verbose=False)
+    assert editor.plan_manifest(MANIFEST) == []
+    reopened = _reopen(editor)
+    assert reopened.plan_manifest(MANIFEST) == []
+    assert reopened.get_campaign_values().prosperity == 20
+    assert reopened.get_event_deck("city").cards == ["18", "3", "57", "41"]
+    assert reopened.verify_savegame() == []
+
+
+def test_apply_plan(editor):
+    original = bytes(editor.txt)
+    plan = editor.plan_manifest(MANIFEST)
+    editor.apply_plan(plan)
+    assert editor.plan_manifest(MANIFEST) == []
+    assert editor.index.verify(editor.txt) == []
+    # One step of the history
+    editor.undo()
+    assert bytes(editor.txt) == original
+
+
+def test_watcher_sync_skips_its_own_save(editor):
+    with contextlib.redirect_stdout(io.StringIO()):
+        watcher = ManifestWatcher(editor, MANIFEST, poll=True)
+        try:
+            assert len(watcher.sync()) > 0
+            assert watcher.sync() is None
+            game = _reopen(editor)
+            game.update_campaign_values(prosperity=25)
+            game.save_savegame()
+            plan = watcher.sync()
+        finally:
+            watcher.watcher.close()
+    assert [patch["description"] for patch in plan] == ["Prosperity: 25 -> 20"]
+    assert _reopen(editor).plan_manifest(MANIFEST) == []
@@ -0,0 +1,143 @@
+"""
+Undo/redo history of the edits made to an open savegame.
+
+Every splice into the savegame is recorded as (start, bytes it replaced, bytes it wrote), and all splices of one call
+of an editing method make up one step. So the history only takes the size of the edits, not a copy of the savegame per
+step, and undoing a step only splices its old bytes back in. The oldest steps are dropped once there are more than
+`max_steps` of them, or once they add up to more than `max_bytes`.
+"""
+import functools
+
+
+def undoable(method):
+    """Record the edits of a SaveGameEditor method as one step of its history, including those of nested calls."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        arguments = [repr(arg) for arg in args] + [f"{name}={value!r}" for name, value in kwargs.items()]
+        description = f"{method.__name__}({', '.join(arguments)})"
+        if len(description) > 80:
+            description = description[:77] + "..."
+        self.history.begin(description)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.history.end()
+
+    return wrapper
+
+
+class EditHistory:
+    def __init__(self, max_steps=100, max_bytes=64 * 2**20):
+        """
+        :param max_steps: number of steps to keep at most
+        :param max_bytes: total size of the old and new bytes of the kept steps at most; the latest step is always kept
+        """
+        self.max_steps = max_steps
+        self.max_bytes = max_bytes
+        # [description, [(start, old bytes, new bytes), ...], size], oldest first
+        self._steps = []
+        # Number of steps that are applied to the savegame; the ones after it can be redone
+        self.position = 0
+        # name -> position
+        self.checkpoints = {}
+        self._open = None
+        self._depth = 0
+
+    def begin(self, description):
+        """Start a step; nested calls add to the step of the outermost one."""
+        self._depth += 1
+        if self._depth == 1:
+            self._open = [description, [], 0]
+
+    def end(self):
+        self._depth -= 1
+        if self._depth == 0:
+            step, self._open = self._open, None
+            if step[1]:
+                self._push(step)
+
+    def record(self, start, old, new):
+        """Note that the bytes `old` at `start` were replaced by `new`."""
+        if self._open is not None:
+            self._open[1].append((start, old, new))
+            self._open[2] += len(old) + len(new)
+        else:
+            self._push(["edit", [(start, old, new)], len(old) + len(new)])
+
+    def _push(self, step):
+        # A new edit makes the undone steps unreachable
+        del self._steps[self.position :]
+        self.checkpoints = {name: position for name, position in self.checkpoints.items() if position <= self.position}
+        self._steps.append(step)
+        self.position += 1
+        size = sum(s[2] for s in self._steps)
+        dropped = 0
+        while len(self._steps) - dropped > 1 and (
+            len(self._steps) - dropped > self.max_steps or size > self.max_bytes
+        ):
+            size -= self._steps[dropped][2]
+            dropped += 1
+        if dropped:
+            del self._steps[:dropped]
+            self.position -= dropped
+            self.checkpoints = {
+                name: position - dropped for name, position in self.checkpoints.items() if position >= dropped
+            }
+
+    def clear(self):
+        self._steps = []
+        self.position = 0
+        self.checkpoints = {}
+
+    def checkpoint(self, name):
+        self.checkpoints[name] = self.position
+
+    def position_of(self, name):
+        if name not in self.checkpoints:
+            raise Exception(f"There is no checkpoint '{name}'! Known checkpoints: {', '.join(self.checkpoints)}")
+        return self.checkpoints[name]
+
+    def undo_steps(self, steps):
+        """
+        :return: list of (description, splices to make) of the last `steps` applied steps, latest first; the splices
+            are (start, end, bytes) and restore the bytes as they were before the step
+        """
+        if steps > self.position:
+            raise Exception(f"Can't undo {steps} step(s), only {self.position} can be undone!")
+        undone = []
+        for _ in range(steps):
+            self.position -= 1
+            description, splices, _ = self._steps[self.position]
+            undone.append((description, [(start, start + len(new), old) for start, old, new in reversed(splices)]))
+        return undone
+
+    def redo_steps(self, steps):
+        """
+        :return: list of (description, splices to make) of the next `steps` undone steps, oldest first; the splices
+            are (start, end, bytes)
+        """
+        if steps > len(self._steps) - self.position:
+            raise Exception(f"Can't redo {steps} step(s), only {len(self._steps) - self.position} can be redone!")
+        redone = []
+        for _ in range(steps):
+            description, splices, _ = self._steps[self.position]
+            self.position += 1
+            redone.append((description, [(start, start + len(old), new) for start, old, new in splices]))
+        return redone
+
+    def steps(self):
+        """:return: list of dicts with the "description" of every step, whether it is "applied", and the names of the
+            "checkpoints" set right after it"""
+        names = {}
+        for name, position in self.checkpoints.items():
+            names.setdefault(position, []).append(name)
+        return [
+            {"description": step[0], "applied": i < self.position, "checkpoints": names.get(i + 1, [])}
+            for i, step in enumerate(self._steps)
+        ]
+
+    @property
+    def size(self):
+        """Total size of the old and new bytes of the kept steps"""
+        return sum(step[2] for step in self._steps)
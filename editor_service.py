@@ -0,0 +1,327 @@
+"""
+Local JSON-RPC service that keeps campaigns open between calls, for tools that read and edit savegames many times a
+minute (e.g. a TTS bridge).
+
+    python editor_service.py "<...>/GloomSaves/Campaign" --port 8765
+
+It only listens on 127.0.0.1. Every call is a JSON-RPC 2.0 request POSTed over HTTP, with the campaign folder name in
+its params, e.g.
+
+    {"jsonrpc": "2.0", "id": 1, "method": "update_characters",
+     "params": {"campaign": "Campaign_...", "characters": {"Sol Goodman": {"gold": 91}}}}
+
+Requests need `Content-Type: application/json`, and requests with an `Origin` header (i.e. sent by a web page in a
+browser) are refused, so that web pages can't reach the service with a cross-site POST.
+
+Methods: report, snapshot, get_characters, get_scenario_states, query, plan_manifest (reads) and update_characters,
+set_scenario_states, apply_manifest (edits, saved right away).
+
+Open campaigns are kept in an LRU cache bounded by the number of campaigns and an estimate of the memory they take,
+i.e. their savegames and record indexes (`INDEX_SIZE_FACTOR` times the savegame size). Before every
+call the size and modification time of the savegame are checked; when they changed, the savegame is read again and
+only the region that differs is spliced in (nothing happens if its content is the same). Calls are serialized per
+campaign, so two edits of the same campaign never interleave, while calls for other campaigns run in the meantime.
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from backup_store import BackupStore
+from batch import campaign_report
+from nrbf import RECORD_TYPE_ENUM, Record
+from savegame_editor import SaveGameEditor
+
+HOST = "127.0.0.1"
+MAX_REQUEST_SIZE = 16 * 2**20
+# The record index of a savegame takes about 12-14x its size on top of the bytes, see benchmarks/memory_profile.py
+INDEX_SIZE_FACTOR = 14
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class CampaignCache:
+    """LRU cache of open campaigns, see the module docstring. `get` may be called from several threads at once, but
+    only one at a time per campaign."""
+
+    def __init__(self, root_dir, max_campaigns=8, max_bytes=256 * 2**20, backup_store=None):
+        """
+        :param root_dir: folder that contains the campaign folders
+        :param max_campaigns: maximum number of campaigns to keep open
+        :param max_bytes: maximum memory the open campaigns may take, estimated as their savegame size plus
+            `INDEX_SIZE_FACTOR` times that for the record index
+        :param backup_store: BackupStore that savegames are backed up to when they are opened, and whenever they
+            changed on disk since
+        """
+        self.root_dir = root_dir
+        self.max_campaigns = max_campaigns
+        self.max_bytes = max_bytes
+        self.backup_store = backup_store or BackupStore()
+        # campaign -> [editor, stat of the savegame when it was last read or written], least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.reloads = 0
+        self.misses = 0
+
+    def get(self, campaign):
+        """
+        :return: the SaveGameEditor of the campaign, up to date with the savegame on disk
+        """
+        if os.path.basename(campaign) != campaign or campaign.startswith("."):
+            raise Exception(f"'{campaign}' isn't the name of a campaign folder!")
+        with self._lock:
+            entry = self._entries.get(campaign)
+        if entry is None:
+            editor = SaveGameEditor(root_dir=self.root_dir, campaign=campaign, backup_store=self.backup_store)
+            entry = [editor, _file_stat(editor.file)]
+            self.misses += 1
+        else:
+            editor, stat = entry
+            new_stat = _file_stat(editor.file)
+            if new_stat != stat:
+                if editor.reload_savegame() is not None:
+                    # Changed by the game (or another tool), so back up the new version before it is edited
+                    editor.backup()
+                    self.reloads += 1
+                entry[1] = new_stat
+            else:
+                self.hits += 1
+        with self._lock:
+            self._entries[campaign] = entry
+            self._entries.move_to_end(campaign)
+            self._evict()
+        return editor
+
+    def saved(self, campaign):
+        """Note that the cached editor of the campaign just saved the savegame, so it doesn't need to be read again."""
+        with self._lock:
+            entry = self._entries.get(campaign)
+            if entry is not None:
+                entry[1] = _file_stat(entry[0].file)
+
+    def _evict(self):
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_campaigns
+            or sum(len(editor.buffer) for editor, _ in self._entries.values()) * (1 + INDEX_SIZE_FACTOR)
+            > self.max_bytes
+        ):
+            self._entries.popitem(last=False)
+
+    def __contains__(self, campaign):
+        with self._lock:
+            return campaign in self._entries
+
+    def info(self):
+        with self._lock:
+            campaigns = {campaign: len(editor.buffer) for campaign, (editor, _) in self._entries.items()}
+        return {"campaigns": campaigns, "hits": self.hits, "reloads": self.reloads, "misses": self.misses}
+
+
+def _to_json(value):
+    """Make a value found by `SaveGameEditor.query` JSON serializable."""
+    if isinstance(value, Record):
+        if value.record_type == RECORD_TYPE_ENUM["BinaryObjectString"]:
+            return value.value
+        return {
+            "object_id": value.object_id,
+            "type": value.class_info.name if value.class_info and value.class_info.name else value.type_name,
+            "span": [value.start, value.end],
+        }
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+class EditorService:
+    """The JSON-RPC methods. Every method gets the editor of the campaign and the other params as keyword arguments."""
+
+    read_methods = ("report", "snapshot", "get_characters", "get_scenario_states", "query", "plan_manifest")
+    write_methods = ("update_characters", "set_scenario_states", "apply_manifest")
+
+    def __init__(self, cache):
+        self.cache = cache
+        # campaign -> [asyncio.Lock, number of calls holding or waiting for it]
+        self._campaign_locks = {}
+
+    @staticmethod
+    def report(editor):
+        return campaign_report(editor)
+
+    @staticmethod
+    def snapshot(editor):
+        return editor.snapshot().to_dict()
+
+    @staticmethod
+    def get_characters(editor, characters=None):
+        return editor.get_characters(characters)
+
+    @staticmethod
+    def get_scenario_states(editor, scenarios=None):
+        return editor.get_scenario_states(scenarios)
+
+    @staticmethod
+    def query(editor, path):
+        return [_to_json(value) for value in editor.query(path)]
+
+    @staticmethod
+    def plan_manifest(editor, manifest):
+        return [patch["description"] for patch in editor.plan_manifest(manifest)]
+
+    @staticmethod
+    def update_characters(editor, characters):
+        return editor.update_characters(characters, verbose=False)
+
+    @staticmethod
+    def set_scenario_states(editor, scenarios):
+        return editor.set_scenario_states({int(nbr): state for nbr, state in scenarios.items()}, verbose=False)
+
+    @staticmethod
+    def apply_manifest(editor, manifest, dry_run=False):
+        # Not `SaveGameEditor.apply_manifest`, which saves by itself: `_call` saves, so the cache knows about the write
+        plan = editor.plan_manifest(manifest)
+        if not dry_run:
+            editor.apply_plan(plan)
+        return [patch["description"] for patch in plan]
+
+    def _call(self, method, campaign, params):
+        """Run one method in a worker thread, while holding the lock of the campaign."""
+        editor = self.cache.get(campaign)
+        try:
+            result = getattr(self, method)(editor, **params)
+            saved = method in self.write_methods and editor.save_savegame()
+        except BaseException:
+            if method in self.write_methods:
+                # Don't leave half-applied edits (or edits the savegame was refused for) behind in the cache
+                editor.reload_savegame()
+            raise
+        if saved:
+            self.cache.saved(campaign)
+        return result
+
+    async def call(self, method, params):
+        if method == "cache_info":
+            return self.cache.info()
+        if method not in self.read_methods + self.write_methods:
+            raise LookupError(method)
+        params = dict(params)
+        campaign = params.pop("campaign", None)
+        if not isinstance(campaign, str):
+            raise Exception("The params need the name of the campaign folder as 'campaign'!")
+        entry = self._campaign_locks.setdefault(campaign, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await asyncio.get_running_loop().run_in_executor(None, self._call, method, campaign, params)
+        finally:
+            entry[1] -= 1
+            self._drop_locks()
+
+    def _drop_locks(self):
+        """Forget the locks of campaigns that no call is using and that aren't cached (anymore)."""
+        for campaign, (_, users) in list(self._campaign_locks.items()):
+            if not users and campaign not in self.cache:
+                del self._campaign_locks[campaign]
+
+    async def handle_rpc(self, request):
+        """:return: the JSON-RPC response to one request (a dict)"""
+        request_id = request.get("id") if isinstance(request, dict) else None
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32600, "message": "Invalid request"}}
+        params = request.get("params") or {}
+        if not isinstance(params, dict):
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32602, "message": "params must be named"}}
+        try:
+            result = await self.call(request["method"], params)
+        except LookupError:
+            error = {"code": -32601, "message": f"Unknown method {request['method']}"}
+            return {"jsonrpc": "2.0", "id": request_id, "error": error}
+        except TypeError as e:
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32602, "message": str(e)}}
+        except Exception as e:
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32000, "message": str(e)}}
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    async def handle_connection(self, reader, writer):
+        """Serve JSON-RPC requests POSTed over HTTP/1.1 on one connection, keeping it open between requests."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                method = request_line.split()[:1]
+                length = headers.get("content-length", "0")
+                length = int(length) if length.isdecimal() else -1
+                if not method:
+                    status, body = "400 Bad Request", {"error": "Malformed request line"}
+                elif method[0] != b"POST":
+                    status, body = "405 Method Not Allowed", {"error": "POST a JSON-RPC request"}
+                elif "origin" in headers:
+                    # Sent by browsers, and any web page can POST to localhost without a CORS preflight
+                    status, body = "403 Forbidden", {"error": "Requests from web pages are not allowed"}
+                elif headers.get("content-type", "").partition(";")[0].strip().lower() != "application/json":
+                    status, body = "415 Unsupported Media Type", {"error": "The Content-Type must be application/json"}
+                elif length < 0:
+                    status, body = "400 Bad Request", {"error": "Invalid Content-Length"}
+                elif length > MAX_REQUEST_SIZE:
+                    status, body = "413 Payload Too Large", {"error": "Request too large"}
+                else:
+                    status = "200 OK"
+                    try:
+                        request = json.loads(await reader.readexactly(length))
+                    except ValueError:
+                        body = {"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error"}}
+                    else:
+                        body = await self.handle_rpc(request)
+                payload = json.dumps(body).encode("utf-8")
+                keep_alive = headers.get("connection", "").lower() != "close" and status == "200 OK"
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(root_dir, port=8765, max_campaigns=8, max_bytes=256 * 2**20):
+    service = EditorService(CampaignCache(root_dir, max_campaigns=max_campaigns, max_bytes=max_bytes))
+    server = await asyncio.start_server(service.handle_connection, HOST, port)
+    print(f"Serving {root_dir} on http://{HOST}:{server.sockets[0].getsockname()[1]}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the savegame editor over JSON-RPC on localhost.")
+    parser.add_argument("root_dir", help="folder that contains the campaign folders")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-campaigns", type=int, default=8, help="number of campaigns to keep open")
+    parser.add_argument(
+        "--max-mb", type=float, default=256, help="memory the open campaigns may take, including their record indexes"
+    )
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.root_dir, args.port, args.max_campaigns, int(args.max_mb * 2**20)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+SQLite history of the campaign state across all backups of a campaign, to chart prosperity, reputation, donations,
+character experience and scenario progress over time.
+
+    python history_db.py ingest
+    python history_db.py ingest --root-dir "<...>/GloomSaves/Campaign" --campaigns <campaign folder>
+    python history_db.py values <campaign folder>
+    python history_db.py characters <campaign folder> --name "Sol Goodman"
+    python history_db.py scenarios <campaign folder> --scenario 90
+
+`ingest` reads the backups of the BackupStore and, with --root-dir, the `<campaign>.dat-backup-YYYYmmdd-HHMMSS` files
+that older versions of the editor wrote next to the savegame. Every distinct version is extracted once, keyed by its
+SHA-256, in a pool of processes; versions that are already in the database are skipped. The queries only read the
+database.
+
+Tables:
+
+    states(hash, donated, prosperity, reputation)                        one row per distinct version
+    characters(hash, name, gold, exp, level, perk_points, perk_checks)
+    scenarios(hash, scenario, state)
+    history(campaign, time, hash, note, source)                          one row per backup
+    files(path, size, mtime_ns, hash)                                    backup files that were hashed already
+"""
+import argparse
+import contextlib
+import dataclasses
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from backup_store import DEFAULT_BACKUP_DIR, BackupStore
+from batch import find_campaigns
+from savegame_editor import SaveGameEditor
+
+DEFAULT_DATABASE = os.path.join(os.path.dirname(DEFAULT_BACKUP_DIR), "history.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS states (
+    hash TEXT PRIMARY KEY,
+    donated INTEGER,
+    prosperity INTEGER,
+    reputation INTEGER
+);
+CREATE TABLE IF NOT EXISTS characters (
+    hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    gold INTEGER,
+    exp INTEGER,
+    level INTEGER,
+    perk_points INTEGER,
+    perk_checks INTEGER,
+    PRIMARY KEY (hash, name)
+);
+CREATE TABLE IF NOT EXISTS scenarios (
+    hash TEXT NOT NULL,
+    scenario INTEGER NOT NULL,
+    state TEXT,
+    PRIMARY KEY (hash, scenario)
+);
+CREATE TABLE IF NOT EXISTS history (
+    campaign TEXT NOT NULL,
+    time TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    note TEXT,
+    source TEXT,
+    PRIMARY KEY (campaign, time, hash)
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS characters_by_name ON characters (name, hash);
+CREATE INDEX IF NOT EXISTS scenarios_by_scenario ON scenarios (scenario, hash);
+CREATE INDEX IF NOT EXISTS history_by_hash ON history (hash);
+"""
+
+_backup_file_pattern = re.compile(r"-backup-([0-9]{8}-[0-9]{6})$")
+
+
+def _extract(source):
+    """
+    Extract the campaign values, characters and scenario states of one version, in a worker process.
+    :param source: ("store", store root, campaign, hash) or ("file", path, hash)
+    :return: (hash, report or None, traceback or None)
+    """
+    object_hash = source[-1]
+    try:
+        if source[0] == "store":
+            _, root, campaign, _ = source
+            data = BackupStore(root).restore(campaign, object_hash)
+        else:
+            with open(source[1], "rb") as f:
+                data = f.read()
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Only what is stored, e.g. not the looted chests of `batch.campaign_report`
+            editor = SaveGameEditor(data=data)
+            report = dataclasses.asdict(editor.get_campaign_values())
+            report["characters"] = editor.get_characters()
+            report["scenarios"] = editor.get_scenario_states()
+        return object_hash, report, None
+    except Exception:
+        return object_hash, None, traceback.format_exc()
+
+
+class HistoryDatabase:
+    def __init__(self, path=None):
+        """
+        :param path: the SQLite database, by default ~/.gloomhaven-savegame-editor/history.sqlite
+        """
+        self.path = path or DEFAULT_DATABASE
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _known_hashes(self):
+        return {row["hash"] for row in self.connection.execute("SELECT hash FROM states")}
+
+    def _backup_files(self, root_dir, campaign):
+        """
+        Hash the backup files next to a savegame, except the ones whose size and modification time didn't change
+        since they were hashed last time.
+        :return: list of (time, hash, path)
+        """
+        entries = []
+        for path in sorted(glob.glob(os.path.join(glob.escape(root_dir), campaign, f"{campaign}.dat-backup-*"))):
+            match = _backup_file_pattern.search(path)
+            if not match:
+                continue
+            stat = os.stat(path)
+            row = self.connection.execute("SELECT size, mtime_ns, hash FROM files WHERE path = ?", (path,)).fetchone()
+            if row is not None and (row["size"], row["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                object_hash = row["hash"]
+            else:
+                with open(path, "rb") as f:
+                    object_hash = hashlib.sha256(f.read()).hexdigest()
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime_ns, object_hash),
+                )
+            time = datetime.strptime(match.group(1), "%Y%m%d-%H%M%S").isoformat(timespec="seconds")
+            entries.append((time, object_hash, path))
+        return entries
+
+    def _insert_state(self, object_hash, report):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO states VALUES (?, ?, ?, ?)",
+            (object_hash, report["donated"], report["prosperity"], report["reputation"]),
+        )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO characters VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (object_hash, name, c["gold"], c["exp"], c["level"], c["perk_points"], c["perk_checks"])
+                for name, c in report["characters"].items()
+            ],
+        )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO scenarios VALUES (?, ?, ?)",
+            [(object_hash, int(scenario), state) for scenario, state in report["scenarios"].items()],
+        )
+
+    def ingest(self, store=None, campaigns=None, root_dir=None, processes=None):
+        """
+        Add the backups that aren't in the database yet.
+        :param store: BackupStore to read the backups from, by default the default one
+        :param campaigns: names of the campaigns to ingest, or None for every campaign in the store (and in `root_dir`)
+        :param root_dir: folder that contains the campaign folders, to also ingest the backup files next to the
+            savegames
+        :param processes: number of worker processes, or None for one per CPU
+        :return: dict with the number of "versions" that were extracted, the number of "backups" that were added to
+            the history, and the "errors" as hash -> traceback
+        """
+        store = store or BackupStore()
+        if campaigns is None:
+            campaigns = set(store.list_campaigns())
+            if root_dir is not None:
+                campaigns.update(find_campaigns(root_dir))
+            campaigns = sorted(campaigns)
+
+        history = []
+        sources = {}
+        for campaign in campaigns:
+            for backup in store.list_backups(campaign):
+                history.append((campaign, backup["time"], backup["id"], backup["note"], "store"))
+                sources.setdefault(backup["id"], ("store", store.root, campaign, backup["id"]))
+            if root_dir is not None:
+                for time, object_hash, path in self._backup_files(root_dir, campaign):
+                    history.append((campaign, time, object_hash, None, path))
+                    sources.setdefault(object_hash, ("file", path, object_hash))
+
+        known = self._known_hashes()
+        new_sources = [source for object_hash, source in sources.items() if object_hash not in known]
+        errors = {}
+        extracted = 0
+        if new_sources:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                for object_hash, report, error in executor.map(_extract, new_sources):
+                    if error is not None:
+                        errors[object_hash] = error
+                        continue
+                    self._insert_state(object_hash, report)
+                    extracted += 1
+        before = self.connection.total_changes
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO history VALUES (?, ?, ?, ?, ?)",
+            [entry for entry in history if entry[2] not in errors],
+        )
+        added = self.connection.total_changes - before
+        self.connection.commit()
+        return {"versions": extracted, "backups": added, "errors": errors}
+
+    def _query(self, sql, parameters):
+        return [dict(row) for row in self.connection.execute(sql, parameters)]
+
+    def campaign_values(self, campaign):
+        """
+        :return: list of dicts with the "time", "donated", "prosperity" and "reputation" of every backup, oldest first
+        """
+        return self._query(
+            "SELECT h.time, s.donated, s.prosperity, s.reputation FROM history h JOIN states s ON s.hash = h.hash "
+            "WHERE h.campaign = ? ORDER BY h.time, h.rowid",
+            (campaign,),
+        )
+
+    def character_history(self, campaign, name=None):
+        """
+        :param name: only this character, or None for all characters
+        :return: list of dicts with the "time", "name", "gold", "exp", "level", "perk_points" and "perk_checks" of the
+            characters in every backup, oldest first
+        """
+        sql = (
+            "SELECT h.time, c.name, c.gold, c.exp, c.level, c.perk_points, c.perk_checks "
+            "FROM history h JOIN characters c ON c.hash = h.hash WHERE h.campaign = ?"
+        )
+        if name is not None:
+            return self._query(f"{sql} AND c.name = ? ORDER BY h.time, h.rowid", (campaign, name))
+        return self._query(f"{sql} ORDER BY h.time, h.rowid, c.name", (campaign,))
+
+    def scenario_history(self, campaign, scenario=None):
+        """
+        :param scenario: only this scenario, or None for the number of scenarios per state instead
+        :return: list of dicts with the "time" and the "state" of the scenario in every backup, or with the "time",
+            "state" and number of scenarios ("count") in that state, oldest first
+        """
+        if scenario is not None:
+            return self._query(
+                "SELECT h.time, s.state FROM history h JOIN scenarios s ON s.hash = h.hash "
+                "WHERE h.campaign = ? AND s.scenario = ? ORDER BY h.time, h.rowid",
+                (campaign, scenario),
+            )
+        return self._query(
+            "SELECT h.time, s.state, COUNT(*) AS count FROM history h JOIN scenarios s ON s.hash = h.hash "
+            "WHERE h.campaign = ? GROUP BY h.rowid, s.state ORDER BY h.time, h.rowid, s.state",
+            (campaign,),
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="History of the campaign state across all backups.")
+    parser.add_argument("--db", help="path to the database (default: ~/.gloomhaven-savegame-editor/history.sqlite)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="add the backups that aren't in the database yet")
+    ingest_parser.add_argument("--root-dir", help="also ingest the backup files next to the savegames in this folder")
+    ingest_parser.add_argument("--campaigns", nargs="*", help="only ingest these campaigns")
+    ingest_parser.add_argument("--processes", type=int, help="number of worker processes (default: one per CPU)")
+    values_parser = subparsers.add_parser("values", help="gold donated, prosperity and reputation over time")
+    values_parser.add_argument("campaign")
+    characters_parser = subparsers.add_parser("characters", help="character values over time")
+    characters_parser.add_argument("campaign")
+    characters_parser.add_argument("--name", help="only this character")
+    scenarios_parser = subparsers.add_parser("scenarios", help="scenario states over time")
+    scenarios_parser.add_argument("campaign")
+    scenarios_parser.add_argument("--scenario", type=int, help="only this scenario")
+    args = parser.parse_args(argv)
+
+    db = HistoryDatabase(args.db)
+    try:
+        if args.command == "ingest":
+            result = db.ingest(campaigns=args.campaigns, root_dir=args.root_dir, processes=args.processes)
+        elif args.command == "values":
+            result = db.campaign_values(args.campaign)
+        elif args.command == "characters":
+            result = db.character_history(args.campaign, args.name)
+        else:
+            result = db.scenario_history(args.campaign, args.scenario)
+    finally:
+        db.close()
+    print(json.dumps(result, indent=2))
+    return 1 if args.command == "ingest" and result["errors"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
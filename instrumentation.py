@@ -0,0 +1,177 @@
+"""
+Opt-in instrumentation of a SaveGameEditor: wall time, call counts, bytes scanned by regular expressions and bytes
+copied by the edit buffer, per method.
+
+    with editor.instrument() as stats:
+        editor.update_char_values("Sol Goodman", gold=50)
+    print(stats.to_json())
+
+While instrumenting, every method of the editor (public methods as well as internal helpers) is wrapped on the
+instance, so nothing changes for editors that aren't instrumented. The numbers of a method include the methods it
+calls. The `re` module used by savegame_editor is swapped for a counting one for the duration, so don't instrument
+editors in several threads at the same time.
+"""
+import inspect
+import json
+import re
+import time
+from functools import wraps
+
+import savegame_editor
+
+
+def _scanned(string, pos=0, endpos=None):
+    length = len(string)
+    endpos = length if endpos is None else min(endpos, length)
+    return max(endpos - pos, 0)
+
+
+class _CountingPattern:
+    """Compiled pattern that adds the length of every string it scans to `stats.regex_bytes`."""
+
+    def __init__(self, pattern, stats):
+        self._pattern = pattern
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._pattern, name)
+
+    def _count(self, string, pos=0, endpos=None):
+        self._stats.regex_bytes += _scanned(string, pos, endpos)
+
+    def search(self, string, pos=0, endpos=None):
+        self._count(string, pos, endpos)
+        return self._pattern.search(string, pos, len(string) if endpos is None else endpos)
+
+    def match(self, string, pos=0, endpos=None):
+        self._count(string, pos, endpos)
+        return self._pattern.match(string, pos, len(string) if endpos is None else endpos)
+
+    def fullmatch(self, string, pos=0, endpos=None):
+        self._count(string, pos, endpos)
+        return self._pattern.fullmatch(string, pos, len(string) if endpos is None else endpos)
+
+    def finditer(self, string, pos=0, endpos=None):
+        self._count(string, pos, endpos)
+        return self._pattern.finditer(string, pos, len(string) if endpos is None else endpos)
+
+    def findall(self, string, pos=0, endpos=None):
+        self._count(string, pos, endpos)
+        return self._pattern.findall(string, pos, len(string) if endpos is None else endpos)
+
+
+class _CountingRe:
+    """Stand-in for the `re` module that counts the bytes scanned by the module-level functions."""
+
+    def __init__(self, stats):
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(re, name)
+
+    def compile(self, pattern, flags=0):
+        return _CountingPattern(re.compile(pattern, flags), self._stats)
+
+    def search(self, pattern, string, flags=0):
+        return self.compile(pattern, flags).search(string)
+
+    def match(self, pattern, string, flags=0):
+        return self.compile(pattern, flags).match(string)
+
+    def fullmatch(self, pattern, string, flags=0):
+        return self.compile(pattern, flags).fullmatch(string)
+
+    def finditer(self, pattern, string, flags=0):
+        return self.compile(pattern, flags).finditer(string)
+
+    def findall(self, pattern, string, flags=0):
+        return self.compile(pattern, flags).findall(string)
+
+
+class Instrumentation:
+    """
+    Collects the numbers of an instrumented editor.
+    :ivar operations: method name -> dict with its "calls", wall time in "seconds", "regex_bytes" and "copied_bytes"
+    """
+
+    def __init__(self, editor, on_call=None):
+        """
+        :param editor: the SaveGameEditor to instrument
+        :param on_call: optional tracing hook, called after every call of a method with the method name, the nesting
+            depth of the call and a dict with its "seconds", "regex_bytes" and "copied_bytes"
+        """
+        self.editor = editor
+        self.on_call = on_call
+        self.operations = {}
+        self.regex_bytes = 0
+        self._depth = 0
+        self._wrapped = []
+        self._module_re = None
+
+    def _wrap(self, name, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            regex_bytes = self.regex_bytes
+            buffer = getattr(self.editor, "buffer", None)
+            copied_bytes = buffer.bytes_copied if buffer is not None else 0
+            self._depth += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                # A method that replaces the buffer (e.g. restore_backup) only counts what the old buffer copied
+                copied_end = buffer.bytes_copied if buffer is not None else 0
+                call = {
+                    "seconds": time.perf_counter() - start,
+                    "regex_bytes": self.regex_bytes - regex_bytes,
+                    "copied_bytes": copied_end - copied_bytes,
+                }
+                totals = self.operations.setdefault(
+                    name, {"calls": 0, "seconds": 0.0, "regex_bytes": 0, "copied_bytes": 0}
+                )
+                totals["calls"] += 1
+                for key, value in call.items():
+                    totals[key] += value
+                if self.on_call is not None:
+                    self.on_call(name, self._depth, call)
+
+        return wrapper
+
+    def start(self):
+        editor = self.editor
+        for name, member in inspect.getmembers(type(editor)):
+            if name.startswith("__") or name == "instrument" or isinstance(member, property):
+                continue
+            if inspect.isfunction(member):
+                setattr(editor, name, self._wrap(name, getattr(editor, name)))
+                self._wrapped.append(name)
+            elif isinstance(member, re.Pattern):
+                setattr(editor, name, _CountingPattern(member, self))
+                self._wrapped.append(name)
+        self._module_re = savegame_editor.re
+        savegame_editor.re = _CountingRe(self)
+        return self
+
+    def stop(self):
+        for name in self._wrapped:
+            delattr(self.editor, name)
+        self._wrapped = []
+        if self._module_re is not None:
+            savegame_editor.re = self._module_re
+            self._module_re = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def report(self):
+        """
+        :return: dict with the numbers per method, slowest first
+        """
+        return dict(sorted(self.operations.items(), key=lambda item: item[1]["seconds"], reverse=True))
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.report(), **{"indent": 2, **kwargs})
@@ -1,25 +1,25 @@
-from savegame_editor import SaveGameEditor
+import argparse
 import json
 
-editor = SaveGameEditor(
-    root_dir="./", campaign="Campaign_Bangbang_We're_Dead_1054108285")
-
-campaignJson = open("campaign.json")
-campaignData = json.load(campaignJson)
+from savegame_editor import SaveGameEditor
 
-editor.update_campaign_values(
-    donated=campaignData["GoldDonations"], prosperity=campaignData["Prosperity"], reputation=campaignData["Reputation"])
 
-editor.replace_events("city", campaignData["CityEvents"], True)
-editor.replace_events("road", campaignData["RoadEvents"], True)
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Sync a Gloomhaven Digital savegame with a campaign manifest, e.g. exported from TTS."
+    )
+    parser.add_argument("manifest", nargs="?", default="campaign.json", help="path to the campaign.json manifest")
+    parser.add_argument("--root-dir", default="./", help="folder that contains the campaign folders")
+    parser.add_argument("--campaign", default="Campaign_Bangbang_We're_Dead_1054108285", help="name of the campaign")
+    parser.add_argument("--dry-run", action="store_true", help="only print the changes, don't save anything")
+    args = parser.parse_args(argv)
 
-editor.toggle_chests(campaignData["LootedChests"])
+    with open(args.manifest) as campaignJson:
+        campaignData = json.load(campaignJson)
 
-for character in campaignData["Characters"]:
-    editor.update_char_values(character["Name"], character["Gold"], character["Experience"],
-                              character["PerkPoints"], character["PerkChecks"], True, False)
+    editor = SaveGameEditor(root_dir=args.root_dir, campaign=args.campaign, read_only=args.dry_run)
+    editor.apply_manifest(campaignData, dry_run=args.dry_run)
 
-for scenario in campaignData["Scenarios"]:
-    editor.toggle_scenario_status(scenario["Id"], scenario["Status"])
 
-editor.save_savegame()
+if __name__ == "__main__":
+    main()
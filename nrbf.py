@@ -0,0 +1,983 @@
+"""
+Single-pass reader for MS-NRBF, the .NET BinaryFormatter format Gloomhaven Digital uses for its savegames.
+
+Reading the stream produces a flat list of top-level `Record`s. Every record knows its type, ObjectId and byte span in
+the savegame, and class and array records also know where each of their member values or elements starts. Nothing is
+copied out of the buffer apart from the decoded values themselves, so the records can be used to patch the savegame in
+place.
+`RecordWriter` does the reverse: it serializes (edited) records back to MS-NRBF in one linear pass, either a single
+record to splice into the savegame or the whole stream.
+See https://learn.microsoft.com/en-us/openspecs/windows_protocols/ms-nrbf for the format specification.
+"""
+import bisect
+import struct
+import sys
+from array import array
+
+RECORD_TYPE_ENUM = {
+    "SerializedStreamHeader": 0,
+    "ClassWithId": 1,
+    "SystemClassWithMembers": 2,
+    "ClassWithMembers": 3,
+    "SystemClassWithMembersAndTypes": 4,
+    "ClassWithMembersAndTypes": 5,
+    "BinaryObjectString": 6,
+    "BinaryArray": 7,
+    "MemberPrimitiveTyped": 8,
+    "MemberReference": 9,
+    "ObjectNull": 10,
+    "MessageEnd": 11,
+    "BinaryLibrary": 12,
+    "ObjectNullMultiple256": 13,
+    "ObjectNullMultiple": 14,
+    "ArraySinglePrimitive": 15,
+    "ArraySingleObject": 16,
+    "ArraySingleString": 17,
+    "ArrayOfType": 18,
+    "MethodCall": 19,
+    "MethodReturn": 20,
+}
+RECORD_TYPE_NAMES = {v: k for k, v in RECORD_TYPE_ENUM.items()}
+
+CLASS_RECORDS = (1, 2, 3, 4, 5)
+ARRAY_RECORDS = (7, 15, 16, 17)
+
+# BinaryTypeEnum values used in the MemberTypeInfo of a class and the type info of a BinaryArray
+PRIMITIVE, STRING, OBJECT, SYSTEM_CLASS, CLASS, OBJECT_ARRAY, STRING_ARRAY, PRIMITIVE_ARRAY = range(8)
+
+# PrimitiveTypeEnum values mapped to their fixed-size struct format. Char, Decimal and String have a variable size.
+PRIMITIVE_FORMATS = {
+    1: "<?",  # Boolean
+    2: "<B",  # Byte
+    6: "<d",  # Double
+    7: "<h",  # Int16
+    8: "<i",  # Int32
+    9: "<q",  # Int64
+    10: "<b",  # SByte
+    11: "<f",  # Single
+    12: "<q",  # TimeSpan
+    13: "<Q",  # DateTime
+    14: "<H",  # UInt16
+    15: "<I",  # UInt32
+    16: "<Q",  # UInt64
+}
+CHAR, DECIMAL, NULL, PRIMITIVE_STRING = 3, 5, 17, 18
+
+# PrimitiveTypeEnum values whose arrays are kept as an `array` of this typecode instead of a list of Python objects
+PRIMITIVE_TYPECODES = {
+    2: "B",
+    6: "d",
+    7: "h",
+    8: "i",
+    9: "q",
+    10: "b",
+    11: "f",
+    12: "q",
+    13: "Q",
+    14: "H",
+    15: "I",
+    16: "Q",
+}
+
+
+class NrbfError(Exception):
+    pass
+
+
+class ClassInfo:
+    """
+    Name, member names and member types of a class, shared by every record of that class. `metadata_id` and
+    `record_type` are the ObjectId and record type of the record that defined the class, which ClassWithId records
+    refer to.
+    """
+
+    __slots__ = ("name", "member_names", "binary_types", "additional_infos", "library_id", "metadata_id", "record_type")
+
+    def __init__(
+        self,
+        name,
+        member_names,
+        binary_types=None,
+        additional_infos=None,
+        library_id=None,
+        metadata_id=None,
+        record_type=None,
+    ):
+        self.name = name
+        self.member_names = member_names
+        self.binary_types = binary_types
+        self.additional_infos = additional_infos
+        self.library_id = library_id
+        self.metadata_id = metadata_id
+        self.record_type = record_type
+
+
+class Reference:
+    """A MemberReference to the record with ObjectId `id_ref`."""
+
+    __slots__ = ("id_ref",)
+
+    def __init__(self, id_ref):
+        self.id_ref = id_ref
+
+    def __eq__(self, other):
+        return isinstance(other, Reference) and other.id_ref == self.id_ref
+
+    def __hash__(self):
+        return hash(self.id_ref)
+
+    def __repr__(self):
+        return f"Reference({self.id_ref})"
+
+
+class Record:
+    """
+    A record in the stream.
+    :ivar record_type: the RecordTypeEnum value of the record
+    :ivar object_id: the ObjectId of the record, or None for records without one
+    :ivar start: offset of the record type byte in the savegame
+    :ivar end: offset just past the last byte of the record, including nested records
+    :ivar class_info: the ClassInfo of class records
+    :ivar values: member values of class records and elements of arrays. Primitives are decoded to Python values,
+        strings and nested objects are `Record`s, references are `Reference`s and nulls are None. Arrays of fixed-size
+        numeric primitives are an `array` instead of a list.
+    :ivar offsets: offset of the start of each entry of `values` relative to `start`, so that they stay valid when the
+        record moves; see `member_span` for the offsets in the savegame
+    :ivar value: the string of a BinaryObjectString, the value of a MemberPrimitiveTyped, the (LibraryId, name) of a
+        BinaryLibrary, or the id_ref of a MemberReference
+    :ivar prefix: BinaryLibrary records that were written directly in front of this record
+    :ivar boxed: index in `values` -> PrimitiveTypeEnum of the values that were written as MemberPrimitiveTyped
+    """
+
+    __slots__ = (
+        "record_type", "start", "end", "object_id", "class_info", "values", "offsets", "value", "prefix", "boxed"
+    )
+
+    def __init__(self, record_type, start, object_id=None):
+        self.record_type = record_type
+        self.start = start
+        self.end = start
+        self.object_id = object_id
+        self.class_info = None
+        self.values = None
+        self.offsets = None
+        self.value = None
+        self.prefix = None
+        self.boxed = None
+
+    @property
+    def type_name(self):
+        return RECORD_TYPE_NAMES[self.record_type]
+
+    @property
+    def member_names(self):
+        return self.class_info.member_names if self.class_info else None
+
+    def member(self, name):
+        return self.values[self.class_info.member_names.index(name)]
+
+    def member_span(self, index):
+        """:return: the span in the savegame of the entry `index` of `values`"""
+        end = self.start + self.offsets[index + 1] if index + 1 < len(self.offsets) else self.end
+        return self.start + self.offsets[index], end
+
+    def children(self):
+        """Yield the records nested inside this one."""
+        for v in self.values or ():
+            if isinstance(v, Record):
+                yield v
+
+    def __repr__(self):
+        return f"<{self.type_name} id={self.object_id} span=({self.start}, {self.end})>"
+
+
+class _NullRun:
+    __slots__ = ("count",)
+
+    def __init__(self, count):
+        self.count = count
+
+
+class RecordReader:
+    """
+    Walks an MS-NRBF buffer once, front to back. `metadata` (ObjectId -> ClassInfo) is kept on the reader because
+    ClassWithId records refer to the class layout of an earlier record.
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.metadata = {}
+        self.libraries = {}
+
+    def read_records(self, pos=0):
+        records = []
+        while True:
+            record, pos = self.read_record(pos)
+            records.append(record)
+            if record.record_type == RECORD_TYPE_ENUM["MessageEnd"]:
+                return records
+            if pos >= len(self.buf):
+                raise NrbfError(f"Stream ended at offset {pos} without a MessageEnd record")
+
+    def _int32(self, pos):
+        return struct.unpack_from("<i", self.buf, pos)[0], pos + 4
+
+    def _byte(self, pos):
+        return self.buf[pos], pos + 1
+
+    def _string(self, pos):
+        length, shift = 0, 0
+        while True:
+            byte = self.buf[pos]
+            pos += 1
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        return bytes(self.buf[pos : pos + length]).decode("utf-8"), pos + length
+
+    def _primitive(self, primitive_type, pos):
+        fmt = PRIMITIVE_FORMATS.get(primitive_type)
+        if fmt is not None:
+            return struct.unpack_from(fmt, self.buf, pos)[0], pos + struct.calcsize(fmt)
+        if primitive_type == CHAR:
+            first = self.buf[pos]
+            size = 1 if first < 0x80 else 2 if first < 0xE0 else 3 if first < 0xF0 else 4
+            return bytes(self.buf[pos : pos + size]).decode("utf-8"), pos + size
+        if primitive_type in (DECIMAL, PRIMITIVE_STRING):
+            return self._string(pos)
+        if primitive_type == NULL:
+            return None, pos
+        raise NrbfError(f"Unknown primitive type {primitive_type} at offset {pos}")
+
+    def _class_info(self, pos):
+        object_id, pos = self._int32(pos)
+        name, pos = self._string(pos)
+        member_count, pos = self._int32(pos)
+        member_names = []
+        for _ in range(member_count):
+            member_name, pos = self._string(pos)
+            member_names.append(member_name)
+        return object_id, name, member_names, pos
+
+    def _type_info(self, binary_type, pos):
+        if binary_type in (PRIMITIVE, PRIMITIVE_ARRAY):
+            return self._byte(pos)
+        if binary_type == SYSTEM_CLASS:
+            return self._string(pos)
+        if binary_type == CLASS:
+            name, pos = self._string(pos)
+            library_id, pos = self._int32(pos)
+            return (name, library_id), pos
+        return None, pos
+
+    def _member_type_info(self, member_count, pos):
+        binary_types = list(self.buf[pos : pos + member_count])
+        pos += member_count
+        additional_infos = []
+        for binary_type in binary_types:
+            info, pos = self._type_info(binary_type, pos)
+            additional_infos.append(info)
+        return binary_types, additional_infos, pos
+
+    def read_record(self, pos):
+        """Read the record starting at `pos`. Returns the record and the offset just past it."""
+        start = pos
+        record_type, pos = self._byte(pos)
+        record = Record(record_type, start)
+
+        if record_type == 0:  # SerializedStreamHeader
+            record.value = struct.unpack_from("<iiii", self.buf, pos)
+            pos += 16
+        elif record_type in CLASS_RECORDS:
+            pos = self._read_class(record, pos)
+        elif record_type == 6:  # BinaryObjectString
+            record.object_id, pos = self._int32(pos)
+            record.value, pos = self._string(pos)
+        elif record_type == 7:  # BinaryArray
+            pos = self._read_binary_array(record, pos)
+        elif record_type == 8:  # MemberPrimitiveTyped
+            primitive_type, pos = self._byte(pos)
+            record.value, pos = self._primitive(primitive_type, pos)
+            record.values = [primitive_type]
+        elif record_type == 9:  # MemberReference
+            record.value, pos = self._int32(pos)
+        elif record_type in (10, 11):  # ObjectNull, MessageEnd
+            pass
+        elif record_type == 12:  # BinaryLibrary
+            library_id, pos = self._int32(pos)
+            name, pos = self._string(pos)
+            record.value = (library_id, name)
+            self.libraries[library_id] = name
+        elif record_type == 13:  # ObjectNullMultiple256
+            record.value, pos = self._byte(pos)
+        elif record_type == 14:  # ObjectNullMultiple
+            record.value, pos = self._int32(pos)
+        elif record_type == 15:  # ArraySinglePrimitive
+            record.object_id, pos = self._int32(pos)
+            length, pos = self._int32(pos)
+            primitive_type, pos = self._byte(pos)
+            record.class_info = ClassInfo(None, None, [PRIMITIVE], [primitive_type])
+            pos = self._read_primitives(record, primitive_type, length, pos)
+        elif record_type in (16, 17):  # ArraySingleObject, ArraySingleString
+            record.object_id, pos = self._int32(pos)
+            length, pos = self._int32(pos)
+            pos = self._read_elements(record, length, pos)
+        else:
+            raise NrbfError(f"Unsupported record type {record_type} at offset {start}")
+        record.end = pos
+        return record, pos
+
+    def _read_class(self, record, pos):
+        record_type = record.record_type
+        if record_type == 1:  # ClassWithId
+            record.object_id, pos = self._int32(pos)
+            metadata_id, pos = self._int32(pos)
+            if metadata_id not in self.metadata:
+                raise NrbfError(f"ClassWithId at offset {record.start} refers to unknown metadata {metadata_id}")
+            record.class_info = self.metadata[metadata_id]
+        else:
+            record.object_id, name, member_names, pos = self._class_info(pos)
+            binary_types = additional_infos = library_id = None
+            if record_type in (4, 5):
+                binary_types, additional_infos, pos = self._member_type_info(len(member_names), pos)
+            if record_type in (3, 5):
+                library_id, pos = self._int32(pos)
+            record.class_info = ClassInfo(
+                name, member_names, binary_types, additional_infos, library_id, record.object_id, record_type
+            )
+            self.metadata[record.object_id] = record.class_info
+
+        class_info = record.class_info
+        record.values, record.offsets = [], array("I")
+        member_count = len(class_info.member_names)
+        while len(record.values) < member_count:
+            i = len(record.values)
+            record.offsets.append(pos - record.start)
+            if class_info.binary_types is not None and class_info.binary_types[i] == PRIMITIVE:
+                value, pos = self._primitive(class_info.additional_infos[i], pos)
+                record.values.append(value)
+            else:
+                value, pos = self._read_value(pos)
+                self._append(record, value)
+        return pos
+
+    def _read_binary_array(self, record, pos):
+        record.object_id, pos = self._int32(pos)
+        array_type, pos = self._byte(pos)
+        rank, pos = self._int32(pos)
+        lengths = struct.unpack_from(f"<{rank}i", self.buf, pos)
+        pos += 4 * rank
+        lower_bounds = None
+        if array_type in (3, 4, 5):  # SingleOffset, JaggedOffset, RectangularOffset
+            lower_bounds = struct.unpack_from(f"<{rank}i", self.buf, pos)
+            pos += 4 * rank
+        binary_type, pos = self._byte(pos)
+        info, pos = self._type_info(binary_type, pos)
+        record.class_info = ClassInfo(None, None, [binary_type], [info])
+        record.value = (array_type, rank, lengths, lower_bounds)
+        length = 1
+        for n in lengths:
+            length *= n
+        if binary_type == PRIMITIVE:
+            return self._read_primitives(record, info, length, pos)
+        return self._read_elements(record, length, pos)
+
+    def _read_primitives(self, record, primitive_type, length, pos):
+        fmt = PRIMITIVE_FORMATS.get(primitive_type)
+        if fmt is not None:
+            size = struct.calcsize(fmt)
+            typecode = PRIMITIVE_TYPECODES.get(primitive_type)
+            if typecode is not None:
+                record.values = array(typecode)
+                record.values.frombytes(self.buf[pos : pos + size * length])
+                if sys.byteorder == "big":
+                    record.values.byteswap()
+            else:
+                record.values = list(struct.unpack_from(f"<{length}{fmt[1]}", self.buf, pos))
+            record.offsets = range(pos - record.start, pos - record.start + size * length, size)
+            return pos + size * length
+        record.values, record.offsets = [], array("I")
+        for _ in range(length):
+            record.offsets.append(pos - record.start)
+            value, pos = self._primitive(primitive_type, pos)
+            record.values.append(value)
+        return pos
+
+    def _read_elements(self, record, length, pos):
+        record.values, record.offsets = [], array("I")
+        while len(record.values) < length:
+            record.offsets.append(pos - record.start)
+            value, pos = self._read_value(pos)
+            self._append(record, value)
+        if len(record.values) != length:
+            raise NrbfError(f"Null run overflows the array at offset {record.start}")
+        return pos
+
+    @staticmethod
+    def _append(record, value):
+        if isinstance(value, _NullRun):
+            record.values.extend([None] * value.count)
+            record.offsets.extend([record.offsets[-1]] * (value.count - 1))
+        elif isinstance(value, Record) and value.record_type == 8:  # MemberPrimitiveTyped
+            if record.boxed is None:
+                record.boxed = {}
+            record.boxed[len(record.values)] = value.values[0]
+            record.values.append(value.value)
+        else:
+            record.values.append(value)
+
+    def _read_value(self, pos):
+        """Read a member value or array element that is written as a record of its own."""
+        libraries = []
+        while self.buf[pos] == RECORD_TYPE_ENUM["BinaryLibrary"]:
+            library, pos = self.read_record(pos)
+            libraries.append(library)
+        record, pos = self.read_record(pos)
+        if libraries:
+            record.prefix = libraries
+        record_type = record.record_type
+        if record_type == 9:  # MemberReference
+            return Reference(record.value), pos
+        if record_type == 10:  # ObjectNull
+            return None, pos
+        if record_type in (13, 14):  # ObjectNullMultiple256, ObjectNullMultiple
+            return _NullRun(record.value), pos
+        return record, pos
+
+
+def read_records(buf):
+    """
+    Read every top-level record of the savegame in `buf`, from the SerializedStreamHeader up to and including the
+    MessageEnd record.
+    """
+    return RecordReader(buf).read_records()
+
+
+def iter_records(records):
+    """Yield the given records and all records nested inside them, depth first in stream order."""
+    stack = list(reversed(records))
+    while stack:
+        record = stack.pop()
+        yield record
+        stack.extend(reversed(list(record.children())))
+
+
+class RecordWriter:
+    """
+    Serializes records back to MS-NRBF, front to back in one pass. Null elements of arrays are written as the shortest
+    ObjectNull/ObjectNullMultiple256/ObjectNullMultiple runs, like BinaryFormatter does, and the lengths of
+    single-dimensional arrays follow their number of elements.
+    """
+
+    def __init__(self, libraries=None):
+        """:param libraries: LibraryId -> name of the libraries in the savegame, see `RecordReader.libraries`"""
+        self.out = bytearray()
+        self.libraries = libraries or {}
+        # Metadata and libraries written so far; None while writing single records that go into an existing stream
+        self._defined_metadata = None
+        self._defined_libraries = None
+
+    def write_records(self, records):
+        """
+        Serialize a whole stream, i.e. every top-level record from the SerializedStreamHeader up to the MessageEnd.
+        Classes and libraries are defined again where their first definition was dropped from the stream.
+        """
+        self._defined_metadata = set()
+        self._defined_libraries = set()
+        try:
+            for record in records:
+                self.write_record(record)
+        finally:
+            self._defined_metadata = None
+            self._defined_libraries = None
+        return self.out
+
+    def _int32(self, value):
+        self.out += struct.pack("<i", value)
+
+    def _string(self, value):
+        data = value.encode("utf-8")
+        length = len(data)
+        while length >= 0x80:
+            self.out.append(length & 0x7F | 0x80)
+            length >>= 7
+        self.out.append(length)
+        self.out += data
+
+    def _primitive(self, primitive_type, value):
+        fmt = PRIMITIVE_FORMATS.get(primitive_type)
+        if fmt is not None:
+            self.out += struct.pack(fmt, value)
+        elif primitive_type == CHAR:
+            self.out += value.encode("utf-8")
+        elif primitive_type in (DECIMAL, PRIMITIVE_STRING):
+            self._string(value)
+        elif primitive_type != NULL:
+            raise NrbfError(f"Unknown primitive type {primitive_type}")
+
+    def _type_info(self, binary_type, info):
+        if binary_type in (PRIMITIVE, PRIMITIVE_ARRAY):
+            self.out.append(info)
+        elif binary_type == SYSTEM_CLASS:
+            self._string(info)
+        elif binary_type == CLASS:
+            self._string(info[0])
+            self._int32(info[1])
+
+    def _require_libraries(self, class_info):
+        """Write a BinaryLibrary record for every library the class refers to that wasn't defined yet."""
+        if self._defined_libraries is None:
+            return
+        library_ids = [
+            info[1]
+            for binary_type, info in zip(class_info.binary_types or (), class_info.additional_infos or ())
+            if binary_type == CLASS
+        ]
+        if class_info.library_id is not None:
+            library_ids.append(class_info.library_id)
+        for library_id in library_ids:
+            if library_id not in self._defined_libraries:
+                if library_id not in self.libraries:
+                    raise NrbfError(f"Library {library_id} is used before it is defined")
+                self.out.append(RECORD_TYPE_ENUM["BinaryLibrary"])
+                self._int32(library_id)
+                self._string(self.libraries[library_id])
+                self._defined_libraries.add(library_id)
+
+    def write_record(self, record):
+        """Serialize one record, including the records nested in it but not its `prefix`."""
+        record_type = record.record_type
+        if record_type in CLASS_RECORDS:
+            self._write_class(record)
+            return self.out
+        self.out.append(record_type)
+        if record_type == 0:  # SerializedStreamHeader
+            self.out += struct.pack("<iiii", *record.value)
+        elif record_type == 6:  # BinaryObjectString
+            self._int32(record.object_id)
+            self._string(record.value)
+        elif record_type == 7:  # BinaryArray
+            self._write_binary_array(record)
+        elif record_type == 8:  # MemberPrimitiveTyped
+            self.out.append(record.values[0])
+            self._primitive(record.values[0], record.value)
+        elif record_type == 9:  # MemberReference
+            self._int32(record.value)
+        elif record_type == 12:  # BinaryLibrary
+            self._int32(record.value[0])
+            self._string(record.value[1])
+            if self._defined_libraries is not None:
+                self._defined_libraries.add(record.value[0])
+        elif record_type == 15:  # ArraySinglePrimitive
+            primitive_type = record.class_info.additional_infos[0]
+            self._int32(record.object_id)
+            self._int32(len(record.values))
+            self.out.append(primitive_type)
+            self._write_primitives(primitive_type, record.values)
+        elif record_type in (16, 17):  # ArraySingleObject, ArraySingleString
+            self._int32(record.object_id)
+            self._int32(len(record.values))
+            self._write_elements(record)
+        elif record_type not in (10, 11):  # ObjectNull, MessageEnd
+            raise NrbfError(f"Unsupported record type {record_type}")
+        return self.out
+
+    def _write_class(self, record):
+        class_info = record.class_info
+        if record.record_type == 1 and self._defined_metadata is not None:
+            if class_info.metadata_id not in self._defined_metadata:
+                # The record that defined the class is gone, so this one defines it now
+                record.record_type = class_info.record_type
+                class_info.metadata_id = record.object_id
+        elif record.record_type != 1:
+            class_info.metadata_id = record.object_id
+        if record.record_type != 1:
+            self._require_libraries(class_info)
+        self.out.append(record.record_type)
+        self._int32(record.object_id)
+        if record.record_type == 1:  # ClassWithId
+            self._int32(class_info.metadata_id)
+        else:
+            self._string(class_info.name)
+            self._int32(len(class_info.member_names))
+            for name in class_info.member_names:
+                self._string(name)
+            if record.record_type in (4, 5):
+                self.out += bytes(class_info.binary_types)
+                for binary_type, info in zip(class_info.binary_types, class_info.additional_infos):
+                    self._type_info(binary_type, info)
+            if record.record_type in (3, 5):
+                self._int32(class_info.library_id)
+            if self._defined_metadata is not None:
+                self._defined_metadata.add(record.object_id)
+
+        for i, value in enumerate(record.values):
+            if class_info.binary_types is not None and class_info.binary_types[i] == PRIMITIVE:
+                self._primitive(class_info.additional_infos[i], value)
+            else:
+                self._write_value(record, i, value)
+
+    def _write_binary_array(self, record):
+        array_type, rank, lengths, lower_bounds = record.value
+        if rank == 1:
+            lengths = (len(record.values),)
+            record.value = (array_type, rank, lengths, lower_bounds)
+        self._require_libraries(record.class_info)
+        self._int32(record.object_id)
+        self.out.append(array_type)
+        self._int32(rank)
+        self.out += struct.pack(f"<{rank}i", *lengths)
+        if array_type in (3, 4, 5):  # SingleOffset, JaggedOffset, RectangularOffset
+            self.out += struct.pack(f"<{rank}i", *lower_bounds)
+        binary_type = record.class_info.binary_types[0]
+        info = record.class_info.additional_infos[0]
+        self.out.append(binary_type)
+        self._type_info(binary_type, info)
+        if binary_type == PRIMITIVE:
+            self._write_primitives(info, record.values)
+        else:
+            self._write_elements(record)
+
+    def _write_primitives(self, primitive_type, values):
+        fmt = PRIMITIVE_FORMATS.get(primitive_type)
+        if isinstance(values, array) and values.typecode == PRIMITIVE_TYPECODES.get(primitive_type):
+            if sys.byteorder == "big":
+                values = array(values.typecode, values)
+                values.byteswap()
+            self.out += values.tobytes()
+        elif fmt is not None:
+            self.out += struct.pack(f"<{len(values)}{fmt[1]}", *values)
+        else:
+            for value in values:
+                self._primitive(primitive_type, value)
+
+    def _write_elements(self, record):
+        nulls = 0
+        for i, value in enumerate(record.values):
+            if value is None:
+                nulls += 1
+                continue
+            self._write_nulls(nulls)
+            nulls = 0
+            self._write_value(record, i, value)
+        self._write_nulls(nulls)
+
+    def _write_nulls(self, count):
+        if count == 1:
+            self.out.append(RECORD_TYPE_ENUM["ObjectNull"])
+        elif 1 < count < 256:
+            self.out.append(RECORD_TYPE_ENUM["ObjectNullMultiple256"])
+            self.out.append(count)
+        elif count >= 256:
+            self.out.append(RECORD_TYPE_ENUM["ObjectNullMultiple"])
+            self._int32(count)
+
+    def _write_value(self, parent, i, value):
+        """Write a member value or array element that is written as a record of its own."""
+        if isinstance(value, Record):
+            for library in value.prefix or ():
+                self.write_record(library)
+            self.write_record(value)
+        elif isinstance(value, Reference):
+            self.out.append(RECORD_TYPE_ENUM["MemberReference"])
+            self._int32(value.id_ref)
+        elif value is None:
+            self.out.append(RECORD_TYPE_ENUM["ObjectNull"])
+        else:
+            primitive_type = (parent.boxed or {}).get(i)
+            if primitive_type is None:
+                primitive_type = _BOXED_TYPES.get(type(value))
+            if primitive_type is None:
+                raise NrbfError(f"Can't tell the primitive type of {value!r}")
+            self.out.append(RECORD_TYPE_ENUM["MemberPrimitiveTyped"])
+            self.out.append(primitive_type)
+            self._primitive(primitive_type, value)
+
+
+# PrimitiveTypeEnum of values added to the record model without one (Boolean, Int32, Double)
+_BOXED_TYPES = {bool: 1, int: 8, float: 6}
+
+
+def write_records(records, libraries=None):
+    """Serialize every top-level record of a savegame back to MS-NRBF, see `RecordWriter.write_records`."""
+    return RecordWriter(libraries).write_records(records)
+
+
+class RecordIndex:
+    """
+    Hash indexes over the records of a savegame, built in the same pass that reads them:
+    * `objects`: ObjectId -> record
+    * `members`: member name -> list of the class records with that member, in stream order; see `member_paths`
+    `update` keeps the indexes valid after the savegame is edited, by reading again only the top-level records that
+    overlap the edit and shifting the offsets of the records after it. `query` looks records up by path on top of them,
+    and `verify` checks the structure of the savegame.
+    """
+
+    def __init__(self, buf):
+        self.reader = RecordReader(buf)
+        self.records = self.reader.read_records()
+        self.starts = [record.start for record in self.records]
+        self.objects = {}
+        self.members = {}
+        self._next_object_id = 1
+        self._add(self.records)
+
+    def new_object_id(self):
+        """Allocate an ObjectId that isn't used yet, above the highest ObjectId and LibraryId in the savegame."""
+        object_id = max(self._next_object_id, max(self.reader.libraries, default=0) + 1)
+        self._next_object_id = object_id + 1
+        return object_id
+
+    def member_paths(self, name):
+        """:return: list of (record, member index) of every class record with a member called `name`, in stream order"""
+        positions = {}
+        paths = []
+        for record in self.members.get(name, ()):
+            class_info = record.class_info
+            i = positions.get(id(class_info))
+            if i is None:
+                i = positions[id(class_info)] = class_info.member_names.index(name)
+            paths.append((record, i))
+        return paths
+
+    def resolve(self, value):
+        """:return: the record a Reference refers to, or `value` itself"""
+        return self.objects.get(value.id_ref) if isinstance(value, Reference) else value
+
+    def _slots(self, record, segment):
+        """Yield the (record, index) of every value of `record` that matches one segment of a query path."""
+        if not isinstance(record, Record) or record.values is None or record.record_type == 8:
+            return
+        if segment == "*":
+            yield from ((record, i) for i in range(len(record.values)))
+        elif segment == "Values":
+            if record.record_type in ARRAY_RECORDS:
+                yield from ((record, i) for i, value in enumerate(record.values) if value is not None)
+            elif record.member_names and "_items" in record.member_names and "_size" in record.member_names:
+                # The live elements of a List<T>
+                items = self.resolve(record.member("_items"))
+                if isinstance(items, Record) and items.values is not None:
+                    yield from ((items, i) for i in range(min(record.member("_size"), len(items.values))))
+        elif segment.isdigit():
+            if int(segment) < len(record.values):
+                yield record, int(segment)
+        elif record.member_names and segment in record.member_names:
+            yield record, record.member_names.index(segment)
+
+    def _query(self, path):
+        segments = path.strip("/").split("/")
+        first = segments.pop(0)
+        if first.startswith("#"):
+            record = self.objects.get(int(first[1:]))
+            matches = [(None, None, record)] if record is not None else []
+        elif first in ("*", "Values") or first.isdigit():
+            raise NrbfError(f"A query path has to start with a member name or an #ObjectId, not '{first}'")
+        else:
+            matches = [(record, i, self.resolve(record.values[i])) for record, i in self.member_paths(first)]
+        for segment in segments:
+            matches = [
+                (record, i, self.resolve(record.values[i]))
+                for _, _, value in matches
+                for record, i in self._slots(value, segment)
+            ]
+        return matches
+
+    def query(self, path):
+        """
+        Find values by a path of member names, starting from the member name index, e.g.
+
+            index.query("PersonalQuestDeck/*/Values")
+
+        References are followed on the way. A segment of the path is a member name, `*` for all members or elements,
+        `Values` for the elements of an array or the live elements of a List<T>, or the position of a member or
+        element. The path can also start at an ObjectId, e.g. "#12/_items".
+        :return: list of the values the path leads to: records for objects and strings, Python values for primitives
+        """
+        return [value for _, _, value in self._query(path)]
+
+    def query_slots(self, path):
+        """
+        Find values by path, see `query`.
+        :return: list of (record, index) of every value the path leads to, i.e. where in `record.values` it is stored,
+            so that its span is `record.member_span(index)`
+        """
+        return [(record, i) for record, i, _ in self._query(path) if record is not None]
+
+    def verify(self, buf):
+        """
+        Check the structure of the savegame in one pass over the records, without reading it again:
+        * it starts with a SerializedStreamHeader and ends with MessageEnd, with nothing after it
+        * ObjectIds and LibraryIds are unique, and the root object and every reference resolve to a record
+        * the declared length of every array matches its elements, counting null runs
+        * the `_size` of every List<T> fits into its `_items` array
+        * every top-level object apart from the root is referenced; a stray one is usually an element written past the
+          declared length of an array
+        :param buf: the savegame the records were read from
+        :return: list of the problems found, empty if the savegame is well-formed
+        """
+        records = self.records
+        problems = []
+        if not records or records[0].record_type != 0:
+            problems.append("The stream doesn't start with a SerializedStreamHeader")
+        if not records or records[-1].record_type != RECORD_TYPE_ENUM["MessageEnd"]:
+            problems.append("The stream doesn't end with a MessageEnd record")
+        elif records[-1].end != len(buf):
+            message_end = records[-1]
+            problems.append(
+                f"{len(buf) - message_end.end} byte(s) after the MessageEnd record at offset {message_end.start}"
+            )
+        if problems:
+            return problems
+
+        objects = self.objects
+        root_id = records[0].value[0]
+        if root_id not in objects:
+            problems.append(f"The root object #{root_id} doesn't exist")
+        # Whether each ObjectId is referenced, as flags since ObjectIds are handed out counting up from 1; a record
+        # takes at least 5 bytes, so higher ones (and negative ones) are kept in a set instead
+        referenced = bytearray(min(self._next_object_id, len(buf)))
+        referenced_other = set()
+        if 0 <= root_id < len(referenced):
+            referenced[root_id] = 1
+        else:
+            referenced_other.add(root_id)
+        libraries = {}
+        for top_record in records:
+            # The same depth-first walk as `iter_records`, which also checks the references on the way
+            stack = [top_record]
+            while stack:
+                record = stack.pop()
+                record_type = record.record_type
+                for library in (record.prefix or []) + ([record] if record_type == 12 else []):  # BinaryLibrary
+                    library_id = library.value[0]
+                    if libraries.setdefault(library_id, library) is not library:
+                        problems.append(
+                            f"LibraryId {library_id} is used at offsets {libraries[library_id].start} and "
+                            f"{library.start}"
+                        )
+                object_id = record.object_id
+                if object_id is not None and objects.get(object_id) is not record:
+                    # Only one of the records with the same ObjectId is in the index
+                    other = objects.get(object_id)
+                    problems.append(
+                        f"ObjectId {object_id} is used at offsets {other.start if other else None} and {record.start}"
+                    )
+                values = record.values
+                if values is None:
+                    continue
+                if record_type in (15, 16, 17):  # ArraySinglePrimitive, ArraySingleObject, ArraySingleString
+                    length = struct.unpack_from("<i", buf, record.start + 5)[0]
+                elif record_type == 7:  # BinaryArray
+                    length = 1
+                    for n in record.value[2]:
+                        length *= n
+                else:
+                    length = len(values)
+                    member_names = record.class_info.member_names if record.class_info else None
+                    if member_names and "_items" in member_names and "_size" in member_names:
+                        self._verify_list(record, problems)
+                if length != len(values):
+                    problems.append(
+                        f"Array #{object_id} at offset {record.start} declares {length} elements but has {len(values)}"
+                    )
+                if type(values) is not list:
+                    continue
+                children = []
+                for i, value in enumerate(values):
+                    if type(value) is Record:
+                        children.append(value)
+                    elif type(value) is Reference:
+                        if value.id_ref not in objects:
+                            problems.append(
+                                f"Reference at offset {record.member_span(i)[0]} to ObjectId {value.id_ref}, which "
+                                "doesn't exist"
+                            )
+                        if 0 <= value.id_ref < len(referenced):
+                            referenced[value.id_ref] = 1
+                        else:
+                            referenced_other.add(value.id_ref)
+                if children:
+                    children.reverse()
+                    stack.extend(children)
+
+        for record in records:
+            object_id = record.object_id
+            if object_id is None:
+                continue
+            if not (referenced[object_id] if 0 <= object_id < len(referenced) else object_id in referenced_other):
+                problems.append(
+                    f"Top-level object #{record.object_id} at offset {record.start} isn't referenced by any other "
+                    "object"
+                )
+        return problems
+
+    def _verify_list(self, record, problems):
+        items = self.resolve(record.member("_items"))
+        size = record.member("_size")
+        if isinstance(items, Record) and items.values is not None and not 0 <= size <= len(items.values):
+            problems.append(
+                f"List #{record.object_id} at offset {record.start} has _size {size}, but room for "
+                f"{len(items.values)} items"
+            )
+
+    def _add(self, records):
+        touched = set()
+        for record in iter_records(records):
+            if record.object_id is not None:
+                self.objects[record.object_id] = record
+                if record.object_id >= self._next_object_id:
+                    self._next_object_id = record.object_id + 1
+            if record.member_names:
+                for name in record.member_names:
+                    self.members.setdefault(name, []).append(record)
+                    touched.add(name)
+        return touched
+
+    def _remove(self, records):
+        removed = set()
+        touched = set()
+        for record in iter_records(records):
+            removed.add(id(record))
+            if record.object_id is not None and self.objects.get(record.object_id) is record:
+                del self.objects[record.object_id]
+            if record.member_names:
+                touched.update(record.member_names)
+        for name in touched:
+            self.members[name] = [record for record in self.members[name] if id(record) not in removed]
+        return touched
+
+    def update(self, buf, start, old_end, new_end):
+        """
+        Bring the indexes in step after the bytes [start, old_end) of the savegame were replaced by the bytes
+        [start, new_end) of `buf`.
+        """
+        delta = new_end - old_end
+        first = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        self.reader.buf = buf
+        pos = self.starts[first]
+        new_records = []
+        while True:
+            record, pos = self.reader.read_record(pos)
+            new_records.append(record)
+            if record.record_type == RECORD_TYPE_ENUM["MessageEnd"]:
+                last = len(self.records)
+                break
+            if pos >= new_end:
+                last = bisect.bisect_left(self.starts, pos - delta, lo=first + 1)
+                if last < len(self.starts) and self.starts[last] == pos - delta and self.starts[last] >= old_end:
+                    break
+            if pos >= len(buf):
+                raise NrbfError(f"Stream ended at offset {pos} without a MessageEnd record")
+
+        touched = self._remove(self.records[first:last])
+        if delta:
+            for record in iter_records(self.records[last:]):
+                for shifted in (record.prefix or []) + [record]:
+                    shifted.start += delta
+                    shifted.end += delta
+        self.records[first:last] = new_records
+        self.starts = [record.start for record in self.records]
+        touched |= self._add(new_records)
+        for name in touched:
+            self.members[name].sort(key=lambda record: record.start)
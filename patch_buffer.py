@@ -0,0 +1,181 @@
+"""
+Edit buffer for the savegame bytes.
+
+Writes that keep the length of the savegame the same (gold, experience, scenario states, ...) go straight into a
+bytearray. Splices that change the length (event decks, personal quests, chests) are kept in a piece table, so they
+only cost the size of the new bytes plus the number of splices made so far. The pieces are joined into one buffer the
+first time the whole savegame is needed again, e.g. for a regex scan or when it is saved.
+
+A read-only buffer wraps its data (e.g. an mmap of the savegame) without copying it.
+"""
+import bisect
+
+
+class PatchBuffer:
+    def __init__(self, data, readonly=False):
+        self.readonly = readonly
+        self._base = data if readonly else bytearray(data)
+        # [buffer, start, stop] slices that make up the savegame while splices are pending, and their offsets
+        self._pieces = None
+        self._piece_starts = None
+        self._length = len(self._base)
+        # (start, old end, new end) of the region that changed since the last call to `take_changes`
+        self._changes = None
+        # Whether anything changed since the buffer was created or last marked clean
+        self.dirty = False
+        # Whether a splice changed the length since the buffer was created or last marked clean
+        self.resized = False
+        # Number of bytes copied into or out of the buffer, for instrumentation
+        self.bytes_copied = 0
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def has_pending_splices(self):
+        return self._pieces is not None
+
+    def mark_clean(self):
+        self.dirty = False
+        self.resized = False
+
+    def _check_writable(self):
+        if self.readonly:
+            raise Exception("The savegame was opened read-only!")
+
+    def getvalue(self):
+        """Return the savegame as a single buffer, joining pending splices into it first."""
+        if self._pieces is not None:
+            self.bytes_copied += self._length
+            self._base = bytearray().join(memoryview(buf)[start:stop] for buf, start, stop in self._pieces)
+            self._pieces = None
+            self._piece_starts = None
+        return self._base
+
+    def read(self, start, end):
+        """Return the bytes [start, end) without joining pending splices."""
+        self.bytes_copied += max(min(end, self._length) - start, 0)
+        if self._pieces is None:
+            return bytes(self._base[start:end])
+        out = bytearray()
+        i = bisect.bisect_right(self._piece_starts, start) - 1
+        while start < end and i < len(self._pieces):
+            buf, piece_start, piece_stop = self._pieces[i]
+            offset = piece_start + start - self._piece_starts[i]
+            chunk = buf[offset : min(piece_stop, offset + end - start)]
+            out += chunk
+            start += len(chunk)
+            i += 1
+        return bytes(out)
+
+    def write(self, offset, data):
+        """Overwrite len(data) bytes at `offset`. Writing the bytes that are already there doesn't count as a change."""
+        self._check_writable()
+        end = offset + len(data)
+        if end > self._length:
+            raise IndexError(f"Write of {len(data)} bytes at offset {offset} runs past the end of the savegame")
+        if self.read(offset, end) == data:
+            return
+        self.bytes_copied += len(data)
+        if self._pieces is None:
+            self._base[offset:end] = data
+        else:
+            i = bisect.bisect_right(self._piece_starts, offset) - 1
+            pos = offset
+            while pos < end:
+                buf, piece_start, piece_stop = self._pieces[i]
+                buf_offset = piece_start + pos - self._piece_starts[i]
+                n = min(piece_stop - buf_offset, end - pos)
+                buf[buf_offset : buf_offset + n] = data[pos - offset : pos - offset + n]
+                pos += n
+                i += 1
+        self._record_change(offset, end, end)
+
+    def splice(self, start, end, data):
+        """Replace the bytes [start, end) with `data`, which may have a different length."""
+        if len(data) == end - start:
+            self.write(start, data)
+            return
+        self._check_writable()
+        self.bytes_copied += len(data)
+        if self._pieces is None:
+            self._pieces = [[self._base, 0, len(self._base)]]
+            self._piece_starts = [0]
+        first = self._split(start)
+        last = self._split(end)
+        new_pieces = [[bytearray(data), 0, len(data)]] if data else []
+        self._pieces[first:last] = new_pieces
+        self._piece_starts[first:] = [0] * (len(self._pieces) - first)
+        pos = self._piece_starts[first - 1] + self._piece_length(first - 1) if first else 0
+        for i in range(first, len(self._pieces)):
+            self._piece_starts[i] = pos
+            pos += self._piece_length(i)
+        self._length += len(data) - (end - start)
+        self.resized = True
+        self._record_change(start, end, start + len(data))
+
+    def _piece_length(self, i):
+        return self._pieces[i][2] - self._pieces[i][1]
+
+    def _split(self, offset):
+        """Make sure a piece starts at `offset` and return its index."""
+        i = bisect.bisect_right(self._piece_starts, offset) - 1
+        if i < 0:
+            return 0
+        if self._piece_starts[i] == offset:
+            return i
+        if i == len(self._pieces) - 1 and offset >= self._piece_starts[i] + self._piece_length(i):
+            return len(self._pieces)
+        buf, piece_start, piece_stop = self._pieces[i]
+        cut = piece_start + offset - self._piece_starts[i]
+        self._pieces[i : i + 1] = [[buf, piece_start, cut], [buf, cut, piece_stop]]
+        self._piece_starts.insert(i + 1, offset)
+        return i + 1
+
+    def _record_change(self, start, old_end, new_end):
+        self.dirty = True
+        if self._changes is None:
+            self._changes = (start, old_end, new_end)
+            return
+        # Merge into one region: [lo, old_hi) of the untouched savegame is [lo, new_hi) of the current one
+        lo, old_hi, new_hi = self._changes
+        current_hi = max(new_hi, old_end)
+        self._changes = (
+            min(lo, start),
+            old_hi + current_hi - new_hi,
+            current_hi + (new_end - old_end),
+        )
+
+    def take_changes(self):
+        """Return the (start, old end, new end) region changed since the last call, or None, and reset it."""
+        changes, self._changes = self._changes, None
+        return changes
+
+
+def _common_length(old, new, limit, reverse=False):
+    """Length of the common prefix (or suffix) of two memoryviews, at most `limit`, compared in halving blocks."""
+    length, size = 0, 1 << 16
+    while size:
+        while length + size <= limit and (
+            old[len(old) - length - size:len(old) - length] == new[len(new) - length - size:len(new) - length]
+            if reverse
+            else old[length:length + size] == new[length:length + size]
+        ):
+            length += size
+        size >>= 1
+    return length
+
+
+def changed_region(old, new):
+    """
+    Find the region in which two versions of the savegame differ, by skipping their common prefix and suffix.
+    :return: (start, old end, new end) such that replacing old[start:old end] with new[start:new end] turns `old` into
+        `new`, or None if they are equal
+    """
+    old, new = memoryview(old), memoryview(new)
+    limit = min(len(old), len(new))
+    start = _common_length(old, new, limit)
+    if start == len(old) == len(new):
+        return None
+    suffix = _common_length(old, new, limit - start, reverse=True)
+    return start, len(old) - suffix, len(new) - suffix
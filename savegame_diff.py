@@ -0,0 +1,239 @@
+"""
+Show what changed between two versions of a savegame, e.g. what a session of the game or an edit did.
+
+    python savegame_diff.py old.dat new.dat
+    python savegame_diff.py --root-dir "<...>/GloomSaves/Campaign" --campaign <campaign folder> [<backup id> ...]
+
+With --campaign, the given backups (see `SaveGameEditor.list_backups`; "current" is the savegame on disk) are diffed
+one after the other, by default the whole chain of backups followed by the current savegame.
+
+Every diff has the semantic changes (campaign values, characters, scenario states, event and personal quest decks and
+looted chests) and the records that changed, aligned by ObjectId. A chain of versions is read into a single record
+index: every next version only splices in the region in which it differs from the previous one, so only the records in
+that region are read again.
+"""
+import argparse
+import bisect
+import json
+
+from backup_store import BackupStore
+from nrbf import RECORD_TYPE_ENUM, Record, Reference, iter_records
+from savegame_editor import SaveGameEditor
+
+
+def summarize(editor):
+    """
+    :return: dict with the campaign values, characters, scenario states, event decks, personal quest deck and looted
+        chests of the savegame, see `snapshot.CampaignSnapshot.to_dict`
+    """
+    return editor.snapshot().to_dict()
+
+
+def _change(what, old, new):
+    return {"what": what, "old": old, "new": new}
+
+
+def diff_summaries(old, new):
+    """
+    :param old: summary of the old savegame, see `summarize`
+    :param new: summary of the new savegame
+    :return: list of semantic changes, every change is a dict with "what" changed and its "old" and "new" value
+    """
+    changes = []
+    for field, name in (("donated", "Gold donated"), ("prosperity", "Prosperity"), ("reputation", "Reputation")):
+        if old[field] != new[field]:
+            changes.append(_change(name, old[field], new[field]))
+
+    for char in sorted(old["characters"].keys() | new["characters"].keys()):
+        old_values, new_values = old["characters"].get(char), new["characters"].get(char)
+        if old_values is None or new_values is None:
+            presence = ["absent" if values is None else "present" for values in (old_values, new_values)]
+            changes.append(_change(char, *presence))
+            continue
+        for field, value in new_values.items():
+            if old_values[field] != value:
+                changes.append(_change(f"{char} {field}", old_values[field], value))
+
+    for scenario in sorted(old["scenarios"].keys() | new["scenarios"].keys()):
+        old_state, new_state = old["scenarios"].get(scenario), new["scenarios"].get(scenario)
+        if old_state != new_state:
+            changes.append(_change(f"Scenario {scenario}", old_state, new_state))
+
+    for field, name in (
+        ("city_events", "City event deck"),
+        ("road_events", "Road event deck"),
+        ("personal_quests", "Personal quest deck"),
+    ):
+        if old[field] != new[field]:
+            changes.append(_change(name, " ".join(old[field]), " ".join(new[field])))
+
+    added = sorted(set(new["looted_chests"]).difference(old["looted_chests"]))
+    removed = sorted(set(old["looted_chests"]).difference(new["looted_chests"]))
+    if added:
+        changes.append(_change("Looted chests added", None, added))
+    if removed:
+        changes.append(_change("Looted chests removed", removed, None))
+    return changes
+
+
+def _plain(value):
+    """Turn a record value into something that can be compared and shown: strings by their value, other nested
+    records by their ObjectId (they are compared on their own) or their values"""
+    if isinstance(value, Record):
+        if value.record_type == RECORD_TYPE_ENUM["BinaryObjectString"]:
+            return value.value
+        if value.object_id is not None:
+            return f"#{value.object_id}"
+        return [_plain(v) for v in value.values or ()]
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, Reference):
+        return f"-> #{value.id_ref}"
+    return value
+
+
+def _records_in(index, start, end):
+    """:return: the top-level records of the index that overlap [start, end), including their nested records"""
+    first = max(bisect.bisect_right(index.starts, start) - 1, 0)
+    last = bisect.bisect_left(index.starts, max(end, start + 1))
+    return {
+        record.object_id: record for record in iter_records(index.records[first:last]) if record.object_id is not None
+    }
+
+
+def _record_type(record):
+    return record.class_info.name if record.class_info else record.type_name
+
+
+def diff_records(old_records, new_records):
+    """
+    Align the records of two versions by ObjectId.
+    :param old_records: dict ObjectId -> record of the old version
+    :param new_records: dict ObjectId -> record of the new version
+    :return: list of record changes, every change is a dict with the "object_id", the "type" of the record (its class
+        name for class records), the "change" ("added", "removed" or "changed") and for changed records the "values"
+        that changed, as member name (or element index) -> [old, new]
+    """
+    changes = []
+    for object_id in sorted(old_records.keys() | new_records.keys()):
+        old, new = old_records.get(object_id), new_records.get(object_id)
+        if old is not None and new is not None and _record_type(old) != _record_type(new):
+            # The ObjectId was given to a different object
+            changes.append({"object_id": object_id, "type": _record_type(old), "change": "removed"})
+            old = None
+        if old is None or new is None:
+            change = "added" if old is None else "removed"
+            changes.append({"object_id": object_id, "type": _record_type(new or old), "change": change})
+            continue
+        if new.values is None:
+            values = {} if _plain(old.value) == _plain(new.value) else {"value": [_plain(old.value), _plain(new.value)]}
+        else:
+            names = new.member_names or range(max(len(old.values), len(new.values)))
+            values = {}
+            for i, name in enumerate(names):
+                old_value = _plain(old.values[i]) if i < len(old.values) else None
+                new_value = _plain(new.values[i]) if i < len(new.values) else None
+                if old_value != new_value:
+                    values[name] = [old_value, new_value]
+        if values:
+            changes.append({"object_id": object_id, "type": _record_type(new), "change": "changed", "values": values})
+    return changes
+
+
+def diff_chain(versions):
+    """
+    Diff every version of a savegame against the one before it, reading them all into a single record index.
+    :param versions: iterable of savegame bytes, oldest first
+    :return: generator of one diff per pair of consecutive versions, see `diff`
+    """
+    versions = iter(versions)
+    editor = SaveGameEditor(data=next(versions))
+    summary = summarize(editor)
+    for data in versions:
+        index = editor.index
+        region = editor.reload_savegame(data)
+        if region is None:
+            yield {"region": None, "changes": [], "records": []}
+            continue
+        start, old_end, new_end = region
+        old_records = _records_in(index, start, old_end)
+        new_summary = summarize(editor)
+        new_records = _records_in(editor.index, start, new_end)
+        yield {
+            "region": list(region),
+            "changes": diff_summaries(summary, new_summary),
+            "records": diff_records(old_records, new_records),
+        }
+        summary = new_summary
+
+
+def diff(a, b):
+    """
+    :param a: the old savegame, as bytes or the path of a savegame file
+    :param b: the new savegame
+    :return: dict with the "region" [start, old end, new end) in which the bytes differ (None if they are equal), the
+        semantic "changes" (see `diff_summaries`) and the changed "records" (see `diff_records`)
+    """
+    versions = []
+    for version in (a, b):
+        if isinstance(version, str):
+            with open(version, "rb") as f:
+                version = f.read()
+        versions.append(version)
+    return next(diff_chain(versions))
+
+
+def show_diff(result, title=None):
+    if title:
+        print(f"\n{title}")
+    if result["region"] is None:
+        print("    No changes")
+        return
+    start, old_end, new_end = result["region"]
+    print(f"    Bytes [{start}, {old_end}) -> [{start}, {new_end})")
+    for change in result["changes"]:
+        print(f"    {change['what']}: {change['old']} -> {change['new']}")
+    print(f"    {len(result['records'])} record(s) changed")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show what changed between versions of a savegame.")
+    parser.add_argument("savegames", nargs="*", help="two savegame files, or backup ids with --campaign")
+    parser.add_argument("--root-dir", default="./", help="folder that contains the campaign folders")
+    parser.add_argument("--campaign", help="diff backups of this campaign")
+    parser.add_argument("--json", action="store_true", help="print the diffs, including the changed records, as JSON")
+    args = parser.parse_args(argv)
+
+    if args.campaign:
+        store = BackupStore()
+        backup_ids = args.savegames or [backup["id"] for backup in store.list_backups(args.campaign)] + ["current"]
+        names = []
+        versions = []
+        for backup_id in backup_ids:
+            if backup_id == "current":
+                with open(f"{args.root_dir}/{args.campaign}/{args.campaign}.dat", "rb") as f:
+                    versions.append(f.read())
+            else:
+                versions.append(store.restore(args.campaign, backup_id))
+            names.append(backup_id[:12])
+    elif len(args.savegames) == 2:
+        names = args.savegames
+        versions = []
+        for path in names:
+            with open(path, "rb") as f:
+                versions.append(f.read())
+    else:
+        parser.error("give two savegame files, or a --campaign")
+
+    results = []
+    for (old, new), result in zip(zip(names, names[1:]), diff_chain(versions)):
+        if args.json:
+            results.append({"old": old, "new": new, **result})
+        else:
+            show_diff(result, f"{old} -> {new}")
+    if args.json:
+        print(json.dumps(results, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
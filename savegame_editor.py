@@ -1,18 +1,59 @@
+import mmap
+import os
 import re
-from datetime import datetime
+from array import array
 import struct
-from IPython.display import display
-import pandas as pd
+import tempfile
+
+from backup_store import BackupStore
+from edit_history import EditHistory, undoable
+from nrbf import (
+    RECORD_TYPE_ENUM,
+    NrbfError,
+    Record,
+    RecordIndex,
+    RecordWriter,
+    Reference,
+    write_records,
+)
+from patch_buffer import PatchBuffer, changed_region
+from snapshot import CampaignSnapshot, CampaignValues, Character, Deck, Scenario
 
 
 class SaveGameEditor:
-    def __init__(self, ext=".dat", root_dir=None, campaign=None):
+    char_fields = ("gold", "exp", "perk_points", "perk_checks")
+    _char_info_pattern = re.compile(b"(?s:.)*?ID(.*)\n\n")
+    _scenario_pattern = re.compile(b"\x12Quest_Campaign_([0-9]{3})([\\s\\S]*?\x00\x00\x00)\t")
+    _event_pattern = re.compile("Event_(City|Road)_Campaign_([a-zA-Z0-9]*)ID")
+
+    def __init__(self, ext=".dat", root_dir=None, campaign=None, backup_store=None, read_only=False, data=None):
+        """
+        :param backup_store: BackupStore the savegame is backed up to when it's opened, by default one in
+            ~/.gloomhaven-savegame-editor/backups (outside of the game's save directory)
+        :param read_only: memory-map the savegame instead of reading it into memory; edits and saves raise an
+            Exception, and no backup is made
+        :param data: savegame bytes to open instead of reading the savegame file, e.g. a backup; no backup is made
+        """
         self.root_dir = root_dir
         self.campaign = campaign
         self.file = f"{self.root_dir}/{self.campaign}/{self.campaign}{ext}"
-        self._read_savegame()
-        self._save_backup_savegame()
-        self._dat_to_json()
+        self.backup_store = backup_store or BackupStore()
+        self.read_only = read_only
+        self.backup_id = None
+        if data is not None:
+            self.buffer = PatchBuffer(data)
+        else:
+            self._read_savegame()
+            if not read_only:
+                self.backup()
+        # Undo/redo history of the edits made since the savegame was opened, see `undo`
+        self.history = EditHistory()
+        # The record index is only built when a feature first needs it, see `index`
+        self._index = None
+        self._roster = None
+        self._scenario_table = None
+        # event -> ObjectIds of its deck and discard deck arrays, see `_get_event_decks`
+        self._event_decks = {}
         self.scenario_state_dict = {
             0: "None",
             1: "Locked",
@@ -22,73 +63,250 @@ class SaveGameEditor:
             5: "Blocked",
             6: "InProgressCasual",
         }
-        self.recordtype_enum = {
-            "SerializedStreamHeader": 0,
-            "ClassWithId": 1,
-            "SystemClassWithMembers": 2,
-            "ClassWithMembers": 3,
-            "SystemClassWithMembersAndTypes": 4,
-            "ClassWithMembersAndTypes": 5,
-            "BinaryObjectString": 6,
-            "BinaryArray": 7,
-            "MemberPrimitiveTyped": 8,
-            "MemberReference": 9,
-            "ObjectNull": 10,
-            "MessageEnd": 11,
-            "BinaryLibrary": 12,
-            "ObjectNullMultiple256": 13,
-            "ObjectNullMultiple": 14,
-            "ArraySinglePrimitive": 15,
-            "ArraySingleObject": 16,
-            "ArraySingleString": 17,
-            "ArrayOfType": 18,
-            "MethodCall": 19,
-            "MethodReturn": 20,
-        }
+        self.scenario_state_ids = {v: k for k, v in self.scenario_state_dict.items()}
+        self.recordtype_enum = RECORD_TYPE_ENUM
 
-    def _save_backup_savegame(self):
-        now_str = datetime.now().strftime("%Y%m%d-%H%M%S")
-        with open(f"{self.file}-backup-{now_str}", "wb") as f:
-            f.write(self.txt)
+    def backup(self, note=None):
+        """
+        Back up the savegame as it is in the editor, e.g. before changing a version the game just saved. Nothing is
+        written if it's identical to the latest backup.
+        :param note: optional note to list with the backup
+        :return: the backup id
+        """
+        self.backup_id = self.backup_store.backup(self.campaign, self.txt, note=note)
+        return self.backup_id
+
+    def list_backups(self):
+        return self.backup_store.list_backups(self.campaign)
+
+    def restore_backup(self, backup_id):
+        """
+        Overwrite the savegame with a backup and reload it. Unsaved edits are lost, but the savegame as it was on disk
+        is backed up first.
+        :param backup_id: id of the backup (see `list_backups`), or an unambiguous prefix of it
+        """
+        if self.read_only:
+            raise Exception("The savegame was opened read-only!")
+        data = self.backup_store.restore(self.campaign, backup_id)
+        self._read_savegame()
+        self.backup()
+        self.buffer = PatchBuffer(data)
+        # The record index and the cached lookups belong to the replaced buffer, and saving verifies with the index
+        self._invalidate_caches(index=True)
+        self.save_savegame(force=True)
+        self.history.clear()
+        self.backup(note="restored")
+        print(f"Restored backup {self.backup_id[:12]}")
+
+    def reload_savegame(self, data=None):
+        """
+        Read the savegame from disk again, e.g. after the game saved it. Only the region that differs from the buffer
+        is spliced in, so the record index only re-reads the records in that region. Unsaved edits are lost.
+        :param data: savegame bytes to load instead of reading the savegame file, e.g. the next version in a chain of
+            backups
+        :return: (start, old end, new end) of the region that changed, or None if the savegame is unchanged
+        """
+        if self.read_only:
+            raise Exception("The savegame was opened read-only!")
+        if data is None:
+            with open(self.file, "rb") as f:
+                data = f.read()
+        region = changed_region(self.buffer.getvalue(), data)
+        if region is not None:
+            start, old_end, new_end = region
+            self._replace_substring_inplace(data[start:new_end], (start, old_end))
+            # The game may have renumbered the ObjectIds, or moved entries without changing the length
+            self._invalidate_caches()
+        # The edits were undone by reading the savegame again
+        self.history.clear()
+        self.buffer.mark_clean()
+        return region
+
+    def _invalidate_caches(self, index=False, event_decks=True):
+        """
+        Forget what was looked up in the savegame (the roster, the scenario table and the event decks), after edits
+        that may have moved or renumbered its records.
+        :param index: also drop the record index, so that it is built from scratch the next time it is used
+        :param event_decks: also forget the ObjectIds of the event decks; they stay valid as long as no ObjectIds are
+            renumbered
+        """
+        if index:
+            self._index = None
+        if event_decks:
+            self._event_decks = {}
+        self._roster = None
+        self._scenario_table = None
 
     def _read_savegame(self):
         with open(self.file, "rb") as f:
-            self.txt = f.read()
-
-    def save_savegame(self):
-        with open(self.file, "wb") as f:
-            f.write(self.txt)
-
-    def _read_events(self):
-        res = re.search(b"(?s)_City_Campaign_[a-zA-Z0-9]*ID(?!.{6}E)", self.txt)
-        city_pattern = b"Event_City_Campaign_([a-zA-Z0-9]*)ID"
-        self.city_events = [n for n in re.findall(city_pattern, self.txt[: res.span()[1]])]
-        self.n_city_events = len(self.city_events)
-        res = re.search(b"(?s)_Road_Campaign_[a-zA-Z0-9]*ID(?!.{6}E)", self.txt)
-        road_pattern = b"Event_Road_Campaign_([a-zA-Z0-9]*)ID"
-        self.road_events = [n for n in re.findall(road_pattern, self.txt[: res.span()[1]])]
-        self.n_road_events = len(self.road_events)
+            if self.read_only:
+                self.buffer = PatchBuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), readonly=True)
+            else:
+                self.buffer = PatchBuffer(f.read())
 
-    @staticmethod
-    def _replace_substring_inplace(txt, substr, span):
-        return txt[: span[0]] + substr + txt[span[1] :]
+    @property
+    def txt(self):
+        return self.buffer.getvalue()
+
+    def save_savegame(self, force=False, verify=True):
+        """
+        Write the savegame if anything was changed. The new savegame is written to a temporary file next to it, which
+        then replaces the savegame in one step, so the game never sees a partially written file.
+        :param force: also write the savegame if nothing was changed
+        :param verify: check the structure of the savegame first (see `verify_savegame`) and refuse to write it if it
+            is malformed, since the game may not be able to load it anymore. Skipped when the record index was never
+            built and all edits kept the length of the savegame, i.e. only fixed-width values were overwritten
+        :return: True if the savegame was written
+        """
+        if self.read_only:
+            raise Exception("The savegame was opened read-only!")
+        if not (self.buffer.dirty or force):
+            return False
+        if verify and (self._index is not None or self.buffer.resized):
+            problems = self.verify_savegame()
+            if problems:
+                raise Exception("Refusing to write a malformed savegame:\n" + "\n".join(problems))
+        folder, name = os.path.split(self.file)
+        fd, tmp_file = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.buffer.getvalue())
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_file, os.stat(self.file).st_mode & 0o777)
+            os.replace(tmp_file, self.file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+        self.buffer.mark_clean()
+        return True
+
+    def verify_savegame(self):
+        """
+        Check that the savegame is still a well-formed MS-NRBF stream after it was edited, see `RecordIndex.verify`.
+        Only the records in the edited regions are read again to bring the record index up to date, the checks are a
+        single pass over the records.
+        :return: list of the problems found, empty if the savegame is well-formed
+        """
+        try:
+            index = self.index
+        except (NrbfError, struct.error, IndexError, ValueError) as e:
+            # The index is half updated, so build it from scratch next time
+            self._index = None
+            return [f"The savegame can't be read: {e}"]
+        return index.verify(self.txt)
+
+    def undo(self, steps=1):
+        """
+        Undo the last edits, e.g. a `prioritise_personal_quests` with the wrong order. Every call of an editing method
+        is one step, and undoing it only splices back the bytes it replaced.
+        :param steps: number of steps to undo
+        :return: descriptions of the undone steps, latest first
+        """
+        return self._replay(self.history.undo_steps(steps))
+
+    def redo(self, steps=1):
+        """
+        Redo edits that were undone, as long as no other edit was made since.
+        :param steps: number of steps to redo
+        :return: descriptions of the redone steps
+        """
+        return self._replay(self.history.redo_steps(steps))
+
+    def checkpoint(self, name):
+        """Name the current state of the savegame, to go back (or forward) to it with `restore_checkpoint`."""
+        self.history.checkpoint(name)
+
+    def restore_checkpoint(self, name):
+        """
+        Undo or redo the edits up to a checkpoint.
+        :return: descriptions of the undone or redone steps
+        """
+        steps = self.history.position_of(name) - self.history.position
+        return self.redo(steps) if steps >= 0 else self.undo(-steps)
+
+    def _replay(self, steps):
+        for _, splices in steps:
+            for start, end, data in splices:
+                self.buffer.splice(start, end, data)
+        # ObjectIds and offsets of the decks, the roster and the scenarios may be back to what they were
+        self._invalidate_caches()
+        return [description for description, _ in steps]
+
+    def instrument(self, on_call=None):
+        """
+        Measure wall time, call counts, bytes scanned by regular expressions and bytes copied per method, while the
+        returned context manager is active:
+
+            with editor.instrument() as stats:
+                editor.toggle_scenario_status(scenario=90, status="Unlocked")
+            print(stats.to_json())
+
+        :param on_call: optional tracing hook, see `instrumentation.Instrumentation`
+        :return: an `instrumentation.Instrumentation`
+        """
+        from instrumentation import Instrumentation
+
+        return Instrumentation(self, on_call=on_call)
+
+    def close(self):
+        """Release the memory map of a savegame opened read-only."""
+        if self.read_only:
+            self._index = None
+            self.buffer.getvalue().close()
+
+    def snapshot(self):
+        """
+        Read the whole state of the campaign without printing anything. The record index is brought up to date once,
+        and the decks and chests are all read from it.
+        :return: a `snapshot.CampaignSnapshot`; see `CampaignSnapshot.to_dict` for a JSON-serializable version
+        """
+        return CampaignSnapshot(
+            values=self.get_campaign_values(),
+            characters=self.get_party(),
+            scenarios=self.get_scenarios(),
+            city_events=self.get_event_deck("city"),
+            road_events=self.get_event_deck("road"),
+            personal_quests=self.get_personal_quest_deck(),
+            looted_chests=self.get_looted_chests(),
+        )
+
+    def get_event_deck(self, event="city"):
+        """
+        :param event: "city" or "road"
+        :return: the event deck as a `snapshot.Deck`, with the event numbers in the order they will be drawn
+        """
+        deck, _ = self._get_event_decks(event)
+        cards = []
+        for element in deck.values:
+            event_match = self._is_string(element) and self._event_pattern.fullmatch(self._resolve(element).value)
+            if event_match:
+                cards.append(event_match.group(2))
+        return Deck(event, cards)
+
+    def _replace_substring_inplace(self, substr, span):
+        # Edits are only recorded in the buffer; the record index catches up the next time it is used
+        old = self.buffer.read(*span)
+        self.buffer.splice(span[0], span[1], substr)
+        if old != substr:
+            self.history.record(span[0], old, bytes(substr))
+        if len(substr) != span[1] - span[0]:
+            # offsets after the edit have moved, the ObjectIds of the decks haven't
+            self._invalidate_caches(event_decks=False)
 
     @staticmethod
-    def _prettify_events(events):
-        return " ".join([e.decode("utf-8") for e in events])
+    def _print_event_deck(deck):
+        print(f"{len(deck.cards)} {deck.name.capitalize()} Events:")
+        print(f"Current order: {' '.join(deck.cards)}")
+        print(f"Sorted: {' '.join(sorted(deck.cards))}")
 
     def show_events_info(self, event=None):
-        self._read_events()
         if event == "city" or event is None:
-            print(f"{self.n_city_events} City Events:")
-            print(f"Current order: {self._prettify_events(self.city_events)}")
-            print(f"Sorted: {self._prettify_events(sorted(self.city_events))}")
+            self._print_event_deck(self.get_event_deck("city"))
         if event is None:
             print("")
         if event == "road" or event is None:
-            print(f"{self.n_road_events} Road Events:")
-            print(f"Current order: {self._prettify_events(self.road_events)}")
-            print(f"Sorted: {self._prettify_events(sorted(self.road_events))}")
+            self._print_event_deck(self.get_event_deck("road"))
 
     @staticmethod
     def _get_events_span(events_txt, event="city"):
@@ -102,114 +320,257 @@ class SaveGameEditor:
     def _next_power_of_2(x, min_power=2):
         return max(2**min_power, 1 if x == 0 else 2 ** (x - 1).bit_length())
 
+    @undoable
     def replace_events(self, event="city", new_events=None, verbose=True):
-        event_capital = b"City" if event == "city" else b"Road"
         if not new_events:
             print("You didn't specify new events to replace the existing events with!")
             return
+        self._apply_patches(self._build_events_patch(event, new_events))
+        # The new order is known, so it is printed without bringing the record index up to date with the edit
+        self._print_event_deck(Deck(event, [str(new_event) for new_event in new_events]))
 
-        # Find the location of the event data within the full text
-        events_start_index = (
-            list(re.finditer(b"Event_" + event_capital + b"_Campaign_[a-zA-Z0-9]*ID", self.txt))[0].start() - 10
-        )
-        events_end_index = (
-            list(
-                re.finditer(
-                    b"(?s)_Campaign_[a-zA-Z0-9]*ID(?!(\n|\r.)*.{6}E)((?:\n|\r.)*)", self.txt[events_start_index:]
-                )
-            )[0].end()
-            + events_start_index
-        )
+    def _get_event_decks(self, event):
+        """
+        Get the arrays of the event deck and its discard deck. They are only searched for the first time; after that
+        their ObjectIds are kept, and the index keeps their records and offsets current when edits move them.
+        :return: the deck and discard deck array records; the discard deck is None if there is none
+        """
+        ids = self._event_decks.get(event)
+        objects = self.index.objects
+        if ids is None or any(object_id is not None and object_id not in objects for object_id in ids):
+            deck, discard = self._find_event_decks(event)
+            ids = (deck.object_id, discard.object_id if discard is not None else None)
+            self._event_decks[event] = ids
+        return tuple(objects[object_id] if object_id is not None else None for object_id in ids)
 
-        # Get first BinaryObjectString object ID
-        first_event_object_id = struct.unpack("<I", self.txt[events_start_index + 5 : events_start_index + 9])[0]
-
-        # Number of events submitted
-        n_events = len(new_events)
-
-        # Create the new events txt
-        # define the length of the array in which to store the events, which should be a power of 2
-        array_length = self._next_power_of_2(n_events)  # define the length of the a
-        new_events_txt = struct.pack("<I", array_length)  # the length of the array in little endian
-
-        # Create string excluding ID
-        event_string_noid = b"Event_" + event_capital + b"_Campaign_"
-
-        # now add the stuff for each event
-        for i, new_event in enumerate(new_events):
-            # record type 6
-            new_events_txt += b"\x06"
-            # first BinaryObjectString object ID--applied to every BinaryObjectString in array
-            new_events_txt += struct.pack("<I", first_event_object_id + i)
-            # the length of the string defining the event
-            new_events_txt += len(event_string_noid.decode("utf-8") + str(new_event) + "ID").to_bytes(1, "little")
-            new_events_txt += event_string_noid + bytes(str(new_event), "utf-8") + b"ID"
-        if array_length - n_events > 1:
-            n_nulls = array_length - n_events
-            # If there is more than one space left in the array, add a ObjectNullMultiple256 (13 = \r)
-            # and the number of nulls to add
-            new_events_txt += b"\r" + n_nulls.to_bytes(1, "little")
-        elif array_length - n_events == 1:
-            # If there is exactly one space left in the array, add a single null (10 = \n)
-            new_events_txt += b"\n"
-        else:
-            # If there are no spaces left in the array, we're finished
-            pass
+    def _find_event_decks(self, event):
+        """
+        Find the arrays of the event deck and its discard deck: the deck is the first array with events of this type,
+        and the discard deck the array right behind it, if that only holds events of the same type
+        """
+        event_capital = "City" if event == "city" else "Road"
+
+        def is_event(element):
+            event_match = self._is_string(element) and self._event_pattern.fullmatch(self._resolve(element).value)
+            return bool(event_match) and event_match.group(1) == event_capital
 
-        # Check for discard deck.
-        # Next array in save file. Used to find end of discard deck if present.
-        next_deck = b"Event_Road_Campaign_" if event == "city" else b"PERSONALQUEST_"
+        records = self.index.records
+        for i, record in enumerate(records):
+            if record.record_type in (16, 17) and any(
+                is_event(element) for element in record.values if element is not None
+            ):
+                discard = records[i + 1] if i + 1 < len(records) else None
+                if not (
+                    discard is not None
+                    and discard.record_type in (16, 17)
+                    and all(is_event(element) for element in discard.values if element is not None)
+                ):
+                    discard = None
+                return record, discard
+        raise Exception(f"The {event} event deck was not found in the savegame!")
 
-        # Find the possible location of the event discard deck within the full text
-        discard_start_index = events_end_index
-        discard_end_index = (
-            list(re.finditer(next_deck, self.txt[discard_start_index:]))[0].start() - 15 + discard_start_index
+    def _resolve(self, value):
+        return self._get_obj_value(value.id_ref) if isinstance(value, Reference) else value
+
+    def _is_string(self, value, prefix=""):
+        value = self._resolve(value)
+        return (
+            isinstance(value, Record)
+            and value.record_type == self.recordtype_enum["BinaryObjectString"]
+            and value.value.startswith(prefix)
         )
 
-        # Test for presence of discard deck (is discard deck between event deck and next deck)
-        if discard_start_index != discard_end_index:
-            # add empty discard deck
-            discard_array_length = struct.unpack("<I", self.txt[discard_start_index + 5 : discard_start_index + 9])[0]
-            # array, object ID, array size
-            new_events_txt += self.txt[discard_start_index : discard_start_index + 9]
-            if discard_array_length > 1:
-                # If there is more than one space in the array, add a ObjectNullMultiple256 (13 = \r)
-                # and the number of nulls to add
-                new_events_txt += b"\r" + discard_array_length.to_bytes(1, "little")
-            elif discard_array_length == 1:
-                # If there is exactly one space in the array, add a single null (10 = \n)
-                new_events_txt += b"\n"
-            else:
-                # If there are no spaces left in the array, add no nulls. This case should not happen as it would
-                # softlock the game.
-                pass
-        else:
-            # If there is no discard deck, we're finished
-            pass
+    def _build_events_patch(self, event, new_events):
+        """
+        Build the patches that replace an event deck and empty its discard deck. Events that are already in either
+        deck keep their string record; new events get a fresh ObjectId.
+        :return: list of (span, new bytes, part) patches
+        """
+        deck, discard = self._get_event_decks(event)
+        strings = {}
+        for element in deck.values + (discard.values if discard is not None else []):
+            if self._is_string(element):
+                strings.setdefault(self._resolve(element).value, element)
+        event_capital = "City" if event == "city" else "Road"
+        elements = []
+        for new_event in new_events:
+            elements.append(strings.pop(f"Event_{event_capital}_Campaign_{new_event}ID", None))
+            if elements[-1] is None:
+                elements[-1] = self._new_string(f"Event_{event_capital}_Campaign_{new_event}ID")
+        # the length of the array in which to store the events should be a power of 2
+        patches = self._build_array_patches(deck, elements, self._next_power_of_2(len(elements)), "deck")
+        if discard is not None:
+            patches += self._build_array_patches(discard, [], len(discard.values), "discard deck")
+        return patches
+
+    def _new_string(self, value):
+        string = Record(self.recordtype_enum["BinaryObjectString"], 0, self.index.new_object_id())
+        string.value = value
+        return string
 
-        self.txt = self._replace_substring_inplace(self.txt, new_events_txt, (events_start_index, discard_end_index))
-        self.show_events_info(event=event)
+    def _get_list(self, array):
+        """Find the List<T> record whose `_items` is the given array, or None"""
+        for record, i in self._get_paths_to_member("_items"):
+            if record.values[i] == Reference(array.object_id):
+                return record
+        return None
+
+    def _build_array_patches(self, array, elements, capacity, part, list_record=None):
+        """
+        Build the patches that replace the elements of an array with `elements` followed by nulls up to `capacity`,
+        and that set the `_size` of the List<T> the array belongs to
+        :return: list of (span, new bytes, part) patches
+        """
+        if len(elements) > capacity:
+            raise Exception(f"There are more elements than fit in the {part}!")
+        new_array = Record(array.record_type, array.start, array.object_id)
+        new_array.class_info = array.class_info
+        new_array.value = array.value
+        new_array.values = list(elements) + [None] * (capacity - len(elements))
+        patches = [((array.start, array.end), bytes(RecordWriter().write_record(new_array)), part)]
+
+        list_record = list_record or self._get_list(array)
+        if list_record is not None and "_size" in list_record.member_names:
+            i = list_record.member_names.index("_size")
+            class_info = list_record.class_info
+            if class_info.binary_types and class_info.binary_types[i] == 0 and class_info.additional_infos[i] == 8:
+                patches.append((list_record.member_span(i), struct.pack("<i", len(elements)), f"{part} size"))
+        return patches
+
+    def _apply_patches(self, patches):
+        """Apply (span, new bytes, part) patches back to front, so that the spans of earlier patches stay valid"""
+        for span, new, _ in sorted(patches, key=lambda patch: patch[0], reverse=True):
+            self._replace_substring_inplace(new, span)
 
     def show_character_info(self, characters=None):
-        char_info = []
-        if characters:
-            for char in characters:
-                gold, exp, level, perks, checks = self.update_char_values(
-                    char_name=char, verbose=False, return_values=True
-                )
-                char_info.append(
-                    {
-                        "name": char,
-                        "gold": gold,
-                        "level": level,
-                        "experience": exp,
-                        "perk points available": perks,
-                        "perk checks": checks,
-                    }
-                )
+        char_info = [
+            {
+                "name": char.name,
+                "gold": char.gold,
+                "level": char.level,
+                "experience": char.exp,
+                "perk points available": char.perk_points,
+                "perk checks": char.perk_checks,
+            }
+            for char in self.get_party(characters).values()
+        ]
         print("\nInfo about current characters:")
+        # Only needed for the notebook, so scripts don't pay for importing them
+        from IPython.display import display
+        import pandas as pd
+
         display(pd.DataFrame(char_info).sort_values(by="experience", ascending=False))
 
+    def _get_roster(self):
+        """
+        Map the name of every character in the savegame to the spans of their gold, experience, level, perk points
+        and perk checks. The roster is built once from the character records and kept until an edit shifts offsets.
+        """
+        if self._roster is None:
+            roster = {}
+            for record, member in self._get_paths_to_member("CharacterName"):
+                name = record.values[member]
+                if record.class_info.name != "MapRuleLibrary.Party.CMapCharacter" or not isinstance(name, Record):
+                    continue
+                char_info = self._char_info_pattern.match(self.txt, name.end, record.end)
+                if char_info is None:
+                    continue
+                char_info_span = char_info.span(1)
+                roster[name.value] = {
+                    "gold": (char_info_span[0], char_info_span[0] + 4),
+                    "exp": (char_info_span[0] + 4, char_info_span[0] + 8),
+                    "level": (char_info_span[0] + 8, char_info_span[0] + 12),
+                    "perk_points": (char_info_span[1] - 12, char_info_span[1] - 8),
+                    "perk_checks": (char_info_span[1] - 8, char_info_span[1] - 4),
+                }
+            self._roster = roster
+        return self._roster
+
+    def _get_roster_entries(self, characters):
+        roster = self._get_roster()
+        unknown = [char for char in characters if char not in roster]
+        if unknown:
+            raise Exception(
+                f"The character(s) {', '.join(unknown)} weren't found in the savegame! Maybe a typo? "
+                f"Known characters: {', '.join(roster)}"
+            )
+        return {char: roster[char] for char in characters}
+
+    def get_characters(self, characters=None):
+        """
+        Read the values of several characters at once
+        :param characters: list of character names, or None for all characters in the savegame
+        :return: dict mapping each character name to a dict with their gold, exp, level, perk_points and perk_checks
+        """
+        roster = self._get_roster() if characters is None else self._get_roster_entries(characters)
+        return {
+            char: {field: struct.unpack("<I", self.buffer.read(*span))[0] for field, span in spans.items()}
+            for char, spans in roster.items()
+        }
+
+    def get_party(self, characters=None):
+        """
+        :param characters: list of character names, or None for all characters in the savegame
+        :return: dict mapping each character name to a `snapshot.Character`
+        """
+        return {char: Character(char, **values) for char, values in self.get_characters(characters).items()}
+
+    @undoable
+    def update_characters(self, characters, verbose=True):
+        """
+        Update the values of a whole party in one pass. All character names are checked before anything is written.
+        :param characters: dict mapping character names to a dict with any of gold, exp, perk_points and perk_checks,
+            e.g. {"Sol Goodman": {"gold": 91, "exp": 374}, "Emesh": {"perk_checks": 1}}
+        :param verbose: print what was changed for every character
+        :return: dict mapping each character name to {field: {"old": value, "new": value}} for all their fields
+        """
+        roster = self._get_roster_entries(characters)
+        for char, values in characters.items():
+            unknown_fields = set(values).difference(self.char_fields)
+            if unknown_fields:
+                raise Exception(f"Can't update {', '.join(sorted(unknown_fields))} of {char}!")
+
+        results = {}
+        for char, values in characters.items():
+            current = self.get_characters([char])[char]
+            for field, value in values.items():
+                if value is not None:
+                    self._replace_substring_inplace(struct.pack("<I", value), roster[char][field])
+            new = self.get_characters([char])[char]
+            results[char] = {field: {"old": current[field], "new": new[field]} for field in current}
+            if verbose:
+                self._print_char_update(char, values, results[char])
+        return results
+
+    @staticmethod
+    def _print_char_update(char_name, values, result):
+        if values.get("gold") is not None:
+            print(f"{char_name}'s gold amount was updated from {result['gold']['old']} to {result['gold']['new']}.")
+        else:
+            print(f"{char_name} currently has {result['gold']['old']} gold.")
+        if values.get("exp") is not None:
+            print(
+                f"{char_name}'s experience was updated from {result['exp']['old']} "
+                f"(level {result['level']['old']}) to {result['exp']['new']}."
+            )
+        else:
+            print(f"{char_name} currently is level {result['level']['old']} with {result['exp']['old']} experience.")
+        if values.get("perk_points") is not None:
+            print(
+                f"{char_name}'s available perk points was updated from {result['perk_points']['old']} "
+                f"to {result['perk_points']['new']}."
+            )
+        else:
+            print(f"{char_name} currently has {result['perk_points']['old']} available perk points.")
+        if values.get("perk_checks") is not None:
+            print(
+                f"{char_name}'s available perk checks was updated from {result['perk_checks']['old']} "
+                f"to {result['perk_checks']['new']}."
+            )
+        else:
+            print(f"{char_name} currently has {result['perk_checks']['old']} available perk checks.")
+
+    @undoable
     def update_char_values(
         self,
         char_name="Sol Goodman",
@@ -220,99 +581,90 @@ class SaveGameEditor:
         verbose=True,
         return_values=False,
     ):
-        char_info_span = re.search(bytes(char_name, "utf-8") + b"(?s:.)*?ID(.*)\n\n", self.txt).span(1)
-        gold_span = (char_info_span[0], char_info_span[0] + 4)
-        exp_span = (char_info_span[0] + 4, char_info_span[0] + 8)
-        level_span = (char_info_span[0] + 8, char_info_span[0] + 12)
-        perk_points_span = (char_info_span[1] - 12, char_info_span[1] - 8)
-        perk_checks_span = (char_info_span[1] - 8, char_info_span[1] - 4)
-        current_gold = struct.unpack("<I", self.txt[gold_span[0] : gold_span[1]])[0]
-        current_exp = struct.unpack("<I", self.txt[exp_span[0] : exp_span[1]])[0]
-        current_level = struct.unpack("<I", self.txt[level_span[0] : level_span[1]])[0]
-        current_perk_points = struct.unpack("<I", self.txt[perk_points_span[0] : perk_points_span[1]])[0]
-        current_perk_checks = struct.unpack("<I", self.txt[perk_checks_span[0] : perk_checks_span[1]])[0]
-        if gold is not None:
-            new_gold_str = struct.pack("<I", gold)
-            self.txt = self._replace_substring_inplace(self.txt, new_gold_str, gold_span)
-            new_gold = struct.unpack("<I", self.txt[gold_span[0] : gold_span[1]])[0]
-            if verbose:
-                print(f"{char_name}'s gold amount was updated from {current_gold} to {new_gold}.")
-        elif verbose:
-            print(f"{char_name} currently has {current_gold} gold.")
-        if exp is not None:
-            new_exp_str = struct.pack("<I", exp)
-            self.txt = self._replace_substring_inplace(self.txt, new_exp_str, exp_span)
-            new_exp = struct.unpack("<I", self.txt[exp_span[0] : exp_span[1]])[0]
-            if verbose:
-                print(f"{char_name}'s experience was updated from {current_exp} (level {current_level}) to {new_exp}.")
-        elif verbose:
-            print(f"{char_name} currently is level {current_level} with {current_exp} experience.")
-        if perk_points is not None:
-            new_perks_str = struct.pack("<I", perk_points)
-            self.txt = self._replace_substring_inplace(self.txt, new_perks_str, perk_points_span)
-            new_perk_points = struct.unpack("<I", self.txt[perk_points_span[0] : perk_points_span[1]])[0]
-            if verbose:
-                print(
-                    f"{char_name}'s available perk points was updated from {current_perk_points} to {new_perk_points}."
-                )
-        elif verbose:
-            print(f"{char_name} currently has {current_perk_points} available perk points.")
-        if perk_checks is not None:
-            perk_checks_str = struct.pack("<I", perk_checks)
-            self.txt = self._replace_substring_inplace(self.txt, perk_checks_str, perk_checks_span)
-            new_perk_checks = struct.unpack("<I", self.txt[perk_checks_span[0] : perk_checks_span[1]])[0]
-            if verbose:
-                print(
-                    f"{char_name}'s available perk checks was updated from {current_perk_checks} to {new_perk_checks}."
-                )
-        elif verbose:
-            print(f"{char_name} currently has {current_perk_checks} available perk checks.")
+        values = {"gold": gold, "exp": exp, "perk_points": perk_points, "perk_checks": perk_checks}
+        result = self.update_characters({char_name: values}, verbose=verbose)[char_name]
         if return_values:
-            return (
-                gold or current_gold,
-                exp or current_exp,
-                current_level,
-                perk_points or current_perk_points,
-                perk_checks or current_perk_checks,
-            )
+            return tuple(result[field]["new"] for field in ("gold", "exp", "level", "perk_points", "perk_checks"))
+
+    def _get_scenario_table(self):
+        """
+        Offsets of the state of every scenario, indexed by scenario number, with -1 for numbers that aren't in the
+        savegame. Only the first occurrence of a scenario counts. The table is built with one scan over the savegame
+        and kept until an edit shifts offsets.
+        """
+        if self._scenario_table is None:
+            scenario_table = array("l")
+            for scenario in self._scenario_pattern.finditer(self.txt):
+                scenario_nbr = int(scenario.group(1))
+                if scenario_nbr >= len(scenario_table):
+                    scenario_table.extend([-1] * (scenario_nbr + 1 - len(scenario_table)))
+                if scenario_table[scenario_nbr] == -1:
+                    scenario_table[scenario_nbr] = scenario.end(2) - 4
+            self._scenario_table = scenario_table
+        return self._scenario_table
+
+    def get_scenario_states(self, scenarios=None):
+        """
+        Read the state of several scenarios at once
+        :param scenarios: list of scenario numbers, or None for all scenarios in the savegame
+        :return: dict mapping each scenario number to its state, e.g. {1: "Completed", 2: "Unlocked"}
+        """
+        scenario_table = self._get_scenario_table()
+        if scenarios is None:
+            scenarios = [nbr for nbr, offset in enumerate(scenario_table) if offset != -1]
+        missing = [nbr for nbr in scenarios if nbr >= len(scenario_table) or scenario_table[nbr] == -1]
+        if missing:
+            raise Exception(f"Scenario(s) {', '.join(str(s) for s in missing)} weren't found in the savegame!")
+        txt = self.txt
+        return {
+            nbr: self.scenario_state_dict[struct.unpack_from("<I", txt, scenario_table[nbr])[0]] for nbr in scenarios
+        }
 
+    def get_scenarios(self, scenarios=None):
+        """
+        :param scenarios: list of scenario numbers, or None for all scenarios in the savegame
+        :return: dict mapping each scenario number to a `snapshot.Scenario`
+        """
+        return {nbr: Scenario(nbr, state) for nbr, state in self.get_scenario_states(scenarios).items()}
+
+    @undoable
+    def set_scenario_states(self, scenarios, verbose=True):
+        """
+        Change the state of several scenarios in one pass. Only Locked, Unlocked and Blocked scenarios can be changed.
+        :param scenarios: dict mapping scenario numbers to their new state, e.g. {90: "Unlocked", 91: "Locked"}
+        :param verbose: print what happened to every scenario
+        :return: dict mapping each scenario number to {"old": state, "new": state}
+        """
+        unknown_states = set(scenarios.values()).difference(self.scenario_state_ids)
+        if unknown_states:
+            raise Exception(f"Unknown scenario state(s): {', '.join(sorted(str(s) for s in unknown_states))}")
+        current_states = self.get_scenario_states(list(scenarios))
+        scenario_table = self._get_scenario_table()
+        results = {}
+        for scenario, status in scenarios.items():
+            cur_state = current_states[scenario]
+            if cur_state in ("Locked", "Unlocked", "Blocked"):
+                offset = scenario_table[scenario]
+                new_scenario_state_str = struct.pack("<I", self.scenario_state_ids[status])
+                self._replace_substring_inplace(new_scenario_state_str, (offset, offset + 4))
+                results[scenario] = {"old": cur_state, "new": status}
+                if verbose:
+                    print(f"Scenario {scenario} was changed from {cur_state} to {status}.")
+            else:
+                results[scenario] = {"old": cur_state, "new": cur_state}
+                if verbose:
+                    print(f"Scenario {scenario} is currently {cur_state}.")
+                    print("I can't change the state of such a scenario.")
+        return results
+
+    @undoable
     def toggle_scenario_status(self, scenario=1, status=None):
-        if scenario == 19:
-            scenario_span = re.search(
-                b"\x12Quest_Campaign_" + bytes(f"{scenario:03d}", "utf-8") + b"(.*?\t.*?)\t", self.txt
-            ).span(1)
-        else:
-            scenario_span = re.search(
-                b"\x12Quest_Campaign_" +
-                bytes(f"{scenario:03d}", "utf-8") + b"(.*?)\t", self.txt
-            ).span(1)
-        current_scenario_state = struct.unpack(
-            "<I", self.txt[scenario_span[1] - 4: scenario_span[1]])[0]
         if status is not None:
-            if self.scenario_state_dict[current_scenario_state] in ("Locked", "Unlocked", "Blocked"):
-                new_scenario_state = list(self.scenario_state_dict.keys(
-                ))[list(self.scenario_state_dict.values()).index(status)]
-                if new_scenario_state is not None:
-                    new_scenario_state_str = struct.pack(
-                        "<I", new_scenario_state)
-                    scenario_state_span = (
-                        scenario_span[1] - 4, scenario_span[1])
-                    self.txt = self._replace_substring_inplace(
-                        self.txt, new_scenario_state_str, scenario_state_span)
-                    new_scenario_state = struct.unpack(
-                        "<I", self.txt[scenario_span[1] - 4: scenario_span[1]])[0]
-                    cur_state = self.scenario_state_dict[current_scenario_state]
-                    new_state = self.scenario_state_dict[new_scenario_state]
-                    print(
-                        f"Scenario {scenario} was changed from {cur_state} to {new_state}.")
-            else:
-                print(f"Scenario {scenario} is currently {self.scenario_state_dict[current_scenario_state]}.")
-                print("I can't change the state of such a scenario.")
+            self.set_scenario_states({scenario: status})
         else:
-            print(f"Scenario {scenario} is currently {self.scenario_state_dict[current_scenario_state]}.")
+            print(f"Scenario {scenario} is currently {self.get_scenario_states([scenario])[scenario]}.")
 
     def show_scenario_overview(self, verbose=False):
-        scenarios = [m for m in re.finditer(b"\x12Quest_Campaign_([0-9]{3})([\s\S]*?\x00\x00\x00)\t", self.txt)]
         overview = {
             "Completed": [],
             "InProgress": [],
@@ -322,16 +674,8 @@ class SaveGameEditor:
             "Blocked": [],
             "None": [],
         }
-        processed_scenarios = []
-        for scenario in scenarios:
-            scenario_nbr = int(scenario.group(1))
-            scenario_state = struct.unpack("<I", scenario.group(2)[-4:])[0]
-            if scenario_nbr in processed_scenarios:
-                # this scenario was already processed
-                pass
-            else:
-                overview[self.scenario_state_dict[scenario_state]].append(scenario_nbr)
-                processed_scenarios.append(scenario_nbr)
+        for scenario in self.get_scenarios().values():
+            overview[scenario.state].append(scenario.number)
 
         print("\nScenario Overview:")
         for k, v in overview.items():
@@ -339,15 +683,42 @@ class SaveGameEditor:
                 print(f"    {k}: {' '.join([str(s) for s in v])}")
 
     def show_campaign_info(self):
-        self.update_campaign_values()
+        values = self.get_campaign_values()
+        print(f"\nGold donated to the tree so far: {values.donated:,}")
+        print(f"Current prosperity: {values.prosperity}")
+        print(f"Current reputation: {values.reputation}")
 
-    def update_campaign_values(self, donated=None, prosperity=None, reputation=None):
+    def get_campaign_values(self):
+        """:return: the gold donated to the tree, the prosperity and the reputation as `snapshot.CampaignValues`"""
+        spans = self._get_campaign_value_spans()
+        return CampaignValues(
+            **{field: struct.unpack("<I", self.buffer.read(*span))[0] for field, span in spans.items()}
+        )
+
+    def _get_campaign_value_spans(self):
+        """
+        :return: dict with the spans of the gold donated to the tree, the prosperity and the reputation
+        """
         donated_span = re.search(b"GoldDonated", self.txt).span()
-        donated_gold_span = (donated_span[1] + 6, donated_span[1] + 10)
-        current_gold_donated = struct.unpack("<I", self.txt[donated_gold_span[0] : donated_gold_span[1]])[0]
+        campaign_span = re.search(rb"MapRuleLibrary\.Party\.CMapCharacter.*?\t(.*?)\t", self.txt).span(1)
+        return {
+            "donated": (donated_span[1] + 6, donated_span[1] + 10),
+            "prosperity": (campaign_span[0] + 4, campaign_span[0] + 8),
+            "reputation": (campaign_span[0] + 8, campaign_span[1]),
+        }
+
+    @undoable
+    def update_campaign_values(self, donated=None, prosperity=None, reputation=None):
+        if donated is None and prosperity is None and reputation is None:
+            self.show_campaign_info()
+            return
+        campaign_value_spans = self._get_campaign_value_spans()
+        current = self.get_campaign_values()
+        donated_gold_span = campaign_value_spans["donated"]
+        current_gold_donated = current.donated
         if donated is not None:
             new_gold_donated_str = struct.pack("<I", donated)
-            self.txt = self._replace_substring_inplace(self.txt, new_gold_donated_str, donated_gold_span)
+            self._replace_substring_inplace(new_gold_donated_str, donated_gold_span)
             print(
                 f"The total gold donated to the tree was updated from {current_gold_donated:,}"
                 f" gold to {donated} gold."
@@ -355,106 +726,99 @@ class SaveGameEditor:
         else:
             print(f"\nGold donated to the tree so far: {current_gold_donated:,}")
 
-        campaign_span = list(re.finditer(b"MapRuleLibrary\.Party\.CMapCharacter.*?\\t(.*?)\\t", self.txt))[0].span(1)
-        prosperity_span = (campaign_span[0] + 4, campaign_span[0] + 8)
-        current_prosperity = struct.unpack("<I", self.txt[prosperity_span[0] : prosperity_span[1]])[0]
+        prosperity_span = campaign_value_spans["prosperity"]
+        current_prosperity = current.prosperity
         if prosperity is not None:
             new_prosperity_str = struct.pack("<I", prosperity)
-            self.txt = self._replace_substring_inplace(self.txt, new_prosperity_str, prosperity_span)
+            self._replace_substring_inplace(new_prosperity_str, prosperity_span)
             print(f"Prosperity was updated from {current_prosperity} to {prosperity}.")
         else:
             print(f"Current prosperity: {current_prosperity}")
 
-        reputation_span = (campaign_span[0] + 8, campaign_span[1])
-        current_reputation = struct.unpack("<I", self.txt[reputation_span[0] : reputation_span[1]])[0]
+        reputation_span = campaign_value_spans["reputation"]
+        current_reputation = current.reputation
         if reputation is not None:
             new_reputation_str = struct.pack("<I", reputation)
-            self.txt = self._replace_substring_inplace(self.txt, new_reputation_str, reputation_span)
+            self._replace_substring_inplace(new_reputation_str, reputation_span)
             print(f"Reputation was updated from {current_reputation} to {reputation}.")
         else:
             print(f"Current reputation: {current_reputation}")
 
-    def _dat_to_json(self):
-        try:
-            import netfleece
-        except ModuleNotFoundError:
-            raise Exception(
-                "You need to install the netfleece package with `pip install netfleece` to use this method."
-            )
-        except Exception:
-            raise Exception(
-                "A required package (netfleece) could not be imported.\nThis package unfortunately doesn't "
-                "work in Python 3.9 and above.\nPlease try again in a Python 3.8 environment!"
-            )
-        with open(self.file, "rb") as infile:
-            self.json = netfleece.parseloop(infile)
+    def _index_savegame(self):
+        """
+        Walk the savegame once and keep the offset table of its records (type, ObjectId, byte span and member layout),
+        together with an ObjectId index and a member name index over them
+        """
+        self._index = RecordIndex(self.txt)
+
+    @property
+    def index(self):
+        self._sync_index()
+        return self._index
+
+    def _sync_index(self):
+        """Build the record index, or bring it in step with the edits made since it was last used"""
+        changes = self.buffer.take_changes()
+        if self._index is None:
+            self._index_savegame()
+        elif changes is not None:
+            self._index.update(self.buffer.getvalue(), *changes)
+
+    def get_personal_quest_deck(self):
+        """:return: the personal quest deck as a `snapshot.Deck`, with the quests in the order they will be drawn"""
+        quests_dict, _, _ = self._read_personal_quest_deck()
+        return Deck("personal quests", [quest.decode("utf-8") for quest in quests_dict])
 
     def show_personal_quests(self):
-        self.prioritise_personal_quests()
+        print("\nCurrent personal quest deck order:")
+        for quest in self.get_personal_quest_deck().cards:
+            print(f"    {quest}")
 
+    @undoable
     def remove_personal_quests(self, quests_to_remove=None):
         if quests_to_remove is None:
             self.show_personal_quests()
             return
-        quests_dict, pq_deck_obj_str, pq_deck_span, pq_deck_str = self._read_personal_quest_deck()
+        quests_dict, pq_list, pq_deck = self._read_personal_quest_deck()
         quests_to_remove_bytes = [str.encode(s) for s in quests_to_remove]
         for quest in quests_to_remove_bytes:
             if quest in quests_dict.keys():
                 quests_dict.pop(quest)
             else:
                 print(f"Quest {quest.decode('utf-8')} was not found in the quest deck!")
-        self._recreate_personal_quest_deck(quests_dict, pq_deck_obj_str, pq_deck_span)
+        self._recreate_personal_quest_deck(quests_dict, pq_list, pq_deck)
 
     def _read_personal_quest_deck(self):
-        pq_deck_path = self._get_paths_to_value(self.json, "PersonalQuestDeck")[0]
-        pq_deck_idref1 = self.json[pq_deck_path[0]][pq_deck_path[1]]["Values"][pq_deck_path[4]]["IdRef"]
-        pq_deck_idref2 = self._get_obj_value(self.json, pq_deck_idref1)["Values"][0]["IdRef"]
-        pq_deck_objectid = self._get_obj_value(self.json, pq_deck_idref2)["Values"][0]["IdRef"]
-        pq_deck_recordtype = self.recordtype_enum[self._get_obj_value(self.json, pq_deck_objectid)["RecordTypeEnum"]]
-        pq_deck_obj_str = pq_deck_recordtype.to_bytes(1, "little") + struct.pack("<I", pq_deck_objectid)
-        pq_deck_span = re.search(pq_deck_obj_str + b".{4}(\x06.{5}[A-Za-z_]*)*(\\n|\\r.)?", self.txt).span()
-        pq_deck_str = self.txt[pq_deck_span[0] : pq_deck_span[1]]
-        quests = list(re.finditer(b"(\x06.{4}.(PERSONALQUEST|PersonalQuest).*?)(?=\x06|$|\\n|\\r)", pq_deck_str))
+        """
+        :return: dict mapping the name of every personal quest in the deck (without its prefix) to its element in the
+            deck array, the List record of the deck and the deck array record
+        """
+        pq_list = self.query("PersonalQuestDeck/0")[0]
+        pq_deck = self.index.resolve(pq_list.member("_items"))
         quests_dict = {
-            quest.group()[20:]: {
-                "object_id": quest.group()[1:5],
-                "length": len(quest.group()[6:]),
-                "quest_str": quest.group()[6:],
-            }
-            for quest in quests
+            self._resolve(quest).value.encode("utf-8")[14:]: quest
+            for quest in pq_deck.values
+            if self._is_string(quest, "PERSONALQUEST") or self._is_string(quest, "PersonalQuest")
         }
-        return quests_dict, pq_deck_obj_str, pq_deck_span, pq_deck_str
-
-    def _recreate_personal_quest_deck(self, quests_dict, pq_deck_obj_str, pq_deck_span):
-        deck_length = 25
-        new_pq_deck_str = pq_deck_obj_str + struct.pack("<I", deck_length)
-        for quest, quest_info in quests_dict.items():
-            new_pq_deck_str += (
-                b"\x06" + quest_info["object_id"] + quest_info["length"].to_bytes(1, "little") + quest_info["quest_str"]
-            )
-        nulls_to_add = deck_length - len(quests_dict)
-        if nulls_to_add < 0:
+        return quests_dict, pq_list, pq_deck
+
+    def _recreate_personal_quest_deck(self, quests_dict, pq_list, pq_deck):
+        deck_length = len(pq_deck.values)
+        if len(quests_dict) > deck_length:
             raise Exception("There are more quests in the deck than allowed!")
-        elif nulls_to_add == 0:
-            pass
-        elif nulls_to_add == 1:
-            new_pq_deck_str += self.recordtype_enum["ObjectNull"].to_bytes(1, "little")
-        elif nulls_to_add > 1:
-            new_pq_deck_str += self.recordtype_enum["ObjectNullMultiple256"].to_bytes(
-                1, "little"
-            ) + nulls_to_add.to_bytes(1, "little")
-        self.txt = self._replace_substring_inplace(self.txt, new_pq_deck_str, pq_deck_span)
+        self._apply_patches(
+            self._build_array_patches(pq_deck, list(quests_dict.values()), deck_length, "personal quest deck", pq_list)
+        )
         print("New personal quest deck order:")
         for quest in quests_dict:
             print(f"    {quest.decode('utf-8')}")
 
+    @undoable
     def prioritise_personal_quests(self, prioritize=None):
-        quests_dict, pq_deck_obj_str, pq_deck_span, pq_deck_str = self._read_personal_quest_deck()
         if prioritize is None:
-            print("\nCurrent personal quest deck order:")
-            for quest, _ in quests_dict.items():
-                print(f"    {quest.decode('utf-8')}")
+            self.show_personal_quests()
             return
+        quests_dict, pq_list, pq_deck = self._read_personal_quest_deck()
 
         prioritize_bytes = [str.encode(s) for s in prioritize]
         current_order = list(quests_dict.keys())
@@ -468,95 +832,195 @@ class SaveGameEditor:
             new_order.append(quest)
         new_order.extend(current_order)
         quests_dict = {quest: quests_dict[quest] for quest in new_order}
-        self._recreate_personal_quest_deck(quests_dict, pq_deck_obj_str, pq_deck_span)
+        self._recreate_personal_quest_deck(quests_dict, pq_list, pq_deck)
 
     def _read_chest_deck(self):
-        self._get_paths_to_value(self.json, "AlreadyRewardedChestTreasureTableIDs")
-        chests_path = self._get_paths_to_value(self.json, "AlreadyRewardedChestTreasureTableIDs")[0]
-        chests_idref = self.json[chests_path[0]][chests_path[1]]["Values"][chests_path[4]]["IdRef"]
-        chests_objectid = self._get_obj_value(self.json, chests_idref)["Values"][0]["IdRef"]
-        chests_recordtype = self.recordtype_enum[self._get_obj_value(self.json, chests_objectid)["RecordTypeEnum"]]
-        chests_obj_str = chests_recordtype.to_bytes(1, "little") + struct.pack("<I", chests_objectid)
-        chests_span = re.search(chests_obj_str + b".{4}(\x06.{5}[A-Za-z_0-9]*)*(\\n|\\r.)?", self.txt).span()
-        chests_deck_str = self.txt[chests_span[0]: chests_span[1]]
-        chests_looted = list(re.finditer(b"\x06(.{4}).TT_Campaign_Chest_([0-9]{2})(?=\x06|$|\\n|\\r)", chests_deck_str))
-        chests_dict = {int(chest.group(2)): chest.group(1) for chest in chests_looted}
-        return chests_dict, chests_obj_str, chests_span, chests_deck_str
+        """
+        :return: dict mapping the number of every looted chest to its element in the chest array, the List record of
+            the looted chests and the chest array record
+        """
+        chests_list = self.query("AlreadyRewardedChestTreasureTableIDs")[0]
+        chests = self.index.resolve(chests_list.member("_items"))
+        chests_dict = {}
+        for chest in chests.values:
+            if self._is_string(chest):
+                chest_match = re.fullmatch("TT_Campaign_Chest_([0-9]{2})", self._resolve(chest).value)
+                if chest_match:
+                    chests_dict[int(chest_match.group(1))] = chest
+        return chests_dict, chests_list, chests
+
+    def get_looted_chests(self):
+        """:return: the numbers of the looted chests, in the order they are stored in the savegame"""
+        return list(self._read_chest_deck()[0])
 
     def show_looted_chests(self):
-        chests_dict, chests_obj_str, chests_span, chests_deck_str = self._read_chest_deck()
-        looted_chests = [int(chest) for chest in list(chests_dict.keys())]
-        print(f"\nLooted chests: {' '.join([str(c) for c in looted_chests])}")
+        print(f"\nLooted chests: {' '.join(str(chest) for chest in self.get_looted_chests())}")
 
+    @undoable
     def toggle_chests(self, looted=None):
-        chests_dict, chests_obj_str, chests_span, chests_deck_str = self._read_chest_deck()
-        current_looted_chests = [int(chest) for chest in list(chests_dict.keys())]
-        first_chest_object_id = 3000000 # struct.unpack("<I", chests_dict[current_looted_chests[0]])[0]
-        new_looted_chests = sorted(set(current_looted_chests).union(set(looted)))
-        chests_to_be_looted = sorted(set(new_looted_chests).difference(set(current_looted_chests)))
+        patches, chests_to_be_looted = self._build_chests_patch(looted)
         print(f"The following chests will now be set to 'looted': {' '.join(str(c) for c in chests_to_be_looted)}")
-        chest_deck_length = self._next_power_of_2(len(new_looted_chests))
-        new_chests_deck_str = chests_obj_str + struct.pack("<I", chest_deck_length)
-        chest_str_length = 20
-        for i, chest in enumerate(new_looted_chests):
-            new_chests_deck_str += b"\x06" + struct.pack("<I", first_chest_object_id + i)
-            new_chests_deck_str += chest_str_length.to_bytes(1, "little")
-            new_chests_deck_str += b"TT_Campaign_Chest_" + bytes(str(chest).zfill(2), "utf-8")
-        nulls_to_add = chest_deck_length - len(new_looted_chests)
-        if nulls_to_add < 0:
-            raise Exception("There are more quests in the deck than allowed!")
-        elif nulls_to_add == 0:
-            pass
-        elif nulls_to_add == 1:
-            new_chests_deck_str += self.recordtype_enum["ObjectNull"].to_bytes(1, "little")
-        elif nulls_to_add > 1:
-            new_chests_deck_str += self.recordtype_enum["ObjectNullMultiple256"].to_bytes(
-                1, "little"
-            ) + nulls_to_add.to_bytes(1, "little")
-        self.txt = self._replace_substring_inplace(self.txt, new_chests_deck_str, chests_span)
+        self._apply_patches(patches)
         self.show_looted_chests()
 
-    def _breadcrumb_finder(self, json_dict_or_list, value, path, result):
-        """
-        This recursive function is able to parse through a nested JSON dictionary or list to find all occurences of
-        a given value and return their "paths" in the JSON object
-        See https://stackoverflow.com/a/69537980/3112000
-        :param json_dict_or_list: JSON dict or list to parse through
-        :param value: value that we're looking for
-        :param path: current path that we're looking at
-        :param result: list of all the paths found so far
-        :return: nothing as the results list is edited in-place
-        """
-        if json_dict_or_list == value:
-            path.append(json_dict_or_list)
-            result.append(path.copy())
-            path.pop()
-        elif isinstance(json_dict_or_list, dict):
-            for k, v in json_dict_or_list.items():
-                path.append(k)
-                self._breadcrumb_finder(v, value, path, result)
-                path.pop()
-
-        elif isinstance(json_dict_or_list, list):
-            lst = json_dict_or_list
-            for i in range(len(lst)):
-                path.append(i)
-                self._breadcrumb_finder(lst[i], value, path, result)
-                path.pop()
-
-    def _get_paths_to_value(self, data, value):
-        results = []
-        self._breadcrumb_finder(data, value, [], results)
-        return results
+    def _build_chests_patch(self, looted):
+        """
+        Build the patches that add chests to the looted chests. The chests that were already looted keep their string
+        record; the others get a fresh ObjectId.
+        :return: list of (span, new bytes, part) patches and the chests that will be looted
+        """
+        chests_dict, chests_list, chests = self._read_chest_deck()
+        new_looted_chests = sorted(set(chests_dict).union(set(looted)))
+        chests_to_be_looted = sorted(set(new_looted_chests).difference(set(chests_dict)))
+        elements = [
+            chests_dict[chest] if chest in chests_dict else self._new_string(f"TT_Campaign_Chest_{str(chest).zfill(2)}")
+            for chest in new_looted_chests
+        ]
+        chest_deck_length = self._next_power_of_2(len(new_looted_chests))
+        patches = self._build_array_patches(chests, elements, chest_deck_length, "looted chests", chests_list)
+        return patches, chests_to_be_looted
 
-    def _get_paths_to_key_value(self, data, key, value):
-        results = []
-        self._breadcrumb_finder(data, value, [], results)
-        return [r for r in results if r[-2:] == [key, value]]
+    def _plan_patch(self, plan, span, new, description):
+        if self.buffer.read(*span) != new:
+            plan.append({"span": span, "new": new, "description": description})
+
+    def plan_manifest(self, manifest):
+        """
+        Resolve every edit in a sync manifest to a patch on the savegame, without changing anything yet.
+        The manifest uses the campaign.json schema of main.py; every key is optional:
+        GoldDonations, Prosperity, Reputation, CityEvents, RoadEvents, LootedChests,
+        Characters ([{Name, Gold, Experience, PerkPoints, PerkChecks}]) and Scenarios ([{Id, Status}]).
+        :param manifest: the manifest as a dict
+        :return: list of patches ordered by offset. Every patch is a dict with the "span" it replaces, the "new" bytes
+            and a "description". Edits that wouldn't change anything are left out.
+        """
+        plan = []
+        campaign_value_spans = self._get_campaign_value_spans()
+        for key, field, name in (
+            ("GoldDonations", "donated", "Gold donated"),
+            ("Prosperity", "prosperity", "Prosperity"),
+            ("Reputation", "reputation", "Reputation"),
+        ):
+            if manifest.get(key) is not None:
+                span = campaign_value_spans[field]
+                current = struct.unpack("<I", self.buffer.read(*span))[0]
+                self._plan_patch(plan, span, struct.pack("<I", manifest[key]), f"{name}: {current} -> {manifest[key]}")
+
+        for key, event in (("CityEvents", "city"), ("RoadEvents", "road")):
+            if manifest.get(key):
+                description = f"{event.capitalize()} event deck: {' '.join(str(e) for e in manifest[key])}"
+                for span, new, part in self._build_events_patch(event, manifest[key]):
+                    self._plan_patch(plan, span, new, f"{description} ({part})")
+
+        if manifest.get("LootedChests"):
+            patches, chests_to_be_looted = self._build_chests_patch(manifest["LootedChests"])
+            if chests_to_be_looted:
+                description = f"Looted chests: add {' '.join(str(c) for c in chests_to_be_looted)}"
+                for span, new, part in patches:
+                    self._plan_patch(plan, span, new, f"{description} ({part})")
+
+        characters = {
+            character["Name"]: {
+                "gold": character.get("Gold"),
+                "exp": character.get("Experience"),
+                "perk_points": character.get("PerkPoints"),
+                "perk_checks": character.get("PerkChecks"),
+            }
+            for character in manifest.get("Characters", [])
+        }
+        roster = self._get_roster_entries(characters)
+        current_characters = self.get_characters(list(characters))
+        for char, values in characters.items():
+            for field, value in values.items():
+                if value is not None:
+                    description = f"{char} {field}: {current_characters[char][field]} -> {value}"
+                    self._plan_patch(plan, roster[char][field], struct.pack("<I", value), description)
+
+        scenarios = {scenario["Id"]: scenario["Status"] for scenario in manifest.get("Scenarios", [])}
+        unknown_states = set(scenarios.values()).difference(self.scenario_state_ids)
+        if unknown_states:
+            raise Exception(f"Unknown scenario state(s): {', '.join(sorted(str(s) for s in unknown_states))}")
+        current_states = self.get_scenario_states(list(scenarios))
+        scenario_table = self._get_scenario_table()
+        for scenario, status in scenarios.items():
+            if current_states[scenario] in ("Locked", "Unlocked", "Blocked"):
+                offset = scenario_table[scenario]
+                new_scenario_state_str = struct.pack("<I", self.scenario_state_ids[status])
+                description = f"Scenario {scenario}: {current_states[scenario]} -> {status}"
+                self._plan_patch(plan, (offset, offset + 4), new_scenario_state_str, description)
+
+        plan.sort(key=lambda patch: patch["span"])
+        for previous, patch in zip(plan, plan[1:]):
+            if patch["span"][0] < previous["span"][1]:
+                raise Exception(f"'{previous['description']}' and '{patch['description']}' overlap!")
+        return plan
+
+    @staticmethod
+    def show_manifest_plan(plan):
+        print(f"\n{len(plan)} change(s) to make:")
+        for patch in plan:
+            start, end = patch["span"]
+            sizes = f"{end - start:>5} -> {len(patch['new']):>5} bytes"
+            print(f"    [{start:>8}, {end:>8}) {sizes}  {patch['description']}")
+
+    @undoable
+    def apply_manifest(self, manifest, dry_run=False, verbose=True):
+        """
+        Sync the savegame with a manifest in one go: all edits are resolved against the savegame as it is now, applied
+        back to front so that earlier offsets stay valid, and saved with a single write.
+        :param manifest: the manifest as a dict, see `plan_manifest` for its schema
+        :param dry_run: only show the plan, without changing or saving the savegame
+        :param verbose: show the plan
+        :return: the plan, see `plan_manifest`
+        """
+        plan = self.plan_manifest(manifest)
+        if verbose or dry_run:
+            self.show_manifest_plan(plan)
+        if dry_run:
+            return plan
+        self.apply_plan(plan)
+        self.save_savegame()
+        return plan
+
+    @undoable
+    def apply_plan(self, plan):
+        """
+        Apply the patches of a plan back to front, so that earlier offsets stay valid. The savegame isn't saved.
+        :param plan: plan from `plan_manifest`, made for the savegame as it is now
+        """
+        for patch in reversed(plan):
+            self._replace_substring_inplace(patch["new"], patch["span"])
+
+    @undoable
+    def rewrite_savegame(self):
+        """
+        Serialize all records of `index` back into the savegame in one pass, after they were edited in memory, e.g.
+        by changing the `values` of a record or dropping elements from an array. New records need an ObjectId from
+        `index.new_object_id()`.
+        """
+        index = self.index
+        data = bytes(write_records(index.records, index.reader.libraries))
+        self._replace_substring_inplace(data, (0, len(self.buffer)))
+        self._invalidate_caches(index=True)
+
+    def query(self, path):
+        """
+        Find values in the savegame by a path of member names, following references on the way, e.g.
+        `editor.query("PersonalQuestDeck/*/Values")` for the personal quests in the deck. See `RecordIndex.query`.
+        :return: list of the values the path leads to
+        """
+        return self.index.query(path)
+
+    def _get_paths_to_member(self, member_name):
+        """
+        Find all class records that have a member with the given name
+        :param member_name: name of the member to look for, e.g. "PersonalQuestDeck"
+        :return: list of (record, member index) tuples
+        """
+        return self.index.member_paths(member_name)
 
-    def _get_obj_value(self, data, objectid):
-        path = self._get_paths_to_key_value(data, "ObjectId", objectid)[0]
-        return data[path[0]][path[1]]
+    def _get_obj_value(self, objectid):
+        return self.index.objects[objectid]
 
     # TODO:
     # * method to change character's name
@@ -0,0 +1,72 @@
+"""
+Typed views of the state of a campaign, returned by the `get_*` methods and `snapshot` of SaveGameEditor.
+
+They are plain values read out of the savegame: nothing is printed, and changing them doesn't change the savegame.
+`CampaignSnapshot.to_dict` turns a snapshot into JSON-serializable dicts and lists, e.g. for batch jobs and services.
+"""
+from __future__ import annotations
+
+import dataclasses
+from dataclasses import dataclass
+
+
+@dataclass
+class CampaignValues:
+    donated: int
+    prosperity: int
+    reputation: int
+
+
+@dataclass
+class Character:
+    name: str
+    gold: int
+    exp: int
+    level: int
+    perk_points: int
+    perk_checks: int
+
+    def values(self):
+        """:return: dict with the gold, exp, level, perk_points and perk_checks, like `SaveGameEditor.get_characters`"""
+        return {field.name: getattr(self, field.name) for field in dataclasses.fields(self) if field.name != "name"}
+
+
+@dataclass
+class Scenario:
+    number: int
+    state: str
+
+
+@dataclass
+class Deck:
+    """A deck of cards in the order they will be drawn, e.g. the city events ["18", "03", ...]"""
+
+    name: str
+    cards: list[str]
+
+
+@dataclass
+class CampaignSnapshot:
+    values: CampaignValues
+    characters: dict[str, Character]
+    scenarios: dict[int, Scenario]
+    city_events: Deck
+    road_events: Deck
+    personal_quests: Deck
+    looted_chests: list[int]
+
+    def to_dict(self):
+        """
+        :return: dict with the "donated", "prosperity" and "reputation", the "characters" (name -> values), the
+            "scenarios" (number -> state), the cards of the "city_events", "road_events" and "personal_quests" decks,
+            and the "looted_chests"
+        """
+        return {
+            **dataclasses.asdict(self.values),
+            "characters": {name: character.values() for name, character in self.characters.items()},
+            "scenarios": {number: scenario.state for number, scenario in self.scenarios.items()},
+            "city_events": list(self.city_events.cards),
+            "road_events": list(self.road_events.cards),
+            "personal_quests": list(self.personal_quests.cards),
+            "looted_chests": list(self.looted_chests),
+        }
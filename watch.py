@@ -0,0 +1,219 @@
+"""
+Watch a campaign's savegame and re-apply a sync manifest every time the game saves it.
+
+    python watch.py campaign.json --root-dir "<...>/GloomSaves/Campaign" --campaign <campaign folder>
+
+The savegame is parsed once and kept open. When the game writes it, the watcher waits until the writes have settled
+(--debounce seconds without a new one), splices the region that differs from the previous version into the open
+savegame and re-applies the manifest, so only the records in that region are read again. The editor's own save shows
+up as one more change, which is recognised because the file is then identical to what the editor holds.
+
+Changes are picked up with inotify on Linux, and by polling the size and modification time of the savegame elsewhere
+(or with --poll).
+"""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import time
+import traceback
+
+from savegame_editor import SaveGameEditor
+
+
+class InotifyWatcher:
+    """Waits for the savegame to be written or replaced, using inotify on its folder."""
+
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    _event_header = struct.Struct("iIII")
+
+    def __init__(self, file):
+        folder, self.name = os.path.split(os.path.abspath(file))
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Watch the folder rather than the file, so that a savegame that is replaced by a rename is still seen
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {folder}")
+        self.name = os.fsencode(self.name)
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: seconds to wait at most, or None to wait until the savegame changes
+        :return: True if the savegame changed, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                return False
+            data = os.read(self.fd, 64 * 1024)
+            changed = False
+            pos = 0
+            while pos < len(data):
+                _, _, _, length = self._event_header.unpack_from(data, pos)
+                pos += self._event_header.size
+                changed |= data[pos:pos + length].rstrip(b"\0") == self.name
+                pos += length
+            if changed:
+                return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Waits for the savegame to be written or replaced, by polling its size and modification time."""
+
+    def __init__(self, file, interval=1.0):
+        self.file = file
+        self.interval = interval
+        self._stat = self._get_stat()
+
+    def _get_stat(self):
+        try:
+            stat = os.stat(self.file)
+        except FileNotFoundError:
+            # In the middle of being replaced
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: seconds to wait at most, or None to wait until the savegame changes
+        :return: True if the savegame changed, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stat = self._get_stat()
+            if stat != self._stat:
+                self._stat = stat
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.interval if deadline is None else min(self.interval, max(deadline - time.monotonic(), 0)))
+
+    def close(self):
+        pass
+
+
+def make_watcher(file, poll=False, poll_interval=1.0):
+    """:return: an InotifyWatcher where inotify is available (and `poll` is False), else a PollingWatcher"""
+    if not poll:
+        try:
+            return InotifyWatcher(file)
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(file, interval=poll_interval)
+
+
+class ManifestWatcher:
+    """Keeps a campaign open and syncs it with a manifest after every save of the game."""
+
+    def __init__(self, editor, manifest, debounce=2.0, poll=False, poll_interval=1.0):
+        """
+        :param editor: the SaveGameEditor of the campaign to watch
+        :param manifest: the manifest as a dict, see `SaveGameEditor.plan_manifest` for its schema
+        :param debounce: seconds without a write after which a save of the game is considered complete
+        :param poll: poll the savegame instead of using inotify
+        :param poll_interval: seconds between two polls
+        """
+        self.editor = editor
+        self.manifest = manifest
+        self.debounce = debounce
+        self.watcher = make_watcher(editor.file, poll=poll, poll_interval=poll_interval)
+        self.syncs = 0
+        self._failed = False
+
+    def sync(self):
+        """
+        Bring the open savegame up to date with the file and re-apply the manifest.
+        :return: the applied plan, see `SaveGameEditor.plan_manifest`, or None if the savegame didn't change
+        """
+        self.syncs += 1
+        if self._failed:
+            # The open savegame may be half updated, so parse it from scratch
+            editor = self.editor
+            self.editor = SaveGameEditor(
+                root_dir=editor.root_dir, campaign=editor.campaign, backup_store=editor.backup_store
+            )
+            self._failed = False
+        else:
+            region = self.editor.reload_savegame()
+            if region is None and self.syncs > 1:
+                return None
+            if region is not None:
+                start, old_end, new_end = region
+                print(f"{time.strftime('%H:%M:%S')} Savegame changed in [{start}, {old_end}) -> [{start}, {new_end})")
+        plan = self.editor.plan_manifest(self.manifest)
+        if not plan:
+            print(f"{time.strftime('%H:%M:%S')} Savegame is in sync with the manifest")
+            return plan
+        # The game's save is about to be changed, so keep it (a backup of an identical save is skipped)
+        self.editor.backup()
+        self.editor.show_manifest_plan(plan)
+        self.editor.apply_plan(plan)
+        self.editor.save_savegame()
+        return plan
+
+    def run(self, max_syncs=None):
+        """
+        Sync once, then every time the game saves, until interrupted.
+        :param max_syncs: stop after this many syncs
+        """
+        try:
+            while True:
+                try:
+                    self.sync()
+                except Exception:
+                    # E.g. a savegame that was read while the game was still writing it
+                    traceback.print_exc()
+                    print("Couldn't sync the savegame, trying again after the next save")
+                    self._failed = True
+                if max_syncs is not None and self.syncs >= max_syncs:
+                    break
+                self.watcher.wait()
+                while self.watcher.wait(self.debounce):
+                    pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.watcher.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-apply a campaign manifest every time the game saves.")
+    parser.add_argument("manifest", nargs="?", default="campaign.json", help="path to the campaign.json manifest")
+    parser.add_argument("--root-dir", default="./", help="folder that contains the campaign folders")
+    parser.add_argument("--campaign", default="Campaign_Bangbang_We're_Dead_1054108285", help="name of the campaign")
+    parser.add_argument("--debounce", type=float, default=2.0, help="seconds to wait for the game to finish writing")
+    parser.add_argument("--poll", action="store_true", help="poll the savegame instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between two polls")
+    args = parser.parse_args(argv)
+
+    with open(args.manifest) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    editor = SaveGameEditor(root_dir=args.root_dir, campaign=args.campaign)
+    watcher = ManifestWatcher(
+        editor, manifest, debounce=args.debounce, poll=args.poll, poll_interval=args.poll_interval
+    )
+    print(f"Watching {editor.file} ({type(watcher.watcher).__name__}), press Ctrl+C to stop")
+    watcher.run()
+
+
+if __name__ == "__main__":
+    main()